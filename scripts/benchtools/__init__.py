@@ -0,0 +1,6 @@
+"""Shared tooling for the terraform setups and benchmark runs in this repo.
+
+Each module is importable and also runnable as a CLI, e.g.:
+
+    PYTHONPATH=scripts python3 -m benchtools.prepare_ips --dir terraform/<setup>
+"""
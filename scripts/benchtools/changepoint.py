@@ -0,0 +1,370 @@
+"""Detect performance regressions over the history of the results store.
+
+Every (setup, instance type, test) is a time series with one point per
+ingest, the median of its runs, so the run to run noise is left out. The
+series is split by E-divisive means: the split maximizing the energy
+distance between the points before and after it is kept when a permutation
+test finds it significant, and each side is split again until nothing
+significant is left. A change point is reported as a regression or an
+improvement when the means around it differ by more than --min-change, with
+the git shas of the last point before and the first point after it.
+
+What was found is kept in the store, so a run only re-analyzes the series
+that got new points since the previous one and tells apart the new change
+points.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+from benchtools import memtier, store
+
+STATE = "changepoints.json"
+DEFAULT_METRICS = ("ops_sec", "p99_ms")
+DEFAULT_PVALUE = 0.05
+DEFAULT_PERMUTATIONS = 199
+DEFAULT_MIN_SIZE = 3
+# changes smaller than this, relative to the mean before, are noise
+DEFAULT_MIN_CHANGE = 0.03
+FIELDS = [
+    "setup",
+    "instance_type",
+    "test",
+    "metric",
+    "kind",
+    "change",
+    "before",
+    "after",
+    "pvalue",
+    "sha_before",
+    "sha_after",
+    "timestamp",
+    "new",
+]
+
+
+def block_sums(distances):
+    # table of 2-D prefix sums, the sum of distances[a:b, c:d] in 4 lookups
+    sums = np.zeros((len(distances) + 1, len(distances) + 1))
+    sums[1:, 1:] = distances.cumsum(axis=0).cumsum(axis=1)
+    return sums
+
+
+def energy(values, min_size):
+    """Return (split, statistic) of the best split of values, or (None, 0).
+
+    The statistic is the E-divisive q of Matteson and James (alpha 1) for the
+    points before split against the points from split on.
+    """
+    n = len(values)
+    # one point alone has no distance within
+    min_size = max(min_size, 2)
+    splits = np.arange(min_size, n - min_size + 1)
+    if len(splits) == 0:
+        return None, 0.0
+    sums = block_sums(np.abs(values[:, None] - values[None, :]))
+    left, right = splits, n - splits
+    between = sums[splits, n] - sums[splits, splits]
+    within_left = sums[splits, splits]
+    within_right = sums[n, n] - sums[splits, n] - sums[n, splits] + sums[splits, splits]
+    statistic = (
+        2 * between / (left * right)
+        - within_left / (left * (left - 1))
+        - within_right / (right * (right - 1))
+    ) * (left * right / n)
+    best = int(np.argmax(statistic))
+    return int(splits[best]), float(statistic[best])
+
+
+def significance(values, statistic, min_size, permutations, rng):
+    """Return the permutation test p-value of the best split of values."""
+    hits = 0
+    for _ in range(permutations):
+        if energy(rng.permutation(values), min_size)[1] >= statistic:
+            hits += 1
+    return (hits + 1) / (permutations + 1)
+
+
+def e_divisive(
+    values,
+    pvalue=DEFAULT_PVALUE,
+    permutations=DEFAULT_PERMUTATIONS,
+    min_size=DEFAULT_MIN_SIZE,
+    seed=0,
+):
+    """Return the sorted [(index, pvalue)] of the change points of values.
+
+    index is the first point after the change.
+    """
+    values = np.asarray(values, dtype=float)
+    rng = np.random.default_rng(seed)
+    bounds = [0, len(values)]
+    found = []
+    while True:
+        best = None
+        for start, end in zip(bounds, bounds[1:]):
+            split, statistic = energy(values[start:end], min_size)
+            if split is not None and (best is None or statistic > best[3]):
+                best = (start, end, split, statistic)
+        if best is None or best[3] <= 0:
+            break
+        start, end, split, statistic = best
+        p = significance(values[start:end], statistic, min_size, permutations, rng)
+        if p > pvalue:
+            break
+        found.append((start + split, p))
+        bounds = sorted(bounds + [start + split])
+    return sorted(found)
+
+
+def history(store_dir, metrics, **patterns):
+    """Return {(setup, instance_type, test): [point, ...]} sorted by time.
+
+    A point is a dict with the timestamp, git_sha and, per metric, the median
+    of the runs of one ingest.
+    """
+    table = store.query(store_dir, metrics, **patterns)
+    groups = {}
+    for i in range(len(table["run"])):
+        key = (table["setup"][i], table["instance_type"][i], table["test"][i])
+        point = (int(table["timestamp"][i]), table["git_sha"][i])
+        runs = groups.setdefault(key, {}).setdefault(point, {m: [] for m in metrics})
+        for name in metrics:
+            runs[name].append(table[name][i])
+    series = {}
+    for key, points in groups.items():
+        series[key] = []
+        for (timestamp, git_sha), runs in sorted(points.items()):
+            point = {"timestamp": timestamp, "git_sha": git_sha}
+            for name, values in runs.items():
+                values = [v for v in values if not np.isnan(v)]
+                point[name] = float(np.median(values)) if values else np.nan
+            series[key].append(point)
+    return series
+
+
+def changes(points, name, pvalue, permutations, min_size, min_change):
+    """Return the change points of the metric name over points, as dicts."""
+    points = [point for point in points if not np.isnan(point[name])]
+    values = np.array([point[name] for point in points])
+    found = e_divisive(values, pvalue, permutations, min_size)
+    bounds = [0] + [index for index, _ in found] + [len(values)]
+    result = []
+    for (index, p), start, end in zip(found, bounds, bounds[2:]):
+        before = float(values[start:index].mean())
+        after = float(values[index:end].mean())
+        change = (after - before) / before if before else np.inf
+        if abs(change) < min_change:
+            continue
+        better = change > 0 if name in memtier.HIGHER_IS_BETTER else change < 0
+        result.append(
+            {
+                "kind": "improvement" if better else "regression",
+                "change": change,
+                "before": before,
+                "after": after,
+                "pvalue": p,
+                "sha_before": points[index - 1]["git_sha"],
+                "sha_after": points[index]["git_sha"],
+                "timestamp": points[index]["timestamp"],
+            }
+        )
+    return result
+
+
+def state_key(setup, instance_type, test, name):
+    return "/".join((setup, instance_type, test, name))
+
+
+def load_state(store_dir):
+    try:
+        with open(os.path.join(store_dir, STATE), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(store_dir, state):
+    path = os.path.join(store_dir, STATE)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(state, fd, indent=" ", sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def detect(
+    store_dir,
+    metrics=DEFAULT_METRICS,
+    pvalue=DEFAULT_PVALUE,
+    permutations=DEFAULT_PERMUTATIONS,
+    min_size=DEFAULT_MIN_SIZE,
+    min_change=DEFAULT_MIN_CHANGE,
+    **patterns
+):
+    """Return one dict per change point, keyed like FIELDS.
+
+    A series is analyzed again only when it got new points, older ones
+    backfilled included, or the settings changed since the last detection,
+    otherwise its change points are reused.
+    new tells the change points that were not reported before.
+    """
+    state = load_state(store_dir)
+    settings = [pvalue, permutations, min_size, min_change]
+    rows = []
+    for (setup, instance_type, test), points in sorted(
+        history(store_dir, metrics, **patterns).items()
+    ):
+        for name in metrics:
+            key = state_key(setup, instance_type, test, name)
+            previous = state.get(key)
+            last = points[-1]["timestamp"]
+            if (
+                previous is not None
+                and previous["last"] == last
+                and previous.get("points") == len(points)
+                and previous["settings"] == settings
+            ):
+                found = previous["changes"]
+            else:
+                found = changes(
+                    points, name, pvalue, permutations, min_size, min_change
+                )
+                state[key] = {
+                    "last": last,
+                    "points": len(points),
+                    "settings": settings,
+                    "changes": found,
+                }
+            known = {c["timestamp"] for c in previous["changes"]} if previous else ()
+            for change in found:
+                row = {
+                    "setup": setup,
+                    "instance_type": instance_type,
+                    "test": test,
+                    "metric": name,
+                    "new": change["timestamp"] not in known,
+                }
+                row.update(change)
+                rows.append(row)
+    write_state(store_dir, state)
+    return rows
+
+
+def write_csv(fd, rows):
+    writer = csv.writer(fd, lineterminator="\n")
+    writer.writerow(FIELDS)
+    for row in rows:
+        line = []
+        for field in FIELDS:
+            value = row[field]
+            if field == "test":
+                value = memtier.short_name(value)
+            elif field in ("change", "before", "after", "pvalue"):
+                value = "{:.3f}".format(value)
+            elif field == "timestamp":
+                value = datetime.datetime.fromtimestamp(value).isoformat()
+            elif field == "new":
+                value = int(value)
+            line.append(value)
+        writer.writerow(line)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Detect regressions over the history of the results store.",
+    )
+    parser.add_argument("--store", default="results-store", help="store directory")
+    for key in store.KEYS[:3]:
+        parser.add_argument(
+            "--" + key.replace("_", "-"), default=None, help="glob over " + key
+        )
+    parser.add_argument(
+        "--metric",
+        action="append",
+        default=None,
+        choices=list(memtier.COLUMNS),
+        help="metric to analyze, can be repeated. Defaults to ops_sec and p99_ms",
+    )
+    parser.add_argument(
+        "--pvalue",
+        type=float,
+        default=DEFAULT_PVALUE,
+        help="significance level of a change point",
+    )
+    parser.add_argument(
+        "--permutations",
+        type=int,
+        default=DEFAULT_PERMUTATIONS,
+        help="permutations of the significance test",
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=DEFAULT_MIN_SIZE,
+        help="fewest points on either side of a change point",
+    )
+    parser.add_argument(
+        "--min-change",
+        type=float,
+        default=DEFAULT_MIN_CHANGE,
+        help="smaller changes, relative to the mean before, are not reported",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="print every change point, not only the new ones",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="exit with 2 when a new regression is found",
+    )
+    parser.add_argument("--output", default=None, help="CSV file, default stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    rows = detect(
+        args.store,
+        args.metric or DEFAULT_METRICS,
+        args.pvalue,
+        args.permutations,
+        args.min_size,
+        args.min_change,
+        setup=args.setup,
+        instance_type=args.instance_type,
+        test=args.test,
+    )
+    if not args.all:
+        rows = [row for row in rows if row["new"]]
+    if args.output is None:
+        write_csv(sys.stdout, rows)
+    else:
+        with open(args.output, "w") as fd:
+            write_csv(fd, rows)
+    regressions = [row for row in rows if row["new"] and row["kind"] == "regression"]
+    for row in regressions:
+        print(
+            "Regression of {} on {} {} ({}): {:+.1%} between {} and {}".format(
+                memtier.short_name(row["test"]),
+                row["setup"],
+                row["instance_type"],
+                row["metric"],
+                row["change"],
+                row["sha_before"],
+                row["sha_after"],
+            ),
+            file=sys.stderr,
+        )
+    if regressions and args.fail_on_regression:
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
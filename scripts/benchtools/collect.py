@@ -0,0 +1,268 @@
+"""Fetch the benchmark results of many clients at once.
+
+Every file is streamed gzip compressed over a pooled SSH channel and
+decompressed as it arrives, all hosts concurrently. A transfer that was cut
+short is resumed from the size of the local partial file, and every file is
+checked against the sha256 of its remote copy. What was fetched is recorded
+in a manifest.json next to the results, so files that did not change since
+the previous harvest are not fetched again, and of a file that only grew
+since (a log more runs were appended to) only the new tail is fetched.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import shlex
+import shutil
+import sys
+import time
+import zlib
+
+import paramiko
+
+from benchtools.distribute import sha256sum
+from benchtools.sshpool import DEFAULT_USER, SSHPool
+
+MANIFEST = "manifest.json"
+
+
+class Fetch:
+    """Decompress the gzip stream of one remote file into a local file."""
+
+    def __init__(self, path, offset):
+        self.fd = open(path, "ab" if offset else "wb")
+        self.decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        self.wire_bytes = 0
+        self.stderr = []
+
+    def __call__(self, host, stream, data):
+        if stream == "stderr":
+            self.stderr.append(data)
+            return
+        self.wire_bytes += len(data)
+        self.fd.write(self.decompressor.decompress(data))
+
+    def close(self):
+        self.fd.write(self.decompressor.flush())
+        self.fd.close()
+
+
+def remote_info(pool, host, remote_path, prefix=None):
+    """Return (size, sha256, sha256 of the first prefix bytes) of the remote file.
+
+    The digest covers exactly the first size bytes, so that it still matches
+    what gets fetched when the file grows in between. The prefix digest is
+    None without a prefix.
+    """
+    quoted = shlex.quote(remote_path)
+    cmd = (
+        "set -o pipefail; s=$(stat -c %s {0}) && echo $s && head -c $s {0} | "
+        "sha256sum".format(quoted)
+    )
+    if prefix is not None:
+        cmd += " && head -c {} {} | sha256sum".format(int(prefix), quoted)
+    exit_code, stdout, stderr = pool.run(host, cmd)
+    if exit_code != 0:
+        raise OSError(stderr.strip() or "cannot stat {}".format(remote_path))
+    fields = stdout.split()
+    return int(fields[0]), fields[1], fields[3] if prefix is not None else None
+
+
+def expand(pool, targets, errors):
+    """Return [(host, remote_path, local_name)] of [(host, remote_path)].
+
+    A remote path with wildcards (e.g. the HdrHistogram logs of memtier)
+    stands for every file matching it, kept under a directory per host as the
+    clients name their files alike. Patterns that cannot be listed go to
+    errors.
+    """
+
+    def listing(target):
+        # (matching paths, error)
+        host, remote_path = target
+        try:
+            exit_code, stdout, stderr = pool.run(host, "ls -1d -- " + remote_path)
+        except (OSError, EOFError, paramiko.ssh_exception.SSHException) as e:
+            return [], "{}: {}".format(type(e).__name__, e)
+        if exit_code != 0:
+            return [], stderr.strip() or "nothing matches {}".format(remote_path)
+        return stdout.splitlines(), None
+
+    files = []
+    patterns = []
+    for host, remote_path in targets:
+        if any(char in remote_path for char in "*?["):
+            patterns.append((host, remote_path))
+        else:
+            files.append((host, remote_path, os.path.basename(remote_path)))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(patterns) or 1
+    ) as executor:
+        for (host, pattern), (paths, error) in zip(
+            patterns, executor.map(listing, patterns)
+        ):
+            if error is not None:
+                errors[host + ":" + pattern] = error
+            for path in paths:
+                files.append((host, path, os.path.join(host, os.path.basename(path))))
+    return files
+
+
+def fetch(pool, host, remote_path, local_path, previous=None):
+    """Fetch one file, resuming a partial transfer. Returns its manifest entry.
+
+    The remote file may still be growing, only the bytes present when it was
+    hashed are fetched. When the local copy of the previous fetch is still
+    the start of the remote file, only what was appended since is.
+    """
+    start = time.monotonic()
+    prefix = None
+    if (
+        previous is not None
+        and os.path.exists(local_path)
+        and os.path.getsize(local_path) == previous["size"]
+    ):
+        prefix = previous["size"]
+    size, digest, prefix_digest = remote_info(pool, host, remote_path, prefix)
+    if prefix is not None and previous["sha256"] == digest:
+        return dict(previous, skipped=True)
+    part_path = local_path + ".part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > size:
+        offset = 0
+    if (
+        offset == 0
+        and prefix is not None
+        and prefix_digest == previous["sha256"]
+        and sha256sum(local_path) == previous["sha256"]
+    ):
+        # the file only grew since the previous harvest, fetch its new tail
+        shutil.copyfile(local_path, part_path)
+        offset = prefix
+    sink = Fetch(part_path, offset)
+    try:
+        exit_code = pool.run(
+            host,
+            "head -c {} {} | tail -c +{} | gzip -1".format(
+                size, shlex.quote(remote_path), offset + 1
+            ),
+            on_output=sink,
+        )[0]
+    finally:
+        sink.close()
+    if exit_code != 0:
+        raise OSError(b"".join(sink.stderr).decode(errors="replace").strip())
+    if sha256sum(part_path) != digest:
+        # the partial file does not match the remote one, start over next time
+        os.remove(part_path)
+        raise OSError("checksum mismatch on {}".format(remote_path))
+    os.replace(part_path, local_path)
+    return {
+        "host": host,
+        "remote_path": remote_path,
+        "size": size,
+        "sha256": digest,
+        "resumed_at": offset,
+        "wire_bytes": sink.wire_bytes,
+        "seconds": round(time.monotonic() - start, 3),
+        "fetched_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "skipped": False,
+    }
+
+
+def load_manifest(dest):
+    try:
+        with open(os.path.join(dest, MANIFEST), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(dest, manifest):
+    path = os.path.join(dest, MANIFEST)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(manifest, fd, indent=" ", sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def collect(pool, targets, dest, workers=None):
+    """Fetch [(host, remote_path)] into dest, all at once.
+
+    Returns ({local_name: manifest entry}, {local_name: error}) of this
+    harvest, the manifest keeping the entries of the previous ones as well.
+    """
+    os.makedirs(dest, exist_ok=True)
+    manifest = load_manifest(dest)
+    errors = {}
+    files = expand(pool, targets, errors)
+    names = {}
+    for host, remote_path, name in files:
+        names[name] = (host, remote_path)
+    if len(names) != len(files):
+        raise ValueError("two of the remote files share the same file name")
+
+    def work(name):
+        host, remote_path = names[name]
+        local_path = os.path.join(dest, name)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        return fetch(pool, host, remote_path, local_path, manifest.get(name))
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers or len(names) or 1
+    ) as executor:
+        futures = {executor.submit(work, name): name for name in names}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                manifest[name] = future.result()
+            except (OSError, EOFError, paramiko.ssh_exception.SSHException) as e:
+                errors[name] = "{}: {}".format(type(e).__name__, e)
+    write_manifest(dest, manifest)
+    fetched = {name: manifest[name] for name in names if name not in errors}
+    return fetched, errors
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Fetch benchmark results from many hosts at once.",
+    )
+    parser.add_argument("--pem", required=True, help="private key file")
+    parser.add_argument("--user", default=DEFAULT_USER, help="ssh user")
+    parser.add_argument(
+        "--fetch",
+        action="append",
+        required=True,
+        help="HOST:REMOTE_PATH to fetch, wildcards allowed. Can be repeated",
+    )
+    parser.add_argument("--dest", default="results", help="local results directory")
+    parser.add_argument("--workers", type=int, default=None, help="files at once")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    targets = [tuple(target.split(":", 1)) for target in args.fetch]
+    start = time.monotonic()
+    with SSHPool(os.path.expanduser(args.pem), username=args.user) as pool:
+        fetched, errors = collect(pool, targets, args.dest, args.workers)
+    for name, entry in sorted(fetched.items()):
+        if entry["skipped"]:
+            status = "unchanged"
+        else:
+            status = "{} bytes, {} on the wire".format(
+                entry["size"] - entry["resumed_at"], entry["wire_bytes"]
+            )
+        print("{:<40} {:<20} {}".format(name, entry["host"], status))
+    for name, error in sorted(errors.items()):
+        print("Error on {}. {}".format(name, error), file=sys.stderr)
+    print(
+        "Fetched {} files in {:.3f}s".format(
+            len(fetched), time.monotonic() - start
+        )
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
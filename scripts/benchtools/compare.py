@@ -0,0 +1,192 @@
+"""Compare instance types: baseline-normalized and price-performance.
+
+The runs of every (test, vm) cell are reduced to their median and pivoted
+into a test x vm matrix. Every row is normalized against a baseline vm (so
+above 1 is better than the baseline, also for latencies), and throughput is
+divided by the vCPUs and by the on-demand hourly price of the instance, from
+the catalog bundled in instances.json. The vms are ranked by the geometric
+mean over the tests, so no single test dominates.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from benchtools import memtier
+
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instances.json")
+SORT_KEYS = ("relative", "per_vcpu", "per_dollar")
+
+
+def load_catalog(path=CATALOG):
+    with open(path, "r") as fd:
+        return json.load(fd)["instances"]
+
+
+def pivot(results, column, tests=None, vms=None):
+    """Return (tests, vms, matrix) with the median over the runs of every cell.
+
+    Cells without results are NaN.
+    """
+    cells = {}
+    for test, vm, value in zip(results.test, results.vm, results[column]):
+        cells.setdefault((test, vm), []).append(value)
+    if tests is None:
+        tests = list(dict.fromkeys(results.test))
+    if vms is None:
+        vms = list(dict.fromkeys(results.vm))
+    matrix = np.full((len(tests), len(vms)), np.nan)
+    for i, test in enumerate(tests):
+        for j, vm in enumerate(vms):
+            values = [v for v in cells.get((test, vm), []) if not np.isnan(v)]
+            if values:
+                matrix[i, j] = np.median(values)
+    return tests, vms, matrix
+
+
+def geomean(matrix):
+    """Geometric mean of every column, over the rows that are not NaN."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logs = np.log(matrix)
+    valid = np.isfinite(logs)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        return np.exp(np.where(valid, logs, 0).sum(axis=0) / counts)
+
+
+def compare(results, column, baseline, catalog, tests=None, vms=None):
+    """Return (tests, vms, tables, ranking).
+
+    tables holds the test x vm matrices "value", "relative", and for the
+    throughput columns "per_vcpu" and "per_dollar" as well. ranking has one
+    dict per vm with the geometric mean of every table over the tests.
+    """
+    tests, vms, matrix = pivot(results, column, tests, vms)
+    if baseline not in vms:
+        raise ValueError("baseline {} has no results".format(baseline))
+    base = matrix[:, [vms.index(baseline)]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if column in memtier.HIGHER_IS_BETTER:
+            relative = matrix / base
+        else:
+            relative = base / matrix
+    tables = {"value": matrix, "relative": relative}
+    if column in memtier.HIGHER_IS_BETTER:
+        missing = [vm for vm in vms if vm not in catalog]
+        if missing:
+            raise ValueError("not in the catalog: {}".format(", ".join(missing)))
+        vcpu = np.array([catalog[vm]["vcpu"] for vm in vms], dtype=float)
+        price = np.array([catalog[vm]["price"] for vm in vms], dtype=float)
+        tables["per_vcpu"] = matrix / vcpu
+        tables["per_dollar"] = matrix / price
+    means = {name: geomean(table) for name, table in tables.items()}
+    ranking = []
+    for j, vm in enumerate(vms):
+        entry = {"vm": vm, "tests": int(np.isfinite(matrix[:, j]).sum())}
+        entry.update(catalog.get(vm, {}))
+        entry.update({name: mean[j] for name, mean in means.items()})
+        ranking.append(entry)
+    return tests, vms, tables, ranking
+
+
+def sort_ranking(ranking, key):
+    # vms without any result go last
+    return sorted(
+        ranking, key=lambda entry: -entry[key] if np.isfinite(entry[key]) else np.inf
+    )
+
+
+def write_csv(fd, tests, vms, tables):
+    writer = csv.writer(fd, lineterminator="\n")
+    names = list(tables)
+    writer.writerow(["test", "vm"] + names)
+    for i, test in enumerate(tests):
+        for j, vm in enumerate(vms):
+            values = [tables[name][i, j] for name in names]
+            writer.writerow(
+                [memtier.short_name(test), vm]
+                + ["" if np.isnan(v) else "{:.3f}".format(v) for v in values]
+            )
+
+
+def print_ranking(ranking, key, fd=sys.stdout):
+    names = [name for name in ("value",) + SORT_KEYS if name in ranking[0]]
+    fd.write(
+        "{:>4} {:<14} {:<7} {:>4} {:>7} {:>5}".format(
+            "rank", "vm", "arch", "vcpu", "$/h", "tests"
+        )
+        + "".join(" {:>14}".format(name) for name in names)
+        + "\n"
+    )
+    for pos, entry in enumerate(sort_ranking(ranking, key), start=1):
+        fd.write(
+            "{:>4} {:<14} {:<7} {:>4} {:>7} {:>5}".format(
+                pos,
+                entry["vm"],
+                entry.get("arch", "?"),
+                entry.get("vcpu", "?"),
+                entry.get("price", "?"),
+                entry["tests"],
+            )
+            + "".join(" {:>14.3f}".format(entry[name]) for name in names)
+            + "\n"
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Rank instance types against a baseline and by price.",
+    )
+    parser.add_argument("--results-dir", default="results-final", help="logs dir")
+    parser.add_argument(
+        "--suffix",
+        default="-priority-10.log",
+        help="log file name suffix, what comes before it is the vm",
+    )
+    parser.add_argument("--baseline", required=True, help="vm to normalize against")
+    parser.add_argument(
+        "--metric",
+        default="ops_sec",
+        choices=list(memtier.COLUMNS),
+        help="metric to compare",
+    )
+    parser.add_argument(
+        "--sort-by",
+        default="relative",
+        choices=SORT_KEYS,
+        help="ranking order, per_vcpu and per_dollar need a throughput metric",
+    )
+    parser.add_argument("--catalog", default=CATALOG, help="instance catalog JSON")
+    parser.add_argument("--output", default=None, help="test x vm CSV to write")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    index = memtier.build_index(args.results_dir, args.suffix)
+    results = memtier.Results.from_index(index)
+    try:
+        tests, vms, tables, ranking = compare(
+            results, args.metric, args.baseline, load_catalog(args.catalog)
+        )
+    except ValueError as e:
+        print("Error on {}. {}".format(args.results_dir, e), file=sys.stderr)
+        return 1
+    if args.sort_by not in tables:
+        print(
+            "--sort-by {} needs a throughput metric".format(args.sort_by),
+            file=sys.stderr,
+        )
+        return 1
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            write_csv(fd, tests, vms, tables)
+    print_ranking(ranking, args.sort_by)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
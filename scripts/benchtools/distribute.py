@@ -0,0 +1,464 @@
+"""Upload an artifact once and let the nodes relay it to each other.
+
+The artifact crosses the uplink only once, to the first node. Every node
+writes what it receives to disk while forwarding it, as it arrives, to its
+children over the private network, so the copy is pipelined along a chain
+(fanout 1) or a tree (fanout > 1) and the total time stays roughly flat
+with the number of nodes. Each node checks the sha256 of its copy before
+moving it in place.
+
+Every node also keeps the artifacts it received in a content-addressed cache
+(files named by their sha256, plus a manifest.json recording their size and
+last use) capped in size, least recently used first out. Nodes that already
+hold an artifact are served from their cache and skip the transfer.
+
+The relay needs python3 on every node and the relay port open between them.
+Both are checked first by relaying an empty payload along the same tree;
+when that fails the artifacts are copied straight to every node over SSH
+instead, like scp, without the cache.
+"""
+import argparse
+import base64
+import concurrent.futures
+import hashlib
+import json
+import os
+import shlex
+import sys
+import time
+
+import paramiko
+
+from benchtools.sshpool import DEFAULT_USER, SSHPool
+
+DEFAULT_PORT = 52100
+DEFAULT_FANOUT = 2
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_DIR = "~/.cache/benchtools/artifacts"
+DEFAULT_CACHE_MAX_BYTES = 20 * 1024 ** 3
+# a relay waits that long for its parent (and at most 120s for its children)
+RELAY_TIMEOUT_SECS = 600
+PROBE_TIMEOUT_SECS = 30
+PROBE_PATH = "/tmp/.benchtools-relay-probe"
+
+# runs on the nodes with their system python3, keep it 3.6 compatible
+NODE_SCRIPT = r"""
+import fcntl, hashlib, json, os, shutil, socket, sys, time
+
+op, cache_dir, cache_max, out_path, mode, expected = sys.argv[1:7]
+cache_dir = os.path.expanduser(cache_dir)
+cache_max = int(cache_max)
+mode = int(mode, 8)
+
+
+def place(src_path, dst_path):
+    tmp_path = dst_path + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, dst_path)
+
+
+def cached(update):
+    # update(manifest) runs with the manifest locked, its result is returned
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = os.path.join(cache_dir, "manifest.json")
+        try:
+            with open(path) as fd:
+                manifest = json.load(fd)
+        except (OSError, ValueError):
+            manifest = {}
+        res = update(manifest)
+        with open(path + ".tmp", "w") as fd:
+            json.dump(manifest, fd, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    return res
+
+
+def lookup(manifest):
+    entry = manifest.get(expected)
+    path = os.path.join(cache_dir, expected)
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    # an entry whose file was changed in place (size or mtime) is dropped
+    if entry is None or st is None or [st.st_size, st.st_mtime_ns] != [
+        entry["size"], entry["mtime_ns"]
+    ]:
+        manifest.pop(expected, None)
+        return False
+    place(path, out_path)
+    entry["last_used"] = time.time()
+    return True
+
+
+def add(manifest):
+    path = os.path.join(cache_dir, expected)
+    place(out_path, path)
+    st = os.stat(path)
+    manifest[expected] = {
+        "name": os.path.basename(out_path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "last_used": time.time(),
+    }
+    # evict the least recently used artifacts until under the size cap
+    total = sum(entry["size"] for entry in manifest.values())
+    for sha in sorted(manifest, key=lambda k: manifest[k]["last_used"]):
+        if total <= cache_max or sha == expected:
+            break
+        total -= manifest.pop(sha)["size"]
+        if os.path.exists(os.path.join(cache_dir, sha)):
+            os.remove(os.path.join(cache_dir, sha))
+        print("evicted {}".format(sha))
+
+
+if op == "lookup":
+    print("cache {}".format("hit" if cached(lookup) else "miss"))
+    sys.exit(0)
+
+listen, port, timeout = sys.argv[7:10]
+children = sys.argv[10:]
+port = int(port)
+timeout = float(timeout)
+if listen:
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((listen, port))
+    server.listen(1)
+    server.settimeout(timeout)
+    conn = server.accept()[0]
+    server.close()
+    src = conn.makefile("rb")
+else:
+    src = sys.stdin.buffer
+sinks = []
+for child in children:
+    deadline = time.time() + min(timeout, 120)
+    while True:
+        try:
+            sinks.append(socket.create_connection((child, port), timeout=timeout))
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+digest = hashlib.sha256()
+tmp_path = out_path + ".recv"
+with open(tmp_path, "wb") as fd:
+    while True:
+        chunk = src.read(1 << 20)
+        if not chunk:
+            break
+        fd.write(chunk)
+        digest.update(chunk)
+        for sink in sinks:
+            sink.sendall(chunk)
+for sink in sinks:
+    sink.close()
+print("sha256 {}".format(digest.hexdigest()))
+if digest.hexdigest() != expected:
+    os.remove(tmp_path)
+    sys.exit("checksum mismatch on {}".format(out_path))
+os.chmod(tmp_path, mode)
+os.replace(tmp_path, out_path)
+if cache_dir:
+    cached(add)
+"""
+
+
+def sha256sum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def plan(nodes, fanout=DEFAULT_FANOUT):
+    """Return {node: [children]} of a breadth-first tree rooted at nodes[0].
+
+    A fanout of 1 gives a chain.
+    """
+    return {
+        node: nodes[i * fanout + 1 : i * fanout + 1 + fanout]
+        for i, node in enumerate(nodes)
+    }
+
+
+def node_cmd(*args):
+    # relay: args are op, cache dir ("" without cache), cache size cap, out
+    # path, mode, sha256, then the private IP to receive on ("" to read stdin),
+    # the port, the timeout and the children. lookup: only the arguments up to
+    # the sha256
+    script = base64.b64encode(NODE_SCRIPT.encode()).decode()
+    args = [str(arg) for arg in args]
+    return "python3 -c 'import base64; exec(base64.b64decode(\"{}\"))' {}".format(
+        script, " ".join(shlex.quote(a) for a in args)
+    )
+
+
+class NodeResult:
+    def __init__(self, public_ip, exit_code, stdout, stderr, latency):
+        self.public_ip = public_ip
+        self.exit_code = exit_code
+        self.digest = None
+        self.cached = False
+        for line in stdout.splitlines():
+            if line.startswith("sha256 "):
+                self.digest = line.split()[1]
+            elif line == "cache hit":
+                self.cached = True
+        self.error = None
+        if exit_code != 0:
+            self.error = (stderr.strip().splitlines() or ["unknown error"])[-1]
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+
+def run_nodes(pool, work, nodes):
+    """Run work(node) -> (public_ip, cmd, stdin) on all nodes at once.
+
+    Returns {public_ip: NodeResult}.
+    """
+
+    def node_work(node):
+        public_ip, cmd, stdin = work(node)
+        start = time.monotonic()
+        try:
+            if stdin is not None:
+                with open(stdin, "rb") as fd:
+                    res = pool.run(public_ip, cmd, stdin=fd)
+            else:
+                res = pool.run(public_ip, cmd)
+        except (OSError, EOFError, paramiko.ssh_exception.SSHException) as e:
+            res = (None, "", "{}: {}".format(type(e).__name__, e))
+        return NodeResult(public_ip, *res, time.monotonic() - start)
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = [executor.submit(node_work, node) for node in nodes]
+        for future in concurrent.futures.as_completed(futures):
+            res = future.result()
+            results[res.public_ip] = res
+    return results
+
+
+def relay(
+    pool,
+    nodes,
+    src,
+    dst,
+    mode,
+    expected,
+    fanout=DEFAULT_FANOUT,
+    port=DEFAULT_PORT,
+    cache_dir="",
+    cache_max=DEFAULT_CACHE_MAX_BYTES,
+    timeout=RELAY_TIMEOUT_SECS,
+):
+    """Relay src to dst along the tree of nodes, return {public_ip: NodeResult}."""
+    private_to_public = {private_ip: public_ip for public_ip, private_ip in nodes}
+    tree = plan([private_ip for _, private_ip in nodes], fanout)
+    seed = nodes[0][1]
+
+    def work(private_ip):
+        # the children are started along with the seed and wait for their parent
+        listen = "" if private_ip == seed else private_ip
+        cmd = node_cmd(
+            "relay",
+            cache_dir,
+            cache_max,
+            dst,
+            mode,
+            expected,
+            listen,
+            port,
+            timeout,
+            *tree[private_ip]
+        )
+        return private_to_public[private_ip], cmd, src if listen == "" else None
+
+    return run_nodes(pool, work, list(tree))
+
+
+def probe(pool, nodes, fanout=DEFAULT_FANOUT, port=DEFAULT_PORT):
+    """Return the nodes the relay does not work on, as {public_ip: error}.
+
+    An empty payload is relayed along the same tree as the artifacts, which
+    needs python3 on every node and the relay port open between them.
+    """
+    results = relay(
+        pool,
+        nodes,
+        os.devnull,
+        PROBE_PATH,
+        "600",
+        hashlib.sha256().hexdigest(),
+        fanout,
+        port,
+        timeout=PROBE_TIMEOUT_SECS,
+    )
+    return {ip: res.error for ip, res in results.items() if not res.ok}
+
+
+def copy(pool, nodes, src, dst, mode, expected):
+    """Copy src to dst straight to every node over SSH, like scp.
+
+    Returns {public_ip: NodeResult}.
+    """
+    cmd = (
+        "cat > {0}.part && chmod {1} {0}.part && mv {0}.part {0} && "
+        "echo sha256 $(sha256sum {0} | cut -d ' ' -f 1)"
+    ).format(shlex.quote(dst), mode)
+    results = run_nodes(pool, lambda node: (node[0], cmd, src), nodes)
+    for res in results.values():
+        if res.ok and res.digest != expected:
+            res.exit_code = 1
+            res.error = "checksum mismatch on {}".format(dst)
+    return results
+
+
+def distribute(
+    pool,
+    nodes,
+    src,
+    dst,
+    fanout=DEFAULT_FANOUT,
+    port=DEFAULT_PORT,
+    cache_dir=DEFAULT_CACHE_DIR,
+    cache_max=DEFAULT_CACHE_MAX_BYTES,
+    direct=False,
+):
+    """Copy the local file src to dst on every node.
+
+    nodes is a list of (public_ip, private_ip); SSH goes through the public
+    IPs and the relaying through the private ones. Nodes that already hold
+    the artifact in their cache_dir get it from there, only the others take
+    part in the relay. With direct, src is copied to every node over SSH
+    instead. Returns {public_ip: NodeResult}.
+    """
+    expected = sha256sum(src)
+    mode = "{:o}".format(os.stat(src).st_mode & 0o777)
+    if direct:
+        return copy(pool, nodes, src, dst, mode, expected)
+    results = {}
+    if cache_dir:
+        results = run_nodes(
+            pool,
+            lambda node: (
+                node[0],
+                node_cmd("lookup", cache_dir, cache_max, dst, mode, expected),
+                None,
+            ),
+            nodes,
+        )
+        nodes = [node for node in nodes if not results[node[0]].cached]
+        if not nodes:
+            return results
+    results.update(
+        relay(pool, nodes, src, dst, mode, expected, fanout, port, cache_dir, cache_max)
+    )
+    return results
+
+
+def load_nodes(inventory_path, setup, group):
+    with open(inventory_path, "r") as fd:
+        hosts = json.load(fd)["setups"][setup]["groups"][group]
+    return [(host["public_ip"], host["private_ip"]) for host in hosts]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Upload artifacts once and relay them between the nodes.",
+    )
+    parser.add_argument("--pem", required=True, help="private key file")
+    parser.add_argument("--user", default=DEFAULT_USER, help="ssh user")
+    parser.add_argument(
+        "--node",
+        action="append",
+        default=[],
+        help="PUBLIC_IP:PRIVATE_IP of a node, can be repeated",
+    )
+    parser.add_argument("--inventory", default=None, help="inventory.json to use")
+    parser.add_argument("--setup", default=None, help="setup name in the inventory")
+    parser.add_argument("--group", default="server", help="host group of the setup")
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        default=DEFAULT_FANOUT,
+        help="children per node, 1 relays along a chain",
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="relay port")
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="artifact cache on the nodes, '' disables it",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=DEFAULT_CACHE_MAX_BYTES / 1024 ** 3,
+        help="size cap of the cache, least recently used artifacts go first",
+    )
+    parser.add_argument(
+        "artifacts", nargs="+", help="LOCAL_PATH:REMOTE_PATH of each artifact"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    nodes = [tuple(node.split(":", 1)) for node in args.node]
+    if args.inventory:
+        nodes.extend(load_nodes(args.inventory, args.setup, args.group))
+    if not nodes:
+        print("No nodes to distribute to", file=sys.stderr)
+        return 1
+    failed = False
+    with SSHPool(os.path.expanduser(args.pem), username=args.user) as pool:
+        broken = probe(pool, nodes, args.fanout, args.port)
+        for public_ip, error in sorted(broken.items()):
+            print("Warning. No relay on {}. {}".format(public_ip, error))
+        if broken:
+            print("Warning. Copying to every node over SSH instead")
+        for artifact in args.artifacts:
+            src, dst = artifact.rsplit(":", 1)
+            start = time.monotonic()
+            results = distribute(
+                pool,
+                nodes,
+                src,
+                dst,
+                args.fanout,
+                args.port,
+                args.cache_dir,
+                int(args.cache_max_gb * 1024 ** 3),
+                direct=bool(broken),
+            )
+            print(
+                "{} -> {} on {} nodes in {:.3f}s".format(
+                    src, dst, len(nodes), time.monotonic() - start
+                )
+            )
+            for public_ip, res in sorted(results.items()):
+                status = "cached" if res.cached else "ok"
+                if not res.ok:
+                    status = "FAILED {}".format(res.error)
+                print("  {:<20} {:>8.3f}s  {}".format(public_ip, res.latency, status))
+                failed = failed or not res.ok
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
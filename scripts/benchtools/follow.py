@@ -0,0 +1,335 @@
+"""Follow benchmark logs while they are written, one summary row per test.
+
+The logs are tailed (tail -F, so a log that is rotated or recreated by a new
+sweep is followed too) and go through a pipeline of generators: lines ->
+summary rows. A row is pushed as soon as the table of a test is complete,
+for the memtier tables of redis-benchmarks-spec-client-runner as well as for
+redis-benchmark --csv output, so a long sweep shows partial results as it
+goes. Remote logs are filtered on the client VM down to their table lines
+before crossing the wire, and a host that stops completing tests, or whose
+tail fails, is reported without waiting for the end of the sweep. A tail
+that ends cleanly (the log was finished) only ends the following of that
+host.
+
+Rows are pulled from the VMs by the collector over SSH rather than pushed by
+them: the VMs need no agent nor open port, only the SSH access the other
+tools already use, and the rows land on stdout and --output of the
+collector.
+"""
+import argparse
+import csv
+import datetime
+import os
+import queue
+import re
+import shlex
+import sys
+import threading
+import time
+
+import paramiko
+
+from benchtools import memtier
+from benchtools.remote import LineSplitter
+from benchtools.sshpool import DEFAULT_USER, SSHPool
+
+# hosts that did not complete a test for that long are reported as stalled
+DEFAULT_STALL_SECS = 900
+POLL_SECS = 1.0
+# table and --csv lines as they are, every other line emptied, which is all
+# the parser needs to tell where a table ends. Unbuffered, as tail -F never ends
+REMOTE_FILTER = "sed -u 's/^[^#|\"].*//'"
+# redis-benchmark --csv header, "test","rps","avg_latency_ms",...
+CSV_HEADER_RE = re.compile(r'^"test","rps"')
+CSV_ROW_RE = re.compile(r'^"(?P<test>[^"]+)","(?P<rps>[0-9.]+)"')
+CSV_COLUMNS = {
+    "rps": "ops_sec",
+    "avg_latency_ms": "latency_avg_ms",
+    "p50_latency_ms": "p50_ms",
+    "p99_latency_ms": "p99_ms",
+}
+FIELDS = ["time", "host", "test", "run"] + list(memtier.COLUMNS)
+
+
+def tail(path, stop=None, interval=POLL_SECS):
+    """Yield the lines of a local file as they are written, like tail -F.
+
+    The file is read from the start and reopened when it is replaced or
+    truncated. Ends when stop (a threading.Event) is set.
+    """
+    fd = None
+    partial = ""
+    while stop is None or not stop.is_set():
+        if fd is None:
+            try:
+                fd = open(path, "r", errors="replace")
+            except OSError:
+                time.sleep(interval)
+                continue
+        data = fd.read()
+        if data:
+            lines = (partial + data).split("\n")
+            partial = lines.pop()
+            yield from lines
+            continue
+        try:
+            replaced = os.stat(path).st_ino != os.fstat(fd.fileno()).st_ino
+            truncated = os.path.getsize(path) < fd.tell()
+        except OSError:
+            replaced, truncated = True, False
+        if replaced or truncated:
+            fd.close()
+            fd, partial = None, ""
+            continue
+        time.sleep(interval)
+    if fd is not None:
+        fd.close()
+
+
+def summaries(lines, host=None):
+    """Yield a summary row dict per completed test of the lines of one log.
+
+    A memtier table is complete at the first line that is not part of it, a
+    redis-benchmark --csv row right away.
+    """
+    runs = {}
+    test = None
+    metrics = {}
+    csv_fields = None
+
+    def row(test, values):
+        runs[test] = runs.get(test, 0) + 1
+        summary = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "host": host,
+            "test": test,
+            "run": runs[test],
+        }
+        summary.update({name: values.get(name) for name in memtier.COLUMNS})
+        return summary
+
+    for line in lines:
+        if test is not None and not line.startswith("|"):
+            if metrics:
+                yield row(test, memtier.columns(metrics))
+            test, metrics = None, {}
+        if line.startswith("#"):
+            match = memtier.TABLE_RE.match(line)
+            if match is not None:
+                test = match.group("test")
+        elif line.startswith("|") and test is not None:
+            cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            try:
+                value = float(cells[-1])
+            except ValueError:
+                continue
+            metric = memtier.parse_metric(cells[-2]) if len(cells) >= 2 else None
+            if metric is not None:
+                metrics[metric] = value
+        elif CSV_HEADER_RE.match(line):
+            csv_fields = next(csv.reader([line]))
+        elif CSV_ROW_RE.match(line):
+            cells = next(csv.reader([line]))
+            fields = csv_fields or ["test", "rps"]
+            values = {}
+            for field, cell in zip(fields[1:], cells[1:]):
+                if field in CSV_COLUMNS:
+                    values[CSV_COLUMNS[field]] = float(cell)
+            yield row(cells[0], values)
+    if test is not None and metrics:
+        yield row(test, memtier.columns(metrics))
+
+
+class Lines(LineSplitter):
+    """Queue the stdout lines of a remote command."""
+
+    def __init__(self, lines):
+        super().__init__()
+        self.lines = lines
+
+    def write(self, host, stream, line):
+        if stream == "stdout":
+            self.lines.put(line.decode(errors="replace"))
+
+
+def remote_lines(pool, host, path, status):
+    """Yield the table lines of a remote log as they are written.
+
+    Ends when the remote tail does, with the reason in status["reason"] and,
+    when it failed rather than ended cleanly, status["error"] set.
+    """
+    cmd = "tail -n +1 -F {} 2>/dev/null | {}".format(shlex.quote(path), REMOTE_FILTER)
+    lines = queue.Queue()
+
+    def work():
+        splitter = Lines(lines)
+        try:
+            exit_code = pool.run(host, cmd, on_output=splitter)[0]
+            status["reason"] = "tail exited with {}".format(exit_code)
+            status["error"] = exit_code != 0
+        except (OSError, EOFError, paramiko.ssh_exception.SSHException) as e:
+            status["reason"] = "{}: {}".format(type(e).__name__, e)
+            status["error"] = True
+        splitter.flush()
+        lines.put(None)
+
+    threading.Thread(target=work, daemon=True).start()
+    yield from iter(lines.get, None)
+
+
+def push(rows, host, lines, status):
+    # thread worker, one per followed log: lines -> summaries -> rows queue
+    try:
+        for row in summaries(lines, host):
+            rows.put(("row", host, row))
+    finally:
+        kind = "error" if status.get("error") else "end"
+        rows.put((kind, host, status.get("reason", "end of log")))
+
+
+def relative(row, seen, column="ops_sec"):
+    # value of column against the median of the other hosts on the same test
+    others = sorted(
+        values[column]
+        for host, values in seen.get(row["test"], {}).items()
+        if host != row["host"] and values[column] is not None
+    )
+    if not others or not row[column]:
+        return None
+    return row[column] / others[len(others) // 2]
+
+
+def watch(rows, hosts, writer, stall=DEFAULT_STALL_SECS, idle_exit=None):
+    """Write the summary rows of the followed hosts as they come.
+
+    Every row is appended to writer (a csv writer, or None) and printed with
+    its throughput against the other hosts on the same test. Hosts that
+    complete no test for stall seconds, or whose log can no longer be
+    followed, are reported, those whose log ended cleanly are not. Returns
+    {host: reason} of the hosts reported, once every log ended or, with
+    idle_exit, once no host completed a test for that long.
+    """
+    start = time.monotonic()
+    last = {host: start for host in hosts}
+    active = set(hosts)
+    bad = {}
+    seen = {}
+    while active:
+        try:
+            kind, host, data = rows.get(timeout=POLL_SECS)
+        except queue.Empty:
+            kind = None
+        now = time.monotonic()
+        if kind == "row":
+            last[host] = now
+            bad.pop(host, None)
+            seen.setdefault(data["test"], {})[host] = data
+            if writer is not None:
+                writer.writerow(
+                    ["" if data[field] is None else data[field] for field in FIELDS]
+                )
+            ratio = relative(data, seen)
+            print(
+                "{:<20} {:<50} run {:<3} {:>12} ops/sec{}".format(
+                    host,
+                    memtier.short_name(data["test"]),
+                    data["run"],
+                    "{:.0f}".format(data["ops_sec"]) if data["ops_sec"] else "-",
+                    "" if ratio is None else " ({:.2f}x the others)".format(ratio),
+                ),
+                flush=True,
+            )
+        elif kind == "end":
+            active.discard(host)
+            bad.pop(host, None)
+            print("End of {}. {}".format(host, data), file=sys.stderr, flush=True)
+        elif kind == "error":
+            active.discard(host)
+            bad[host] = data
+            print("Error on {}. {}".format(host, data), file=sys.stderr, flush=True)
+        for host in sorted(active):
+            if now - last[host] > stall and host not in bad:
+                bad[host] = "no test completed for {:.0f}s".format(now - last[host])
+                print("Stalled {}. {}".format(host, bad[host]), file=sys.stderr)
+        if idle_exit is not None and all(now - last[h] > idle_exit for h in active):
+            break
+    return bad
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Follow benchmark logs and print a row per completed test.",
+    )
+    parser.add_argument("--pem", default=None, help="private key file")
+    parser.add_argument("--user", default=DEFAULT_USER, help="ssh user")
+    parser.add_argument(
+        "--follow",
+        action="append",
+        default=[],
+        help="HOST:REMOTE_PATH of a log to follow, can be repeated",
+    )
+    parser.add_argument(
+        "--log",
+        action="append",
+        default=[],
+        help="local log to follow instead, e.g. on the client VM. Can be repeated",
+    )
+    parser.add_argument("--output", default=None, help="CSV file to append rows to")
+    parser.add_argument(
+        "--stall",
+        type=float,
+        default=DEFAULT_STALL_SECS,
+        help="seconds without a completed test before a host is reported",
+    )
+    parser.add_argument(
+        "--idle-exit",
+        type=float,
+        default=None,
+        help="exit once no log completed a test for that many seconds",
+    )
+    args = parser.parse_args(argv)
+    if not args.follow and not args.log:
+        parser.error("nothing to follow, use --follow or --log")
+    if args.follow and args.pem is None:
+        parser.error("--follow needs --pem")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    rows = queue.Queue()
+    stop = threading.Event()
+    fd = writer = None
+    if args.output is not None:
+        fd = open(args.output, "a", buffering=1)
+        writer = csv.writer(fd, lineterminator="\n")
+        if fd.tell() == 0:
+            writer.writerow(FIELDS)
+    pool = None
+    if args.follow:
+        pool = SSHPool(os.path.expanduser(args.pem), username=args.user)
+    sources = []
+    for target in args.follow:
+        host, path = target.split(":", 1)
+        status = {}
+        sources.append((host, remote_lines(pool, host, path, status), status))
+    for path in args.log:
+        sources.append((path, tail(path, stop), {}))
+    for source in sources:
+        threading.Thread(target=push, args=(rows,) + source, daemon=True).start()
+    hosts = [host for host, _, _ in sources]
+    try:
+        bad = watch(rows, hosts, writer, args.stall, args.idle_exit)
+    except KeyboardInterrupt:
+        bad = {}
+    finally:
+        stop.set()
+        if pool is not None:
+            pool.close()
+        if fd is not None:
+            fd.close()
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""Merge the HdrHistogram latency logs of many memtier clients exactly.
+
+memtier --hdr-file-prefix writes the latency histogram of a run as an
+HdrHistogram log, one base64 compressed histogram per line. Percentiles of
+several clients (or runs) cannot be averaged; their histograms are added up
+bucket by bucket instead, which is exact as long as they share the same
+precision, and the percentiles of the whole cluster are read from the sum.
+
+The merged histogram is written back as an HdrHistogram log in the same V2
+compressed encoding (runs of empty buckets collapsed, zigzag LEB128 counts,
+deflated), so it stays small on disk and any HdrHistogram tool can read it.
+"""
+import argparse
+import base64
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+# V2 cookies, the low nibble of the last byte being the word size
+ENCODING_COOKIE = 0x1C849313
+COMPRESSED_COOKIE = 0x1C849314
+COOKIE_MASK = ~0xF0
+HEADER = struct.Struct(">iiiiqqd")
+COMPRESSED_HEADER = struct.Struct(">ii")
+# memtier records microseconds
+DEFAULT_UNITS_PER_MS = 1000.0
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9, 99.99, 100.0)
+LOG_SUFFIXES = (".txt", ".hlog", ".hdr")
+
+
+def zigzag_varints(data, offset, end):
+    """Yield the zigzag LEB128 int64 values of data[offset:end]."""
+    while offset < end:
+        value = 0
+        shift = 0
+        for _ in range(8):
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        else:
+            # the 9th byte carries 8 bits
+            value |= data[offset] << 56
+            offset += 1
+        yield (value >> 1) ^ -(value & 1)
+
+
+def zigzag_bytes(value):
+    value = ((value << 1) ^ (value >> 63)) & 0xFFFFFFFFFFFFFFFF
+    out = bytearray()
+    for _ in range(8):
+        if value >> 7 == 0:
+            out.append(value)
+            return out
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+class Histogram:
+    """HdrHistogram counts, with the layout of the C and Java versions."""
+
+    def __init__(self, lowest=1, highest=3600 * 1000 * 1000, digits=3, ratio=1.0):
+        self.lowest = lowest
+        self.highest = highest
+        self.digits = digits
+        self.ratio = ratio
+        largest_single_unit = 2 * 10**digits
+        sub_bucket_count_magnitude = int(np.ceil(np.log2(largest_single_unit)))
+        self.half_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.unit_magnitude = int(np.floor(np.log2(lowest)))
+        self.sub_bucket_count = 1 << (self.half_magnitude + 1)
+        self.half_count = self.sub_bucket_count // 2
+        smallest_untrackable = self.sub_bucket_count << self.unit_magnitude
+        buckets = 1
+        while smallest_untrackable <= highest:
+            if smallest_untrackable > (1 << 62):
+                buckets += 1
+                break
+            smallest_untrackable <<= 1
+            buckets += 1
+        self.counts = np.zeros((buckets + 1) * self.half_count, dtype=np.int64)
+
+    def same_layout(self, other):
+        return (
+            self.unit_magnitude == other.unit_magnitude
+            and self.half_magnitude == other.half_magnitude
+        )
+
+    def values(self, indexes):
+        """Return the lowest value of every counts index."""
+        indexes = np.asarray(indexes, dtype=np.int64)
+        buckets = (indexes >> self.half_magnitude) - 1
+        sub_buckets = (indexes & (self.half_count - 1)) + self.half_count
+        first = buckets < 0
+        sub_buckets[first] -= self.half_count
+        buckets[first] = 0
+        return sub_buckets << (buckets + self.unit_magnitude)
+
+    def widths(self, indexes):
+        """Return the size of the range of values of every counts index."""
+        buckets = np.maximum((np.asarray(indexes) >> self.half_magnitude) - 1, 0)
+        return np.left_shift(1, buckets + self.unit_magnitude)
+
+    def index(self, value):
+        """Return the counts index of a value."""
+        bucket = max(
+            (value | ((self.sub_bucket_count - 1) << self.unit_magnitude)).bit_length()
+            - self.unit_magnitude
+            - self.half_magnitude
+            - 1,
+            0,
+        )
+        sub_bucket = value >> (bucket + self.unit_magnitude)
+        return ((bucket + 1) << self.half_magnitude) + sub_bucket - self.half_count
+
+    def record(self, value, count=1):
+        index = self.index(int(value))
+        if index >= len(self.counts):
+            raise ValueError("{} is above {}".format(value, self.highest))
+        self.counts[index] += count
+
+    def add(self, other):
+        """Add the counts of other, exactly when both have the same precision.
+
+        Otherwise every bucket of other is recorded at its lowest value.
+        """
+        if self.same_layout(other):
+            if len(other.counts) > len(self.counts):
+                self.counts = np.pad(
+                    self.counts, (0, len(other.counts) - len(self.counts))
+                )
+                self.highest = other.highest
+            self.counts[: len(other.counts)] += other.counts
+            return
+        indexes = np.flatnonzero(other.counts)
+        for value, count in zip(other.values(indexes), other.counts[indexes]):
+            self.record(int(value), int(count))
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def stats(self, percentiles=DEFAULT_PERCENTILES):
+        """Return {"count", "min", "mean", "max", "p<percentile>"} in raw units.
+
+        Percentiles are the highest value of the bucket they fall in, like
+        hdr_value_at_percentile.
+        """
+        indexes = np.flatnonzero(self.counts)
+        if len(indexes) == 0:
+            return {"count": 0}
+        counts = self.counts[indexes]
+        lows = self.values(indexes)
+        widths = self.widths(indexes)
+        total = int(counts.sum())
+        stats = {
+            "count": total,
+            "min": int(lows[0]),
+            "mean": float((counts * (lows + widths // 2)).sum() / total),
+            "max": int(lows[-1] + widths[-1] - 1),
+        }
+        cumulative = np.cumsum(counts)
+        for percentile in percentiles:
+            rank = max(int(percentile / 100 * total + 0.5), 1)
+            at = min(int(np.searchsorted(cumulative, rank)), len(indexes) - 1)
+            stats["p{:g}".format(percentile)] = int(lows[at] + widths[at] - 1)
+        return stats
+
+    def encode(self):
+        """Return the base64 V2 compressed encoding of the histogram."""
+        payload = bytearray()
+        previous = 0
+        for index in np.flatnonzero(self.counts):
+            if index - previous > 1:
+                payload += zigzag_bytes(-int(index - previous))
+            elif index - previous == 1:
+                payload += zigzag_bytes(0)
+            payload += zigzag_bytes(int(self.counts[index]))
+            previous = index + 1
+        header = HEADER.pack(
+            ENCODING_COOKIE,
+            len(payload),
+            0,
+            self.digits,
+            self.lowest,
+            self.highest,
+            self.ratio,
+        )
+        deflated = zlib.compress(header + bytes(payload))
+        blob = COMPRESSED_HEADER.pack(COMPRESSED_COOKIE, len(deflated)) + deflated
+        return base64.b64encode(blob).decode()
+
+    @classmethod
+    def decode(cls, encoded):
+        """Return the histogram of a base64 V2 (compressed or not) encoding."""
+        data = base64.b64decode(encoded)
+        cookie, length = COMPRESSED_HEADER.unpack_from(data)
+        if cookie & COOKIE_MASK == COMPRESSED_COOKIE & COOKIE_MASK:
+            data = zlib.decompress(data[8 : 8 + length])
+        cookie, length, offset, digits, lowest, highest, ratio = HEADER.unpack_from(
+            data
+        )
+        if cookie & COOKIE_MASK != ENCODING_COOKIE & COOKIE_MASK:
+            raise ValueError("not a V2 encoded histogram, cookie {:#x}".format(cookie))
+        if offset != 0:
+            raise ValueError("normalizing index offset {} unsupported".format(offset))
+        histogram = cls(lowest, highest, digits, ratio)
+        index = 0
+        for value in zigzag_varints(data, HEADER.size, HEADER.size + length):
+            if value < 0:
+                index -= value
+                continue
+            histogram.counts[index] = value
+            index += 1
+        return histogram
+
+
+def read_log(path):
+    """Return the sum of the histograms of an HdrHistogram log, or None."""
+    histogram = None
+    with open(path, "r", errors="replace") as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith(("#", '"')):
+                continue
+            encoded = line.rsplit(",", 1)[-1]
+            if not encoded.startswith("HIST"):
+                continue
+            interval = Histogram.decode(encoded)
+            if histogram is None:
+                histogram = interval
+            else:
+                histogram.add(interval)
+    return histogram
+
+
+def write_log(path, histogram, start=None, units_per_ms=DEFAULT_UNITS_PER_MS):
+    """Write histogram as a one interval HdrHistogram log."""
+    start = time.time() if start is None else start
+    stats = histogram.stats(())
+    with open(path + ".tmp", "w") as fd:
+        fd.write("#[Histogram log format version 1.3]\n")
+        fd.write("#[StartTime: {:.3f} (seconds since epoch)]\n".format(start))
+        fd.write(
+            '"StartTimestamp","Interval_Length","Interval_Max",'
+            '"Interval_Compressed_Histogram"\n'
+        )
+        fd.write(
+            "0.000,0.000,{:.3f},{}\n".format(
+                stats.get("max", 0) / units_per_ms, histogram.encode()
+            )
+        )
+    os.replace(path + ".tmp", path)
+
+
+def log_paths(paths):
+    """Yield the histogram logs of paths, files or directories walked."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(LOG_SUFFIXES):
+                    yield os.path.join(dirpath, name)
+
+
+def merge(paths):
+    """Return ({path: histogram}, merged histogram) of the logs in paths.
+
+    Files without any histogram (e.g. other .txt outputs) are left out.
+    """
+    histograms = {}
+    merged = None
+    for path in log_paths(paths):
+        try:
+            histogram = read_log(path)
+        except (ValueError, zlib.error, struct.error):
+            continue
+        if histogram is None:
+            continue
+        histograms[path] = histogram
+        if merged is None:
+            merged = Histogram(
+                histogram.lowest, histogram.highest, histogram.digits, histogram.ratio
+            )
+        merged.add(histogram)
+    return histograms, merged
+
+
+def print_stats(name, stats, percentiles, units_per_ms, fd=sys.stdout):
+    if not stats["count"]:
+        fd.write("{:<50} {:>12}\n".format(name, 0))
+        return
+    fd.write(
+        "{:<50} {:>12} {:>10.3f}".format(
+            name, stats["count"], stats["mean"] / units_per_ms
+        )
+        + "".join(
+            " {:>10.3f}".format(stats["p{:g}".format(p)] / units_per_ms)
+            for p in percentiles
+        )
+        + "\n"
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Merge HdrHistogram latency logs and print their percentiles.",
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="histogram logs, or directories to look for them"
+    )
+    parser.add_argument(
+        "--percentile",
+        action="append",
+        type=float,
+        default=None,
+        help="percentile to print, can be repeated",
+    )
+    parser.add_argument(
+        "--units-per-ms",
+        type=float,
+        default=DEFAULT_UNITS_PER_MS,
+        help="recorded values per millisecond, 1000 for memtier",
+    )
+    parser.add_argument(
+        "--output", default=None, help="HdrHistogram log to write the merge to"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    percentiles = args.percentile or DEFAULT_PERCENTILES
+    histograms, merged = merge(args.paths)
+    if merged is None:
+        print(
+            "Error on {}. No histogram found".format(" ".join(args.paths)),
+            file=sys.stderr,
+        )
+        return 1
+    sys.stdout.write(
+        "{:<50} {:>12} {:>10}".format("log", "count", "mean_ms")
+        + "".join(" {:>10}".format("p{:g}_ms".format(p)) for p in percentiles)
+        + "\n"
+    )
+    for path, histogram in histograms.items():
+        print_stats(path, histogram.stats(percentiles), percentiles, args.units_per_ms)
+    print_stats("merged", merged.stats(percentiles), percentiles, args.units_per_ms)
+    if args.output is not None:
+        write_log(args.output, merged, units_per_ms=args.units_per_ms)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
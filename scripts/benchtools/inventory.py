@@ -0,0 +1,180 @@
+"""Fleet-wide inventory of every live terraform setup.
+
+Scans the setup directories under terraform/ in parallel and merges their
+outputs into one JSON inventory plus an Ansible INI inventory. Setups whose
+local state did not change since the previous scan are carried over unread,
+those on a remote backend are read again every time.
+"""
+import argparse
+import concurrent.futures
+import fnmatch
+import json
+import os
+import re
+import sys
+
+from benchtools import prepare_ips
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "terraform")
+IP_OUTPUT_RE = re.compile(r"^(?P<group>.+)_(?P<kind>public|private)_ips?$")
+SKIP_DIRS = (".terraform", "deps", "terraform.tfstate.d")
+
+
+def setup_dirs(root, patterns=("*",)):
+    """Yield (name, path) for every directory holding terraform files."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        if not any(f.endswith(".tf") for f in filenames):
+            continue
+        name = os.path.relpath(dirpath, root)
+        if any(fnmatch.fnmatch(name, p) for p in patterns):
+            yield name, dirpath
+
+
+def read_setup(setup_dir):
+    # runs inside the pool, errors are reported back instead of raised
+    try:
+        return prepare_ips.load_outputs(setup_dir), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def build_entry(setup_dir, key, outputs):
+    groups = {}
+    variables = {}
+    for name, value in sorted(outputs.items()):
+        match = IP_OUTPUT_RE.match(name)
+        if match is None:
+            if not isinstance(value, (list, dict)):
+                variables[name] = value
+            continue
+        hosts = groups.setdefault(match.group("group"), [])
+        ips = prepare_ips.flatten(value)
+        while len(hosts) < len(ips):
+            hosts.append({})
+        for host, ip in zip(hosts, ips):
+            host["{}_ip".format(match.group("kind"))] = ip
+    return {"dir": setup_dir, "key": key, "vars": variables, "groups": groups}
+
+
+def scan(root, patterns=("*",), previous=None, jobs=None, refresh=False):
+    """Return (inventory, errors), re-reading only the setups that changed."""
+    previous = previous or {}
+    setups = {}
+    todo = {}
+    for name, setup_dir in setup_dirs(root, patterns):
+        key = prepare_ips.state_key(setup_dir)
+        if key is None and not prepare_ips.is_remote(setup_dir):
+            # never applied from this checkout
+            continue
+        entry = previous.get(name)
+        unchanged = key is not None and entry is not None and entry["key"] == key
+        if unchanged and not refresh:
+            setups[name] = entry
+        else:
+            todo[name] = (setup_dir, key)
+
+    errors = {}
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(read_setup, setup_dir): name
+                for name, (setup_dir, _) in todo.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                setup_dir, key = todo[name]
+                outputs, error = future.result()
+                if error is not None:
+                    errors[name] = error
+                elif outputs:
+                    setups[name] = build_entry(setup_dir, key, outputs)
+    return {k: setups[k] for k in sorted(setups)}, errors
+
+
+def group_name(*parts):
+    return re.sub(r"[^A-Za-z0-9_]", "_", "_".join(parts))
+
+
+def render_ansible(inventory):
+    """Render the inventory in Ansible INI format, one group per host role."""
+    lines = []
+    for name, entry in inventory.items():
+        setup_group = group_name(name)
+        ssh_user = entry["vars"].get("server_ssh_user", entry["vars"].get("ssh_user"))
+        children = []
+        for role, hosts in sorted(entry["groups"].items()):
+            children.append(group_name(name, role))
+            lines.append("[{}]".format(children[-1]))
+            for host in hosts:
+                if "public_ip" not in host:
+                    continue
+                line = host["public_ip"]
+                if "private_ip" in host:
+                    line += " private_ip={}".format(host["private_ip"])
+                if ssh_user:
+                    line += " ansible_user={}".format(ssh_user)
+                lines.append(line)
+            lines.append("")
+        lines.append("[{}:children]".format(setup_group))
+        lines.extend(children)
+        lines.append("")
+        if entry["vars"]:
+            lines.append("[{}:vars]".format(setup_group))
+            for k, v in sorted(entry["vars"].items()):
+                lines.append("{}={}".format(k, v))
+            lines.append("")
+    return "\n".join(lines)
+
+
+def load_inventory(path):
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)["setups"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_file(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fd:
+        fd.write(content)
+    os.replace(tmp_path, path)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Export the IPs of every live terraform setup.",
+    )
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="terraform directory")
+    parser.add_argument(
+        "--pattern",
+        action="append",
+        default=None,
+        help="glob over the setup names, e.g. 're-*'. Can be repeated",
+    )
+    parser.add_argument("--output", default="inventory.json", help="JSON inventory")
+    parser.add_argument("--ansible", default="inventory.ini", help="Ansible inventory")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument(
+        "--refresh", action="store_true", help="re-read every setup"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    previous = load_inventory(args.output)
+    inventory, errors = scan(
+        args.root, args.pattern or ["*"], previous, args.jobs, args.refresh
+    )
+    write_file(args.output, json.dumps({"setups": inventory}, indent=" "))
+    write_file(args.ansible, render_ansible(inventory))
+    for name, error in sorted(errors.items()):
+        print("Error on {}. {}".format(name, error), file=sys.stderr)
+    print("Total live setups {}".format(len(inventory)))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
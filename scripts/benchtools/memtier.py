@@ -0,0 +1,339 @@
+"""Index the memtier results of redis-benchmarks-spec-client-runner logs.
+
+Every log is read once and its result tables are indexed by
+(test, vm, run). The runner prints one table per test as it goes ("# Results
+for <test> test-case on <setup> topology") and one table for the entire
+suite at the end; the per-test tables are used when present, the suite one
+otherwise (e.g. logs grep-ed down to their memtier rows). A test that shows up
+several times in the logs of a vm (the runner was run again) gets one run per
+occurrence.
+
+Logs are memory-mapped and only their table lines are looked at, and a
+directory tree of logs is parsed by a process pool, one log per task, the
+per-log indexes being merged at the end.
+
+Besides ops/sec, the average latency, p50/p99/p99.9 latencies and KB/sec are
+kept, as typed columns, so vms can be ranked by tail latency as well.
+"""
+import argparse
+import array
+import concurrent.futures
+import csv
+import functools
+import math
+import mmap
+import os
+import re
+import sys
+
+TEST_PREFIX = "memtier_benchmark-"
+# the only lines that matter, table names and table rows. Anchored on the
+# newline rather than with ^ so that re can jump from one newline to the next
+LINE_RE = re.compile(rb"\n([#|][^\n]*)")
+TABLE_RE = re.compile(r"^#+ Results for (?P<test>\S+) test-case")
+# "AGGREGATED AVERAGE RESULTS (3 runs)".Totals."Ops/sec"
+METRIC_RE = re.compile(r'^\$?\.?"(?P<section>[^"]+)"\.(?P<field>.+)$')
+# sections to take a metric from, in order of preference
+SECTIONS = ("AGGREGATED AVERAGE RESULTS", "ALL STATS", "BEST RUN RESULTS")
+# column -> memtier Totals fields it is read from, first one found wins
+COLUMNS = {
+    "ops_sec": ("Ops/sec",),
+    "latency_avg_ms": ("Average Latency", "Latency"),
+    "p50_ms": ("Percentile Latencies.p50.00", "Percentile Latencies.p50.0"),
+    "p99_ms": ("Percentile Latencies.p99.00", "Percentile Latencies.p99.0"),
+    "p99_9_ms": ("Percentile Latencies.p99.90", "Percentile Latencies.p99.9"),
+    "kb_sec": ("KB/sec",),
+}
+# the other columns rank lower first
+HIGHER_IS_BETTER = ("ops_sec", "kb_sec")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_metric(path):
+    """Return (section, field) of a metric JSON path, or None."""
+    match = METRIC_RE.match(path)
+    if match is None:
+        return None
+    field = match.group("field").replace('"', "")
+    if field.startswith("Totals."):
+        field = field[len("Totals.") :]
+    return match.group("section"), field
+
+
+def table_lines(path):
+    """Yield the table lines of a log, skipping everything else in C."""
+    with open(path, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:1] in (b"#", b"|"):
+                end = mm.find(b"\n")
+                yield mm[: end if end >= 0 else len(mm)].decode(errors="replace")
+            for match in LINE_RE.finditer(mm):
+                yield match.group(1).decode(errors="replace")
+
+
+def parse_log(path, vm):
+    """Return the index {(test, vm, run): {metric: value}} of one log.
+
+    Metrics are keyed by (section, field), e.g. ("ALL STATS", "Ops/sec").
+    """
+    index = {}
+    runs = {}
+    suite = {}
+    current = None
+    for line in table_lines(path):
+        if line.startswith("#"):
+            match = TABLE_RE.match(line)
+            current = None
+            if match is not None:
+                test = match.group("test")
+                runs[test] = runs.get(test, 0) + 1
+                current = index.setdefault((test, vm, runs[test]), {})
+            continue
+        cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+        try:
+            value = float(cells[-1])
+        except ValueError:
+            # header or separator row
+            continue
+        metric = parse_metric(cells[-2]) if len(cells) >= 2 else None
+        if metric is None:
+            continue
+        if len(cells) == 3:
+            suite.setdefault((cells[0], metric), []).append(value)
+        elif current is not None:
+            current[metric] = value
+    for (test, metric), values in suite.items():
+        if test in runs:
+            continue
+        for run, value in enumerate(values, start=1):
+            index.setdefault((test, vm, run), {})[metric] = value
+    return index
+
+
+def merge(tables):
+    """Merge per-log indexes, runs of a later log come after the earlier ones."""
+    index = {}
+    last = {}
+    for table in tables:
+        offset = dict(last)
+        for (test, vm, run), metrics in table.items():
+            run += offset.get((test, vm), 0)
+            index[(test, vm, run)] = metrics
+            last[(test, vm)] = max(run, last.get((test, vm), 0))
+    return index
+
+
+def metric(metrics, field):
+    """Return the value of field from the preferred section, or None."""
+    for prefix in SECTIONS:
+        for (section, name), value in metrics.items():
+            if name == field and section.startswith(prefix):
+                return value
+    return None
+
+
+def columns(metrics):
+    """Return {column: value} of metrics, None for the ones not found."""
+    values = {}
+    for name, fields in COLUMNS.items():
+        values[name] = None
+        for field in fields:
+            values[name] = metric(metrics, field)
+            if values[name] is not None:
+                break
+    return values
+
+
+def log_files(results_dir, suffix):
+    """Yield (vm, path) of every <vm><suffix> log under results_dir."""
+    for dirpath, dirnames, filenames in os.walk(results_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(suffix):
+                yield name[: -len(suffix)], os.path.join(dirpath, name)
+
+
+def parse_file(args):
+    # pool worker
+    path, vm = args
+    return parse_log(path, vm)
+
+
+def parse_files(files, jobs=None):
+    """Return the index of every (path, vm) of files, in order.
+
+    The logs are parsed by jobs processes at once.
+    """
+    if jobs == 1 or len(files) < 2:
+        return [parse_file(args) for args in files]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # biggest logs first, so that a long one does not start last
+        futures = {
+            executor.submit(parse_file, args): args
+            for args in sorted(files, key=lambda f: -os.path.getsize(f[0]))
+        }
+        tables = {futures[future]: future.result() for future in futures}
+    return [tables[args] for args in files]
+
+
+def build_index(results_dir, suffix, jobs=None):
+    """Index every log under results_dir, jobs processes at once.
+
+    Logs of the same vm (e.g. from several sweeps) add up as more runs, in
+    the order of their paths.
+    """
+    files = [(path, vm) for vm, path in log_files(results_dir, suffix)]
+    return merge(parse_files(files, jobs))
+
+
+def short_name(test):
+    return test[len(TEST_PREFIX) :] if test.startswith(TEST_PREFIX) else test
+
+
+def matrix(index, tests=None, vms=None):
+    """Yield (test, vm, run, metrics) over tests x vms, in the given order.
+
+    tests default to the order they were found in, vms are sorted. Cells without
+    results are yielded with run and metrics set to None.
+    """
+    found = {}
+    for test, vm, run in index:
+        found.setdefault(test, {}).setdefault(vm, []).append(run)
+    if tests is None:
+        tests = list(found)
+    if vms is None:
+        vms = sorted({vm for _, vm, _ in index})
+    for test in tests:
+        for vm in vms:
+            runs = sorted(found.get(test, {}).get(vm, []))
+            if not runs:
+                yield test, vm, None, None
+            for run in runs:
+                yield test, vm, run, index[(test, vm, run)]
+
+
+class Results:
+    """The (test, vm, run) matrix as columns.
+
+    test and vm are lists of str, run an array of int (0 for a cell without
+    results) and every metric column an array of float, NaN when missing.
+    """
+
+    def __init__(self):
+        self.test = []
+        self.vm = []
+        self.run = array.array("i")
+        self.columns = {name: array.array("d") for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.test)
+
+    def __getitem__(self, name):
+        if name in self.columns:
+            return self.columns[name]
+        return getattr(self, name)
+
+    def append(self, test, vm, run, metrics):
+        self.test.append(test)
+        self.vm.append(vm)
+        self.run.append(run or 0)
+        values = columns(metrics) if metrics is not None else {}
+        for name in COLUMNS:
+            value = values.get(name)
+            self.columns[name].append(math.nan if value is None else value)
+
+    @classmethod
+    def from_index(cls, index, tests=None, vms=None):
+        results = cls()
+        for test, vm, run, metrics in matrix(index, tests, vms):
+            results.append(test, vm, run, metrics)
+        return results
+
+    def rows(self):
+        """Yield (test, vm, run, {column: value}) in order."""
+        for i in range(len(self)):
+            values = {name: column[i] for name, column in self.columns.items()}
+            yield self.test[i], self.vm[i], self.run[i], values
+
+
+def rank(results, column):
+    """Return {test: [(vm, run, value), ...]} best first by column.
+
+    Cells without a value for column are left out.
+    """
+    ranking = {}
+    for test, vm, run, values in results.rows():
+        if not math.isnan(values[column]):
+            ranking.setdefault(test, []).append((vm, run, values[column]))
+    for cells in ranking.values():
+        cells.sort(key=lambda cell: cell[2], reverse=column in HIGHER_IS_BETTER)
+    return ranking
+
+
+def write_csv(fd, results):
+    writer = csv.writer(fd, lineterminator="\n")
+    writer.writerow(["test", "vm", "run"] + list(results.columns))
+    for test, vm, run, values in results.rows():
+        writer.writerow(
+            [short_name(test), vm, run or ""]
+            + ["" if math.isnan(v) else "{:.3f}".format(v) for v in values.values()]
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Index memtier results logs into a (test, vm, run) CSV.",
+    )
+    parser.add_argument("--results-dir", default="results-final", help="logs dir")
+    parser.add_argument(
+        "--suffix",
+        default="-priority-10.log",
+        help="log file name suffix, what comes before it is the vm",
+    )
+    parser.add_argument(
+        "--test",
+        action="append",
+        default=None,
+        help="test to include, in order. Can be repeated, defaults to all",
+    )
+    parser.add_argument(
+        "--vm",
+        action="append",
+        default=None,
+        help="vm to include, in order. Can be repeated, defaults to all",
+    )
+    parser.add_argument("--output", default=None, help="CSV file, default stdout")
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="worker processes, one per core"
+    )
+    parser.add_argument(
+        "--rank",
+        default=None,
+        choices=list(COLUMNS),
+        help="print the vms of every test best first by this column instead",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    index = build_index(args.results_dir, args.suffix, args.jobs)
+    results = Results.from_index(index, args.test, args.vm)
+    if args.rank is not None:
+        for test, cells in rank(results, args.rank).items():
+            print(short_name(test))
+            for pos, (vm, run, value) in enumerate(cells, start=1):
+                print("  {:>3}. {:<20} run {:<3} {:.3f}".format(pos, vm, run, value))
+        return 0
+    if args.output is None:
+        write_csv(sys.stdout, results)
+    else:
+        with open(args.output, "w") as fd:
+            write_csv(fd, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
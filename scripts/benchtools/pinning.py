@@ -0,0 +1,320 @@
+"""Plan the CPUs of redis-server, its io-threads, the benchmark client and NIC IRQs.
+
+The topology is read from sysfs: the online CPUs, their physical core and
+SMT siblings, the L3 cache they share and their NUMA node. Everything that
+serves requests is kept on the NUMA node of the NIC (node 0 without one):
+
+- NIC IRQs on the first cores of the node (core 0 taking the kernel
+  housekeeping anyway),
+- every redis-server on --io-threads whole cores, one thread per physical
+  core, their SMT siblings being left idle,
+- the benchmark client threads on the cores left, those not sharing an L3
+  cache with a server first, one thread per core of the node left unless
+  --client-threads asks for more.
+
+Cores are only shared, with a warning, when there are not enough of them.
+The plan is printed as shell assignments to eval (SERVER_CPUS is an array
+with the cpu list of every redis-server, for taskset -c), or as JSON.
+Only the standard library is used, so the file can be copied alone to a
+VM and run there with python3.
+"""
+import argparse
+import json
+import os
+import sys
+
+DEFAULT_SYSFS = "/sys"
+DEFAULT_PROCFS = "/proc"
+
+
+def parse_list(text):
+    """Return the ints of a sysfs cpu list, e.g. "0-3,8-11"."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        cpus.extend(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def format_list(cpus):
+    """Return the sysfs cpu list of cpus, ranges collapsed."""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(low) if low == high else "{}-{}".format(low, high) for low, high in ranges
+    )
+
+
+def read(path, default=None):
+    try:
+        with open(path, "r") as fd:
+            return fd.read().strip()
+    except OSError:
+        return default
+
+
+class Topology:
+    """The online CPUs of a host and how they share cores, L3 and memory."""
+
+    def __init__(self, sysfs=DEFAULT_SYSFS):
+        base = os.path.join(sysfs, "devices", "system")
+        self.cpus = parse_list(read(os.path.join(base, "cpu", "online"), "0"))
+        self.siblings = {}
+        self.l3 = {}
+        self.node = {}
+        for cpu in self.cpus:
+            path = os.path.join(base, "cpu", "cpu{}".format(cpu))
+            siblings = read(os.path.join(path, "topology", "thread_siblings_list"))
+            self.siblings[cpu] = tuple(parse_list(siblings or str(cpu)))
+            # without an L3 (or a cache description), the package shares it
+            package = read(os.path.join(path, "topology", "physical_package_id"), "0")
+            self.l3[cpu] = "package{}".format(package)
+            try:
+                indexes = sorted(os.listdir(os.path.join(path, "cache")))
+            except OSError:
+                indexes = []
+            for index in indexes:
+                cache = os.path.join(path, "cache", index)
+                if read(os.path.join(cache, "level")) == "3":
+                    self.l3[cpu] = read(os.path.join(cache, "shared_cpu_list"))
+            self.node[cpu] = 0
+        nodes = os.path.join(base, "node")
+        if os.path.isdir(nodes):
+            for name in os.listdir(nodes):
+                if name.startswith("node") and name[4:].isdigit():
+                    for cpu in parse_list(read(os.path.join(nodes, name, "cpulist"))):
+                        self.node[cpu] = int(name[4:])
+
+    def cores(self):
+        """Return the physical cores, as sorted tuples of their online CPUs."""
+        cores = []
+        for cpu in self.cpus:
+            core = tuple(c for c in self.siblings[cpu] if c in self.node)
+            if core not in cores:
+                cores.append(core or (cpu,))
+        return cores
+
+
+def nic_of_default_route(procfs=DEFAULT_PROCFS):
+    """Return the interface of the default route, or None."""
+    route = read(os.path.join(procfs, "net", "route"), "")
+    for line in route.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) > 1 and fields[1] == "00000000":
+            return fields[0]
+    return None
+
+
+def nic_node(nic, sysfs=DEFAULT_SYSFS):
+    """Return the NUMA node of a NIC, None when unknown."""
+    path = os.path.join(sysfs, "class", "net", nic, "device", "numa_node")
+    node = read(path)
+    return int(node) if node is not None and int(node) >= 0 else None
+
+
+def nic_irqs(nic, sysfs=DEFAULT_SYSFS):
+    """Return the MSI IRQs of a NIC, one per queue, sorted."""
+    path = os.path.join(sysfs, "class", "net", nic, "device", "msi_irqs")
+    try:
+        return sorted(int(name) for name in os.listdir(path) if name.isdigit())
+    except OSError:
+        return []
+
+
+def plan(
+    topology, servers=1, io_threads=1, client_threads=None, irq_cores=0, node=None
+):
+    """Return the pinning plan as a dict.
+
+    "servers" is the cpu list of every redis-server, "client" and "irqs" the
+    cpus of the benchmark client and of the NIC IRQs, "client_threads" the
+    threads to run the client with and "warnings" the cores that had to be
+    shared.
+    """
+    nodes = sorted(set(topology.node.values()))
+    node = nodes[0] if node is None or node not in nodes else node
+    domains = []
+    for cpu in topology.cpus:
+        if topology.l3[cpu] not in domains:
+            domains.append(topology.l3[cpu])
+    # the cores of node first, L3 domain by L3 domain
+    cores = sorted(
+        topology.cores(),
+        key=lambda core: (
+            topology.node[core[0]] != node,
+            domains.index(topology.l3[core[0]]),
+            core,
+        ),
+    )
+    free = list(cores)
+    # SMT siblings of the cores taken, used before sharing a cpu outright
+    spare = []
+    warnings = []
+
+    def take(count, role, avoid=()):
+        # count cpus: one per free core (the cores of node first, and of those
+        # the ones outside of the avoided L3 domains), then SMT siblings, then
+        # shared cpus
+        picked = sorted(
+            free,
+            key=lambda core: (
+                topology.node[core[0]] != node,
+                topology.l3[core[0]] in avoid,
+            ),
+        )[:count]
+        chosen = []
+        siblings = []
+        for core in picked:
+            free.remove(core)
+            chosen.append(core[0])
+            siblings.extend(core[1:])
+        spare[:0] = siblings
+        if len(chosen) < count and spare:
+            used = spare[: count - len(chosen)]
+            del spare[: len(used)]
+            chosen.extend(used)
+            warnings.append("{} runs on {} SMT siblings".format(role, len(used)))
+        if len(chosen) < count:
+            missing = count - len(chosen)
+            warnings.append("{} shares {} cpus with other roles".format(role, missing))
+            shared = [cpu for cpu in topology.cpus if cpu not in chosen]
+            shared = shared or topology.cpus
+            chosen.extend(shared[i % len(shared)] for i in range(missing))
+        return chosen
+
+    irqs = take(irq_cores, "irqs") if irq_cores else []
+    server_cpus = [
+        take(io_threads, "redis-server {}".format(i)) for i in range(servers)
+    ]
+    server_l3 = {topology.l3[cpu] for cpus in server_cpus for cpu in cpus}
+    if client_threads is None:
+        # a thread per core left on node, or at least one
+        client_threads = max(
+            len([core for core in free if topology.node[core[0]] == node]), 1
+        )
+    client = take(client_threads, "client", avoid=server_l3)
+    return {
+        "node": node,
+        "irqs": sorted(irqs),
+        "servers": [sorted(cpus) for cpus in server_cpus],
+        "client": sorted(client),
+        "client_threads": client_threads,
+        "warnings": warnings,
+    }
+
+
+def apply_irqs(irqs, cpus, procfs=DEFAULT_PROCFS):
+    """Spread irqs round robin over cpus, return [(path, error)]."""
+    errors = []
+    for i, irq in enumerate(irqs):
+        path = os.path.join(procfs, "irq", str(irq), "smp_affinity_list")
+        try:
+            with open(path, "w") as fd:
+                fd.write(str(cpus[i % len(cpus)]))
+        except OSError as e:
+            errors.append((path, e))
+    return errors
+
+
+def shell(result):
+    """Return the plan as bash assignments."""
+    lines = [
+        "NUMA_NODE={}".format(result["node"]),
+        "SERVER_CPUS=({})".format(
+            " ".join('"{}"'.format(format_list(cpus)) for cpus in result["servers"])
+        ),
+        'CLIENT_CPUS="{}"'.format(format_list(result["client"])),
+        "CLIENT_THREADS={}".format(result["client_threads"]),
+        'IRQ_CPUS="{}"'.format(format_list(result["irqs"])),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Plan the CPUs of redis-server, the benchmark client and the "
+        "NIC IRQs from the CPU topology.",
+    )
+    parser.add_argument(
+        "--servers", type=int, default=1, help="redis-server processes, 0 on clients"
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=1,
+        help="redis-server io-threads, the main thread included",
+    )
+    parser.add_argument(
+        "--client-threads",
+        type=int,
+        default=None,
+        help="benchmark client threads, defaults to one per core left on the node",
+    )
+    parser.add_argument(
+        "--nic",
+        default=None,
+        help="NIC serving the benchmark, 'auto' for the one of the default route",
+    )
+    parser.add_argument(
+        "--irq-cores",
+        type=int,
+        default=None,
+        help="cores for the NIC IRQs, default 1 with --nic and 0 without",
+    )
+    parser.add_argument(
+        "--apply-irqs",
+        action="store_true",
+        help="set the affinity of the NIC IRQs to the planned cpus, needs root",
+    )
+    parser.add_argument("--format", default="shell", choices=["shell", "json"])
+    parser.add_argument("--sysfs", default=DEFAULT_SYSFS, help=argparse.SUPPRESS)
+    parser.add_argument("--procfs", default=DEFAULT_PROCFS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.apply_irqs and args.nic is None:
+        parser.error("--apply-irqs needs --nic")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    nic = args.nic
+    if nic == "auto":
+        nic = nic_of_default_route(args.procfs)
+    irq_cores = args.irq_cores
+    if irq_cores is None:
+        irq_cores = 1 if nic is not None else 0
+    topology = Topology(args.sysfs)
+    result = plan(
+        topology,
+        args.servers,
+        args.io_threads,
+        args.client_threads,
+        irq_cores,
+        nic_node(nic, args.sysfs) if nic is not None else None,
+    )
+    result["nic"] = nic
+    for warning in result["warnings"]:
+        print("Warning. {}".format(warning), file=sys.stderr)
+    if args.apply_irqs:
+        irqs = nic_irqs(nic, args.sysfs) if nic is not None else []
+        if not irqs:
+            print("Error on {}. No MSI IRQs found".format(nic), file=sys.stderr)
+            return 1
+        cpus = result["irqs"] or result["client"]
+        for path, error in apply_irqs(irqs, cpus, args.procfs):
+            print("Error on {}. {}".format(path, error), file=sys.stderr)
+    if args.format == "json":
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        sys.stdout.write(shell(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Render the bash ips file of a terraform setup from its outputs.
+
+Replaces the per-setup prepare_ips.py copies. Local states are read directly,
+remote backends go through the terraform binary. The outputs of a local state
+are cached under .terraform/ and only re-read when the state file serial or
+mtime changes. Remote backends are always asked, the .terraform/ backend
+pointer they leave locally does not change on apply or destroy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchtools import tfstate
+
+CACHE_FILE = os.path.join(".terraform", "prepare_ips.cache.json")
+SETUP_PREFIX = "perf-cto-RE-"
+
+NORMALIZERS = {
+    "underscore": lambda s: s.replace(".", "_").replace("-", "_"),
+    "dots": lambda s: s.replace(".", "_"),
+    "dashes": lambda s: s.replace(".", "-"),
+    "none": lambda s: s,
+}
+
+
+def is_remote(setup_dir):
+    """Return whether setup_dir was initialized with a remote backend only."""
+    return tfstate.local_state_path(setup_dir) is None and os.path.isfile(
+        os.path.join(setup_dir, tfstate.BACKEND_STATE_FILE)
+    )
+
+
+def state_key(setup_dir):
+    """Return the cache key of the local state of setup_dir, or None.
+
+    None without a local state, remote states having no local trace of their
+    changes.
+    """
+    path = tfstate.local_state_path(setup_dir)
+    if path is None or not os.path.isfile(path):
+        return None
+    serial = tfstate.read_serial(path)
+    return {"path": path, "serial": serial, "mtime": os.stat(path).st_mtime_ns}
+
+
+def terraform_output(setup_dir):
+    output = subprocess.run(
+        ["terraform", "output", "-json"],
+        cwd=setup_dir,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return {k: v["value"] for k, v in json.loads(output.stdout.decode()).items()}
+
+
+def read_cache(setup_dir):
+    try:
+        with open(os.path.join(setup_dir, CACHE_FILE), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(setup_dir, key, outputs):
+    path = os.path.join(setup_dir, CACHE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump({"key": key, "outputs": outputs}, fd)
+    os.replace(tmp_path, path)
+
+
+def load_outputs(setup_dir=".", refresh=False):
+    """Return the terraform outputs of setup_dir as a name -> value dict."""
+    key = state_key(setup_dir)
+    if key is not None and not refresh:
+        cached = read_cache(setup_dir)
+        if cached is not None and cached["key"] == key:
+            return cached["outputs"]
+    local_path = tfstate.local_state_path(setup_dir)
+    if local_path is not None:
+        outputs = tfstate.read_outputs(local_path)
+    else:
+        outputs = terraform_output(setup_dir)
+    if key is not None:
+        write_cache(setup_dir, key, outputs)
+    return outputs
+
+
+def flatten(value):
+    # outputs come as a scalar, a list, or a list wrapping a splat list
+    if isinstance(value, list):
+        res = []
+        for v in value:
+            res.extend(flatten(v))
+        return res
+    return [value]
+
+
+def first(value):
+    values = flatten(value)
+    return values[0] if values else ""
+
+
+def detect_schema(outputs):
+    if "server_private_ip" in outputs:
+        return "server"
+    if "producer_public_ips" in outputs:
+        return "streaming"
+    if "client_private_ip" in outputs:
+        return "client"
+    raise ValueError(
+        "unknown terraform output schema: {}".format(", ".join(sorted(outputs)))
+    )
+
+
+def cluster_name(outputs, template=None, normalize="underscore"):
+    total_nodes = len(flatten(outputs["server_private_ip"]))
+    setup_name = outputs.get("setup_name", "")
+    if setup_name.startswith(SETUP_PREFIX):
+        setup_name = setup_name[len(SETUP_PREFIX) :]
+    if template is None:
+        template = "{setup_name}"
+        if not setup_name:
+            template = "{instance_type}_{total_nodes}_nodes"
+    name = template.format(
+        setup_name=setup_name,
+        instance_type=outputs.get("server_instance_type", ""),
+        total_nodes=total_nodes,
+        search_threads=outputs.get("search_threads", ""),
+        proxy_threads=outputs.get("proxy_threads", ""),
+    )
+    return NORMALIZERS[normalize](name)
+
+
+def render_ip_lines(lines, prefix, private_ips, public_ips):
+    lines.append("\n#internal IP addresses")
+    for keyn, v in enumerate(flatten(private_ips), start=1):
+        lines.append("{}{}_I={}".format(prefix, keyn, v))
+    lines.append("\n#external IP addresses")
+    for keyn, v in enumerate(flatten(public_ips), start=1):
+        lines.append("{}{}_E={}".format(prefix, keyn, v))
+
+
+def render(outputs, template=None, normalize="underscore", pem=None):
+    """Render the bash variables for the detected output schema."""
+    schema = detect_schema(outputs)
+    ssh_user = outputs.get("server_ssh_user", outputs.get("ssh_user"))
+    pem = pem or outputs.get("pem")
+    lines = ["#!/bin/bash\n"]
+
+    if schema == "streaming":
+        consumers = flatten(outputs["consumer_public_ips"])
+        producers = flatten(outputs["producer_public_ips"])
+        lines.append("CONSUMER_TOTAL_NODES={}\n".format(len(consumers)))
+        lines.append("PRODUCER_TOTAL_NODES={}\n".format(len(producers)))
+        if ssh_user:
+            lines.append("USER={}\n".format(ssh_user))
+        lines.append("\n#CONSUMERS external IP addresses")
+        for keyn, v in enumerate(consumers, start=1):
+            lines.append("CONSUMER_{}_E={}".format(keyn, v))
+        lines.append("\n#PRODUCERS external IP addresses")
+        for keyn, v in enumerate(producers, start=1):
+            lines.append("PRODUCER_{}_E={}".format(keyn, v))
+        return "\n".join(lines) + "\n"
+
+    if schema == "client":
+        total_nodes = len(flatten(outputs["client_private_ip"]))
+        lines.append("TOTAL_CLIENT_NODES={}\n".format(total_nodes))
+        render_ip_lines(
+            lines, "B_M", outputs["client_private_ip"], outputs["client_public_ip"]
+        )
+        return "\n".join(lines) + "\n"
+
+    total_nodes = len(flatten(outputs["server_private_ip"]))
+    lines.append("TOTAL_NODES={}\n".format(total_nodes))
+    if ssh_user:
+        lines.append('USER="{}"\n'.format(ssh_user))
+    if "search_threads" in outputs:
+        lines.append("SEARCH_THREADS={}\n".format(outputs["search_threads"]))
+    if "proxy_threads" in outputs:
+        lines.append("PROXY_THREADS={}\n".format(outputs["proxy_threads"]))
+    if pem:
+        lines.append("PEM={}\n".format(pem))
+    name = cluster_name(outputs, template, normalize)
+    lines.append('CLUSTER_NAME="{}"\n'.format(name))
+    if "client_public_ip" in outputs:
+        lines.append("\n#client external IP addresses")
+        lines.append("CLIENT_E={}\n".format(first(outputs["client_public_ip"])))
+    render_ip_lines(
+        lines, "B_M", outputs["server_private_ip"], outputs["server_public_ip"]
+    )
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Print the bash ips file of a terraform setup.",
+    )
+    parser.add_argument("--dir", default=".", help="terraform setup directory")
+    parser.add_argument(
+        "--cluster-name",
+        default=None,
+        help="CLUSTER_NAME template. Fields: setup_name (without the {} prefix), "
+        "instance_type, total_nodes, search_threads, proxy_threads".format(
+            SETUP_PREFIX
+        ),
+    )
+    parser.add_argument(
+        "--normalize",
+        default="underscore",
+        choices=sorted(NORMALIZERS),
+        help="character replacement applied to CLUSTER_NAME",
+    )
+    parser.add_argument("--pem", default=None, help="PEM path to export")
+    parser.add_argument(
+        "--refresh", action="store_true", help="ignore the cached outputs"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print the raw outputs as json"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    outputs = load_outputs(args.dir, refresh=args.refresh)
+    if args.json:
+        print(json.dumps(outputs, indent=" "))
+        return 0
+    sys.stdout.write(render(outputs, args.cluster_name, args.normalize, args.pem))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
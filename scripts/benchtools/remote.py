@@ -0,0 +1,409 @@
+"""Asyncio fan-out of remote commands over pooled SSH sessions.
+
+Output is read from the paramiko channels by the event loop as it arrives
+(no thread blocked per session), the number of hosts worked on at once is
+bounded, every host has its own timeout and its wall-clock latency reported.
+Optionally the output of every command is written, as it arrives, to its own
+timestamped log file.
+
+In batch mode the commands of a host are shipped as one bash script over the
+stdin of a single channel, so shell state (cd, exports) carries over between
+steps and only one round trip is paid; the exit code of every step is still
+reported back.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import re
+import secrets
+import sys
+import time
+
+from benchtools.sshpool import DEFAULT_USER, SSHPool, drain, finished
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_TIMEOUT_SECS = 600
+
+
+class HostResult:
+    def __init__(self, host):
+        self.host = host
+        self.exit_codes = []
+        self.error = None
+        self.latency = None
+
+    @property
+    def ok(self):
+        return self.error is None and not any(self.exit_codes)
+
+    def __repr__(self):
+        return "HostResult({}, exit_codes={}, error={}, latency={:.3f})".format(
+            self.host, self.exit_codes, self.error, self.latency or 0
+        )
+
+
+class LineSplitter:
+    """Turn output chunks into complete lines, per host and stream."""
+
+    def __init__(self):
+        self.partial = {}
+
+    def __call__(self, host, stream, data):
+        key = (host, stream)
+        lines = (self.partial.pop(key, b"") + data).split(b"\n")
+        if lines[-1]:
+            self.partial[key] = lines[-1]
+        for line in lines[:-1]:
+            self.write(host, stream, line)
+
+    def write(self, host, stream, line):
+        raise NotImplementedError
+
+    def flush(self):
+        for (host, stream), line in sorted(self.partial.items()):
+            self.write(host, stream, line)
+        self.partial = {}
+
+
+class CommandLog(LineSplitter):
+    """Timestamped, interleaved stdout/stderr log of one remote command."""
+
+    def __init__(self, log_dir, host, index, cmd):
+        super().__init__()
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", cmd.split("\n", 1)[0])[:40].strip("_")
+        host_dir = os.path.join(log_dir, host)
+        os.makedirs(host_dir, exist_ok=True)
+        self.path = os.path.join(host_dir, "{:02d}-{}.log".format(index, slug))
+        self.fd = open(self.path, "wb")
+        for line in cmd.splitlines():
+            self.fd.write("# {}\n".format(line).encode())
+
+    def write(self, host, stream, line):
+        now = datetime.datetime.now().isoformat(timespec="milliseconds")
+        self.fd.write("{} [{}] ".format(now, stream).encode() + line + b"\n")
+        # flushed per line so the log can be followed with tail -f
+        self.fd.flush()
+
+    def close(self, exit_code):
+        self.flush()
+        status = "interrupted" if exit_code is None else str(exit_code)
+        self.write(None, "exit", status.encode())
+        self.fd.close()
+
+
+def tee(*callbacks):
+    def on_output(host, stream, data):
+        for callback in callbacks:
+            callback(host, stream, data)
+
+    return on_output
+
+
+def exec_channel(pool, host, cmd, stdin=None):
+    # blocking round trips (connect, channel open, exec request)
+    chan = pool.transport(host).open_session()
+    chan.exec_command(cmd)
+    if stdin is not None:
+        chan.sendall(stdin)
+        chan.shutdown_write()
+    return chan
+
+
+def build_script(steps, token, errexit=False):
+    """Wrap the steps into one bash script reporting each exit code."""
+    lines = []
+    for index, step in enumerate(steps, start=1):
+        # a step reading stdin must not swallow the rest of the script
+        lines.append("{\n" + step + "\n} < /dev/null")
+        lines.append("__rc=$?")
+        lines.append("printf '%s {} %d\\n' {} $__rc".format(index, token))
+        if errexit:
+            lines.append("[ $__rc -eq 0 ] || exit $__rc")
+    return "\n".join(lines) + "\n"
+
+
+class StepDecoder:
+    """Pull the step exit code markers out of the stdout of a batch script.
+
+    Markers are forwarded as "step" output ("<step> <exit code>") and the
+    exit codes collected in order.
+    """
+
+    def __init__(self, token, on_output):
+        self.token = token.encode()
+        self.on_output = on_output
+        self.partial = b""
+        self.exit_codes = []
+
+    def __call__(self, host, stream, data):
+        if stream != "stdout":
+            self.on_output(host, stream, data)
+            return
+        data = self.partial + data
+        if self.token not in data:
+            # keep a tail that may be the beginning of a marker
+            cut = data.rfind(b"\n") + 1
+            self.partial = data[cut:]
+            if cut:
+                self.on_output(host, stream, data[:cut])
+            return
+        self.partial = b""
+        for line in data.splitlines(keepends=True):
+            if self.token not in line:
+                if line.endswith(b"\n"):
+                    self.on_output(host, stream, line)
+                else:
+                    self.partial = line
+                continue
+            if not line.endswith(b"\n"):
+                self.partial = line
+                continue
+            before, marker = line.split(self.token, 1)
+            if before:
+                self.on_output(host, stream, before + b"\n")
+            step, exit_code = marker.split()
+            self.exit_codes.append(int(exit_code))
+            self.on_output(host, "step", step + b" " + exit_code + b"\n")
+
+    def flush(self, host):
+        if self.partial:
+            self.on_output(host, "stdout", self.partial)
+            self.partial = b""
+
+
+async def stream_channel(chan, host, on_output):
+    """Forward the channel output as it arrives and return its exit code."""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    fd = chan.fileno()
+
+    def readable():
+        drain(chan, host, on_output)
+        if finished(chan) and not done.done():
+            done.set_result(None)
+
+    loop.add_reader(fd, readable)
+    try:
+        # data may have arrived before the reader was registered
+        readable()
+        await done
+    finally:
+        loop.remove_reader(fd)
+    drain(chan, host, on_output)
+    return chan.recv_exit_status()
+
+
+def ignore_output(host, stream, data):
+    pass
+
+
+class FanOut:
+    def __init__(
+        self,
+        pool,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT_SECS,
+        on_output=ignore_output,
+        log_dir=None,
+        batch=False,
+        errexit=False,
+    ):
+        self.pool = pool
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.on_output = on_output
+        self.log_dir = log_dir
+        self.batch = batch
+        self.errexit = errexit
+
+    async def run_channel(self, host, index, cmd, stdin=None, label=None):
+        loop = asyncio.get_running_loop()
+        log = None
+        callback = self.on_output
+        if self.log_dir is not None:
+            log = CommandLog(self.log_dir, host, index, label or cmd)
+            callback = tee(callback, log)
+        exit_code = None
+        decoder = None
+        if stdin is not None:
+            decoder = StepDecoder(self.token, callback)
+            callback = decoder
+        chan = await loop.run_in_executor(
+            self.executor, exec_channel, self.pool, host, cmd, stdin
+        )
+        try:
+            exit_code = await stream_channel(chan, host, callback)
+        finally:
+            chan.close()
+            if decoder is not None:
+                decoder.flush(host)
+            if log is not None:
+                log.close(exit_code)
+        if decoder is not None:
+            return decoder.exit_codes, exit_code
+        return [exit_code], exit_code
+
+    async def run_cmds(self, host, cmds, res):
+        if self.batch:
+            script = build_script(cmds, self.token, self.errexit)
+            exit_codes, status = await self.run_channel(
+                host, 1, "bash -s", script.encode(), label="\n".join(cmds)
+            )
+            res.exit_codes.extend(exit_codes)
+            # a step calling exit, or bash killed, leaves the next steps unreported
+            if status != 0 or len(exit_codes) < len(cmds):
+                res.error = "script exited with {} after {} of {} steps".format(
+                    status, len(exit_codes), len(cmds)
+                )
+            return
+        for index, cmd in enumerate(cmds, start=1):
+            exit_codes, _ = await self.run_channel(host, index, cmd)
+            res.exit_codes.extend(exit_codes)
+
+    async def run_host(self, host, cmds):
+        res = HostResult(host)
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(
+                    self.run_cmds(host, cmds, res), self.timeout
+                )
+            except asyncio.TimeoutError:
+                res.error = "timed out after {}s".format(self.timeout)
+            except Exception as e:
+                res.error = "{}: {}".format(type(e).__name__, e)
+            res.latency = time.monotonic() - start
+        return res
+
+    async def run(self, cmds):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        # unique per run, so no command output can be taken for a step marker
+        self.token = "__benchtools_step_{}".format(secrets.token_hex(8))
+        # only the blocking handshakes and channel opens run on these threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency
+        )
+        with self.executor:
+            results = await asyncio.gather(
+                *(self.run_host(host, host_cmds) for host, host_cmds in cmds.items())
+            )
+        return {res.host: res for res in results}
+
+
+async def fan_out(pool, cmds, **kwargs):
+    """Run a {host: [cmd, ...]} batch and return {host: HostResult}.
+
+    Commands of a host run in order, at most `concurrency` hosts at once.
+    on_output(host, stream, data) is called for every chunk of output, and
+    with log_dir every command also gets a <log_dir>/<host>/<NN>-<cmd>.log.
+    With batch=True the commands of a host run as one script in one channel
+    (stopping at the first failing step with errexit=True), the exit codes
+    are still reported per command.
+    """
+    return await FanOut(pool, **kwargs).run(cmds)
+
+
+class LinePrinter(LineSplitter):
+    """Print the output of every host line by line, prefixed by the host."""
+
+    def __init__(self, fd=sys.stdout):
+        super().__init__()
+        self.fd = fd
+
+    def write(self, host, stream, line):
+        prefix = host if stream == "stdout" else "{} {}".format(host, stream)
+        self.fd.write("[{}] {}\n".format(prefix, line.decode(errors="replace")))
+        self.fd.flush()
+
+
+def print_summary(results, fd=sys.stdout):
+    fd.write("\n{:<40} {:>10}  {}\n".format("host", "latency_s", "status"))
+    for res in sorted(results.values(), key=lambda r: r.latency, reverse=True):
+        if res.error is not None:
+            status = res.error
+        else:
+            status = "exit codes {}".format(res.exit_codes)
+        fd.write("{:<40} {:>10.3f}  {}\n".format(res.host, res.latency, status))
+
+
+def load_hosts(path):
+    # public_ips.json style {name: ip} files, or a plain list of hosts
+    with open(path, "r") as fd:
+        hosts = json.load(fd)
+    if isinstance(hosts, dict):
+        return list(hosts.values())
+    return hosts
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run commands on many hosts at once over SSH.",
+    )
+    parser.add_argument("--pem", required=True, help="private key file")
+    parser.add_argument("--user", default=DEFAULT_USER, help="ssh user")
+    parser.add_argument("--host", action="append", default=[], help="target host")
+    parser.add_argument("--hosts-file", default=None, help="JSON list/dict of hosts")
+    parser.add_argument(
+        "--cmd", action="append", required=True, help="command, can be repeated"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="hosts worked on at once",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT_SECS,
+        help="per host timeout in seconds",
+    )
+    parser.add_argument(
+        "--log-dir", default=None, help="write per host, per command log files"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="do not print the remote output"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="run the commands of a host as one script in a single channel",
+    )
+    parser.add_argument(
+        "--errexit",
+        action="store_true",
+        help="in batch mode, stop a host at its first failing command",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    hosts = list(args.host)
+    if args.hosts_file:
+        hosts.extend(load_hosts(args.hosts_file))
+    printer = LinePrinter()
+    on_output = ignore_output if args.quiet else printer
+    with SSHPool(args.pem, username=args.user) as pool:
+        results = asyncio.run(
+            fan_out(
+                pool,
+                {host: args.cmd for host in hosts},
+                concurrency=args.concurrency,
+                timeout=args.timeout,
+                on_output=on_output,
+                log_dir=args.log_dir,
+                batch=args.batch,
+                errexit=args.errexit,
+            )
+        )
+    printer.flush()
+    print_summary(results)
+    return 0 if all(res.ok for res in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Repeat a test only until the median of its runs is known well enough.
+
+Instead of a fixed number of runs per test, a test is run again only while
+the bootstrap confidence interval of the median of its runs is wider than
+--ci-max of that median, and at most --max-runs times. Noisy tests get more
+runs and stable ones stop after --min-runs, the least the interval can be
+computed from, so the suite gets shorter without publishing noisier
+numbers.
+
+The sweep driver applies it per point with "repeat" in its spec. For the
+redis-benchmarks-spec-client-runner suites, this prints the tests of the
+collected logs that need another run, as a --tests-regexp for the next pass.
+"""
+import argparse
+import re
+import sys
+
+import numpy as np
+
+from benchtools import memtier, stats
+
+DEFAULT_MIN_RUNS = 2
+DEFAULT_MAX_RUNS = 10
+
+
+def pending(
+    groups,
+    ci_max=stats.DEFAULT_CI_MAX,
+    min_runs=DEFAULT_MIN_RUNS,
+    max_runs=DEFAULT_MAX_RUNS,
+    confidence=stats.DEFAULT_CONFIDENCE,
+    resamples=stats.DEFAULT_RESAMPLES,
+    seed=0,
+):
+    """Return the keys of groups ({key: [value of every run]}) to run again.
+
+    Those with fewer than min_runs runs, and those with fewer than max_runs
+    whose confidence interval of the median is wider than ci_max of it.
+    """
+    rng = np.random.default_rng(seed)
+    again = set()
+    by_runs = {}
+    for key, values in groups.items():
+        if len(values) >= max_runs:
+            continue
+        if len(values) < min_runs:
+            again.add(key)
+            continue
+        by_runs.setdefault(len(values), []).append(key)
+    for runs, keys in sorted(by_runs.items()):
+        data = np.array([groups[key] for key in keys], dtype=float)
+        low, high = stats.bootstrap_median(data, resamples, confidence, rng)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            width = (high - low) / np.median(data, axis=1)
+        again.update(key for key, narrow in zip(keys, width <= ci_max) if not narrow)
+    return again
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Print the tests whose median is not known well enough yet.",
+    )
+    parser.add_argument("--results-dir", default="results-final", help="logs dir")
+    parser.add_argument(
+        "--suffix",
+        default="-priority-10.log",
+        help="log file name suffix, what comes before it is the vm",
+    )
+    parser.add_argument(
+        "--metric",
+        default="ops_sec",
+        choices=list(memtier.COLUMNS),
+        help="metric whose median is estimated",
+    )
+    parser.add_argument(
+        "--ci-max",
+        type=float,
+        default=stats.DEFAULT_CI_MAX,
+        help="width of the interval relative to the median to stop at",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=stats.DEFAULT_CONFIDENCE,
+        help="confidence level of the interval",
+    )
+    parser.add_argument(
+        "--min-runs", type=int, default=DEFAULT_MIN_RUNS, help="runs of every test"
+    )
+    parser.add_argument(
+        "--max-runs", type=int, default=DEFAULT_MAX_RUNS, help="most runs of a test"
+    )
+    parser.add_argument(
+        "--tests",
+        default=None,
+        help="file with the names of the tests of the suite, one per line, so "
+        "that the tests without any run yet are pending too",
+    )
+    parser.add_argument(
+        "--regexp",
+        action="store_true",
+        help="print a --tests-regexp of the pending tests instead of their names",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    index = memtier.build_index(args.results_dir, args.suffix)
+    groups = stats.group_runs(memtier.Results.from_index(index), args.metric)
+    if args.tests is not None:
+        try:
+            with open(args.tests, "r") as fd:
+                names = [line.strip() for line in fd if line.strip()]
+        except OSError as e:
+            print("Error on {}. {}".format(args.tests, e), file=sys.stderr)
+            return 1
+        vms = sorted({vm for _, vm in groups}) or [""]
+        for name in names:
+            for vm in vms:
+                groups.setdefault((name, vm), [])
+    again = pending(
+        groups,
+        args.ci_max,
+        args.min_runs,
+        args.max_runs,
+        args.confidence,
+    )
+    # a test runs again on every vm if one of them needs it
+    tests = sorted({test for test, _ in again})
+    if args.regexp and tests:
+        print("^({})$".format("|".join(re.escape(test) for test in tests)))
+    elif tests:
+        print("\n".join(tests))
+    for test, vm in sorted(again):
+        runs = len(groups[(test, vm)])
+        name = memtier.short_name(test)
+        print("{} {} {} runs".format(name, vm, runs), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,458 @@
+"""Export the results store to the RedisTimeSeries datasink.
+
+Every (setup, instance type, test, metric) becomes one time series, created
+with its labels and the LAST duplicate policy, so exporting the same samples
+again (a retry, a re-run) overwrites them instead of failing. Samples are
+written as TS.MADD commands of --batch samples each, --pipeline commands
+sent per round trip, over a small pool of connections speaking RESP
+directly. A batch whose connection breaks is retried on a fresh connection
+with exponential backoff.
+
+The segments of the store already exported to a datasink are recorded in
+the store, so only the new ingests are sent the next time.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import queue
+import socket
+import sys
+import time
+
+import numpy as np
+
+from benchtools import memtier, store
+
+STATE = "rts.json"
+DEFAULT_PREFIX = "benchtools"
+DEFAULT_PORT = 6379
+DEFAULT_BATCH = 1000
+DEFAULT_PIPELINE = 16
+DEFAULT_CONNECTIONS = 4
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT_SECS = 30
+# ms timestamps until 2286, and values below 1e12 with 3 decimals
+TIMESTAMP_DIGITS = 13
+VALUE_DIGITS = 15
+READ_SIZE = 64 * 1024
+
+
+class ReplyError(Exception):
+    """An error reply of the server, e.g. -WRONGTYPE."""
+
+
+def encode(*args):
+    """Return the RESP array of a command, args being bytes or str."""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+class Connection:
+    """One RESP connection, commands pipelined and replies read in order."""
+
+    def __init__(self, host, port, password=None, timeout=DEFAULT_TIMEOUT_SECS):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b""
+        if password:
+            reply = self.execute([encode("AUTH", password)])[0]
+            if isinstance(reply, ReplyError):
+                self.close()
+                raise reply
+
+    def close(self):
+        self.sock.close()
+
+    def fill(self):
+        data = self.sock.recv(READ_SIZE)
+        if not data:
+            raise ConnectionError("connection closed by the server")
+        self.buffer += data
+
+    def line(self, offset):
+        # (line, offset after it) starting at offset
+        while True:
+            end = self.buffer.find(b"\r\n", offset)
+            if end >= 0:
+                return self.buffer[offset:end], end + 2
+            self.fill()
+
+    def reply(self, offset):
+        # (reply, offset after it), error replies returned as ReplyError
+        line, offset = self.line(offset)
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode(), offset
+        if kind == b"-":
+            return ReplyError(rest.decode()), offset
+        if kind == b":":
+            return int(rest), offset
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None, offset
+            while len(self.buffer) < offset + length + 2:
+                self.fill()
+            return self.buffer[offset : offset + length], offset + length + 2
+        if kind == b"*":
+            items = []
+            for _ in range(max(int(rest), 0)):
+                item, offset = self.reply(offset)
+                items.append(item)
+            return items, offset
+        raise ConnectionError("unexpected reply {!r}".format(line[:40]))
+
+    def execute(self, commands):
+        """Send encoded commands at once, return their replies in order."""
+        self.sock.sendall(b"".join(commands))
+        replies = []
+        offset = 0
+        for _ in commands:
+            reply, offset = self.reply(offset)
+            replies.append(reply)
+        self.buffer = self.buffer[offset:]
+        return replies
+
+
+class Pool:
+    """Connections to the datasink, reused across batches."""
+
+    def __init__(self, host, port, password=None, retries=DEFAULT_RETRIES):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.retries = retries
+        self.idle = queue.LifoQueue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, commands):
+        """Run a pipeline of commands, retrying it on a new connection.
+
+        Only a broken connection is retried, error replies are returned.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            try:
+                if conn is None:
+                    conn = Connection(self.host, self.port, self.password)
+                replies = conn.execute(commands)
+            except (OSError, ConnectionError):
+                if conn is not None:
+                    conn.close()
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(0.1 * 2**attempt, 5))
+                continue
+            self.idle.put(conn)
+            return replies
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+def series_key(prefix, setup, instance_type, test, metric):
+    return "/".join((prefix, setup, instance_type, memtier.short_name(test), metric))
+
+
+def series(table, prefix, metrics):
+    """Return {key: (labels, timestamps, values)} of a store query.
+
+    Timestamps are in ms, the run added as ms so the runs of one ingest are
+    kept apart.
+    """
+    groups = {}
+    for i in range(len(table["run"])):
+        cell = (table["setup"][i], table["instance_type"][i], table["test"][i])
+        groups.setdefault(cell, []).append(i)
+    result = {}
+    for (setup, instance_type, test), rows in groups.items():
+        rows = np.array(rows)
+        timestamps = table["timestamp"][rows] * 1000 + table["run"][rows]
+        for name in metrics:
+            values = table[name][rows]
+            valid = ~np.isnan(values)
+            if not valid.any():
+                continue
+            labels = {
+                "setup": setup,
+                "instance_type": instance_type,
+                "test": memtier.short_name(test),
+                "metric": name,
+            }
+            key = series_key(prefix, setup, instance_type, test, name)
+            result[key] = (labels, timestamps[valid], values[valid])
+    return result
+
+
+def create_commands(data):
+    commands = []
+    for key, (labels, _, _) in data.items():
+        args = ["TS.CREATE", key, "DUPLICATE_POLICY", "LAST", "LABELS"]
+        for label in sorted(labels.items()):
+            args.extend(label)
+        commands.append(encode(*args))
+    return commands
+
+
+def digits(numbers, width):
+    """Return the uint8 matrix of the zero padded ASCII digits of numbers."""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return (numbers[:, None] // powers % 10 + ord("0")).astype(np.uint8)
+
+
+def samples(key, timestamps, values):
+    """Return (encoded, size), the RESP (key, timestamp, value) of the samples.
+
+    Every sample takes the same size in bytes: timestamps are written with
+    TIMESTAMP_DIGITS digits and values as fixed point, zero padded, with 3
+    decimals, so the whole series is laid out by numpy at once. Values that
+    do not fit fall back to a list of samples encoded one at a time, and a
+    size of None.
+    """
+    key = key.encode()
+    head = b"$%d\r\n%s\r\n$%d\r\n" % (len(key), key, TIMESTAMP_DIGITS)
+    fixed = np.rint(values * 1000).astype(np.int64) if len(values) else values
+    if (
+        np.any(values < 0)
+        or np.any(fixed >= 10**VALUE_DIGITS)
+        or np.any(timestamps >= 10**TIMESTAMP_DIGITS)
+    ):
+        encoded = [
+            encode(key, timestamp, repr(value))[4:]
+            for timestamp, value in zip(timestamps.tolist(), values.tolist())
+        ]
+        return encoded, None
+    middle = b"\r\n$%d\r\n" % (VALUE_DIGITS + 1)
+    layout = [
+        np.frombuffer(head, dtype=np.uint8),
+        digits(timestamps, TIMESTAMP_DIGITS),
+        np.frombuffer(middle, dtype=np.uint8),
+        digits(fixed // 1000, VALUE_DIGITS - 3),
+        np.frombuffer(b".", dtype=np.uint8),
+        digits(fixed % 1000, 3),
+        np.frombuffer(b"\r\n", dtype=np.uint8),
+    ]
+    rows = np.empty((len(values), sum(part.shape[-1] for part in layout)), np.uint8)
+    column = 0
+    for part in layout:
+        rows[:, column : column + part.shape[-1]] = part
+        column += part.shape[-1]
+    return rows.tobytes(), rows.shape[1]
+
+
+def madd_commands(data, batch):
+    """Return TS.MADD commands of at most batch samples each."""
+    commands = []
+    pending = []
+    count = 0
+    for key, (_, timestamps, values) in data.items():
+        encoded, size = samples(key, timestamps, values)
+        start = 0
+        while start < len(values):
+            take = min(len(values) - start, batch - count)
+            if size is None:
+                pending.extend(encoded[start : start + take])
+            else:
+                pending.append(encoded[start * size : (start + take) * size])
+            start += take
+            count += take
+            if count == batch:
+                commands.append(b"*%d\r\n$7\r\nTS.MADD\r\n" % (1 + 3 * count))
+                commands[-1] += b"".join(pending)
+                pending, count = [], 0
+    if count:
+        commands.append(b"*%d\r\n$7\r\nTS.MADD\r\n" % (1 + 3 * count))
+        commands[-1] += b"".join(pending)
+    return commands
+
+
+def write(pool, data, batch=DEFAULT_BATCH, pipeline=DEFAULT_PIPELINE, workers=1):
+    """Write {key: (labels, timestamps, values)} to the datasink.
+
+    Returns (samples written, [error replies]).
+    """
+    errors = []
+    for reply in pool.execute(create_commands(data)):
+        if isinstance(reply, ReplyError) and "exist" not in str(reply):
+            errors.append(reply)
+    commands = madd_commands(data, batch)
+    pipelines = [
+        commands[start : start + pipeline]
+        for start in range(0, len(commands), pipeline)
+    ]
+    written = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for replies in executor.map(pool.execute, pipelines):
+            for reply in replies:
+                if isinstance(reply, ReplyError):
+                    errors.append(reply)
+                    continue
+                for sample in reply:
+                    if isinstance(sample, ReplyError):
+                        errors.append(sample)
+                    else:
+                        written += 1
+    return written, errors
+
+
+def load_state(store_dir):
+    try:
+        with open(os.path.join(store_dir, STATE), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(store_dir, state):
+    path = os.path.join(store_dir, STATE)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(state, fd, indent=" ", sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def export(
+    pool,
+    store_dir,
+    prefix=DEFAULT_PREFIX,
+    metrics=store.METRICS,
+    batch=DEFAULT_BATCH,
+    pipeline=DEFAULT_PIPELINE,
+    workers=DEFAULT_CONNECTIONS,
+    everything=False,
+    **filters
+):
+    """Export the segments of the store not exported to this datasink yet.
+
+    With everything, all the segments are (re)exported. Segments are only
+    recorded as exported when nothing was filtered out of them (filters are
+    the store.query globs). Returns (segments, samples written, [error
+    replies]).
+    """
+    state = load_state(store_dir)
+    target = "{}:{}".format(pool.host, pool.port)
+    done = set(state.get(target, []))
+    segments = [segment["id"] for segment in store.load_index(store_dir)["segments"]]
+    if not everything:
+        segments = [segment for segment in segments if segment not in done]
+    if not segments:
+        return [], 0, []
+    table = store.query(store_dir, metrics, segments=segments, **filters)
+    data = series(table, prefix, metrics)
+    written, errors = write(pool, data, batch, pipeline, workers)
+    if not errors and not any(filters.values()):
+        state[target] = sorted(done | set(segments))
+        write_state(store_dir, state)
+    return segments, written, errors
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Export the results store to the RedisTimeSeries datasink.",
+    )
+    parser.add_argument("--store", default="results-store", help="store directory")
+    parser.add_argument(
+        "--host", default=os.environ.get("DATASINK_RTS_HOST"), help="datasink host"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.environ.get("DATASINK_RTS_PORT") or DEFAULT_PORT),
+        help="datasink port",
+    )
+    parser.add_argument(
+        "--password",
+        default=os.environ.get("DATASINK_RTS_PASS"),
+        help="datasink password, defaults to DATASINK_RTS_PASS",
+    )
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="key prefix")
+    for key in store.KEYS[:3]:
+        parser.add_argument(
+            "--" + key.replace("_", "-"), default=None, help="glob over " + key
+        )
+    parser.add_argument(
+        "--metric",
+        action="append",
+        default=None,
+        choices=store.METRICS,
+        help="metric to export, can be repeated. Defaults to all",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="export every segment again, not only the new ones",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=DEFAULT_BATCH, help="samples per TS.MADD"
+    )
+    parser.add_argument(
+        "--pipeline",
+        type=int,
+        default=DEFAULT_PIPELINE,
+        help="TS.MADD commands per round trip",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=DEFAULT_CONNECTIONS,
+        help="pipelines in flight at once",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="attempts on a broken connection",
+    )
+    args = parser.parse_args(argv)
+    if not args.host:
+        parser.error("--host or DATASINK_RTS_HOST is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    start = time.monotonic()
+    target = "{}:{}".format(args.host, args.port)
+    try:
+        with Pool(args.host, args.port, args.password, args.retries) as pool:
+            segments, written, errors = export(
+                pool,
+                args.store,
+                args.prefix,
+                args.metric or store.METRICS,
+                args.batch,
+                args.pipeline,
+                args.connections,
+                args.all,
+                setup=args.setup,
+                instance_type=args.instance_type,
+                test=args.test,
+            )
+    except (OSError, ConnectionError, ReplyError) as e:
+        print("Error on {}. {}".format(target, e), file=sys.stderr)
+        return 1
+    for error in errors[:10]:
+        print("Error on {}. {}".format(target, error), file=sys.stderr)
+    print(
+        "Exported {} samples of {} segments to {} in {:.3f}s".format(
+            written, len(segments), target, time.monotonic() - start
+        )
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""Search the clients x pipeline giving the most throughput under a latency SLO.
+
+Instead of guessing CLIENTS and PIPELINE, the clients of every test type
+(data size, keyspace) of a sweep spec are searched at each pipeline depth of
+its matrix: doubled from the lowest clients of the matrix until the latency
+goes over the SLO (e.g. p99 < 1 ms) or --max-clients, then bisected between
+the last point within the SLO and the first one above it. Tests printing
+several rows (lrange) only meet the SLO when all of them do.
+
+Every probe is a point of the sweep driver, checkpointed in the same
+sweep.jsonl, so an interrupted search started again reuses the points it
+measured. The report gives, per instance type and test, the best point
+within the SLO and the knee of the throughput-latency curve: the point
+within the SLO with the most throughput per unit of latency (Kleinrock's
+power), past which adding concurrency mostly adds queueing.
+
+A spec with "steady" only measures the average latency, the SLO has to be
+on --latency avg_latency_ms then. "repeat" is ignored: every probe runs the
+"runs" of the spec.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import statistics
+import sys
+
+from benchtools import sweep
+
+REPORT = "saturation.csv"
+DEFAULT_MAX_CLIENTS = 2048
+# bisect until the clients of the last point within the SLO and of the first
+# one above it are that close, relatively
+DEFAULT_RESOLUTION = 0.1
+LATENCIES = [field for field in sweep.CSV_FIELDS if field.endswith("_latency_ms")]
+FIELDS = [
+    "instance_type",
+    "test_type",
+    "data_size",
+    "keyspace",
+    "pipeline",
+    "clients",
+    "rps",
+    "latency_ms",
+    "within_slo",
+    "best",
+    "knee",
+    "error",
+]
+
+
+class Probe:
+    """Measure points of one test type, data size and keyspace of a spec."""
+
+    def __init__(self, spec, output_dir, done, latency, log=sys.stdout):
+        self.spec = spec
+        self.output_dir = output_dir
+        self.done = done
+        self.latency = latency
+        self.log = log
+        self.checkpoint = sweep.open_checkpoint(output_dir, spec)
+
+    def close(self):
+        self.checkpoint.close()
+
+    def entry(self, point):
+        # checkpointed entry of point, measured now if it was not before
+        entry = self.done.get(sweep.point_id(point))
+        if entry is not None and not entry["error"]:
+            return entry
+        entry = sweep.run_point(self.spec, point, self.output_dir)
+        self.checkpoint.write(json.dumps(entry, sort_keys=True) + "\n")
+        self.checkpoint.flush()
+        os.fsync(self.checkpoint.fileno())
+        self.done[entry["id"]] = entry
+        return entry
+
+    def measure(self, base, pipeline, clients):
+        """Return {"clients", "pipeline", "rps", "latency_ms", "error"}.
+
+        rps and latency_ms are the medians over the runs of the spec of the
+        lowest throughput and highest latency of the rows of the test.
+        """
+        rps = []
+        latencies = []
+        error = None
+        for run in range(1, self.spec["runs"] + 1):
+            point = dict(base, pipeline=pipeline, clients=clients, run=run)
+            entry = self.entry(point)
+            rows = entry["rows"]
+            if entry["error"] is None and any(self.latency not in r for r in rows):
+                entry["error"] = "no {} in the output".format(self.latency)
+            if entry["error"] is not None:
+                error = entry["error"]
+                break
+            rps.append(min(row["rps"] for row in rows))
+            latencies.append(max(row[self.latency] for row in rows))
+        result = {
+            "clients": clients,
+            "pipeline": pipeline,
+            "rps": statistics.median(rps) if error is None else None,
+            "latency_ms": statistics.median(latencies) if error is None else None,
+            "error": error,
+        }
+        self.log.write(
+            "{} pipeline={} clients={} {}\n".format(
+                base["test_type"],
+                pipeline,
+                clients,
+                error
+                or "{:.0f} rps {} {:.3f} ms".format(
+                    result["rps"], self.latency, result["latency_ms"]
+                ),
+            )
+        )
+        self.log.flush()
+        return result
+
+
+def within(result, slo):
+    return result["error"] is None and result["latency_ms"] <= slo
+
+
+def search(measure, low, high, slo, resolution=DEFAULT_RESOLUTION):
+    """Return the results measure(clients) of the probes of one search.
+
+    Clients double from low until a result is over the slo (or failed) or
+    high is reached, then the bound is bisected down to resolution.
+    """
+    results = {}
+    good = bad = None
+    clients = low
+    while True:
+        results[clients] = measure(clients)
+        if not within(results[clients], slo):
+            bad = clients
+            break
+        good = clients
+        if clients >= high:
+            break
+        clients = min(clients * 2, high)
+    while good is not None and bad is not None:
+        if bad - good <= max(1, int(good * resolution)):
+            break
+        clients = (good + bad) // 2
+        results[clients] = measure(clients)
+        if within(results[clients], slo):
+            good = clients
+        else:
+            bad = clients
+    return [results[clients] for clients in sorted(results)]
+
+
+def knee(results):
+    """Return the result with the most throughput per ms of latency, or None."""
+    measured = [r for r in results if r["error"] is None and r["latency_ms"] > 0]
+    if not measured:
+        return None
+    return max(measured, key=lambda r: r["rps"] / r["latency_ms"])
+
+
+def saturate(spec, output_dir, latency, slo, max_clients, resolution, log):
+    """Search every test of spec, return the report rows.
+
+    Raises ValueError when output_dir holds the checkpoint of another spec.
+    """
+    os.makedirs(os.path.join(output_dir, "raw"), exist_ok=True)
+    matrix = spec["matrix"]
+    low = min(matrix["clients"])
+    done = sweep.load_checkpoint(output_dir, spec)
+    probe = Probe(spec, output_dir, done, latency, log)
+    rows = []
+    try:
+        for test_type in matrix["tests"]:
+            for data_size in matrix["data_size"]:
+                for keyspace in matrix["keyspace"]:
+                    base = {
+                        "test_type": test_type,
+                        "data_size": data_size,
+                        "keyspace": keyspace,
+                    }
+                    results = []
+                    for pipeline in matrix["pipeline"]:
+                        results += search(
+                            lambda c: probe.measure(base, pipeline, c),
+                            low,
+                            max_clients,
+                            slo,
+                            resolution,
+                        )
+                    ok = [result for result in results if within(result, slo)]
+                    best = max(ok, key=lambda r: r["rps"]) if ok else None
+                    knee_result = knee(ok)
+                    for result in results:
+                        row = dict(base, **result)
+                        row["within_slo"] = within(result, slo)
+                        row["best"] = result is best
+                        row["knee"] = result is knee_result
+                        rows.append(row)
+    finally:
+        probe.close()
+    return rows
+
+
+def write_report(path, rows, instance_type):
+    with open(path + ".tmp", "w") as fd:
+        writer = csv.writer(fd, lineterminator="\n")
+        writer.writerow(FIELDS)
+        for row in rows:
+            row = dict(row, instance_type=instance_type)
+            writer.writerow(["" if row[f] is None else row[f] for f in FIELDS])
+    os.replace(path + ".tmp", path)
+
+
+def print_report(rows, instance_type, latency, slo, fd=sys.stdout):
+    fd.write(
+        "{:<16} {:<24} {:>9} {:>7} {:>12} {:>10}   {:>9} {:>7} {:>12} {:>10}\n".format(
+            "instance_type",
+            "test",
+            "clients",
+            "pipe",
+            "best_rps",
+            latency.replace("_latency", ""),
+            "clients",
+            "pipe",
+            "knee_rps",
+            latency.replace("_latency", ""),
+        )
+    )
+    tests = []
+    for row in rows:
+        test = (row["test_type"], row["data_size"], row["keyspace"])
+        if test not in tests:
+            tests.append(test)
+    for test in tests:
+        cells = []
+        for flag in ("best", "knee"):
+            found = [
+                row
+                for row in rows
+                if row[flag] and (row["test_type"], row["data_size"], row["keyspace"])
+                == test
+            ]
+            if found:
+                row = found[0]
+                cells.append(
+                    "{:>9} {:>7} {:>12.0f} {:>10.3f}".format(
+                        row["clients"], row["pipeline"], row["rps"], row["latency_ms"]
+                    )
+                )
+            else:
+                cells.append("{:>9} {:>7} {:>12} {:>10}".format("-", "-", "-", "-"))
+        fd.write(
+            "{:<16} {:<24} {}   {}\n".format(
+                instance_type or "-", "{} d={} r={}".format(*test), *cells
+            )
+        )
+    fd.write("SLO {} <= {} ms\n".format(latency, slo))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Search the clients x pipeline of the most throughput under a "
+        "latency SLO.",
+    )
+    parser.add_argument("spec", help="sweep spec JSON")
+    parser.add_argument("--output-dir", default="saturation", help="results directory")
+    parser.add_argument("--host", default=None, help="override the spec host")
+    parser.add_argument("--port", type=int, default=None, help="override the port")
+    parser.add_argument(
+        "--latency",
+        default="p99_latency_ms",
+        choices=LATENCIES,
+        help="redis-benchmark --csv latency the SLO is on",
+    )
+    parser.add_argument(
+        "--slo", type=float, default=1.0, help="highest latency allowed, in ms"
+    )
+    parser.add_argument(
+        "--max-clients",
+        type=int,
+        default=DEFAULT_MAX_CLIENTS,
+        help="clients the search does not go above",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=DEFAULT_RESOLUTION,
+        help="relative precision the clients are searched to",
+    )
+    parser.add_argument(
+        "--instance-type", default="", help="instance type label of the report"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    try:
+        spec = sweep.load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print("Error on {}. {}".format(args.spec, e), file=sys.stderr)
+        return 1
+    if args.host is not None:
+        spec["host"] = args.host
+    if args.port is not None:
+        spec["port"] = args.port
+    if spec["steady"] is not None and args.latency != "avg_latency_ms":
+        print(
+            "Error on {}. steady only measures avg_latency_ms, not {}".format(
+                args.spec, args.latency
+            ),
+            file=sys.stderr,
+        )
+        return 1
+    if spec["repeat"] is not None:
+        print(
+            "Warning. repeat is ignored, every probe runs {} times".format(
+                spec["runs"]
+            ),
+            file=sys.stderr,
+        )
+    if shutil.which(spec["redis_benchmark"]) is None:
+        print(
+            "Error on {}. {} not found".format(args.spec, spec["redis_benchmark"]),
+            file=sys.stderr,
+        )
+        return 1
+    try:
+        rows = saturate(
+            spec,
+            args.output_dir,
+            args.latency,
+            args.slo,
+            args.max_clients,
+            args.resolution,
+            sys.stderr,
+        )
+    except ValueError as e:
+        print("Error on {}. {}".format(args.output_dir, e), file=sys.stderr)
+        return 1
+    write_report(os.path.join(args.output_dir, REPORT), rows, args.instance_type)
+    print_report(rows, args.instance_type, args.latency, args.slo)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
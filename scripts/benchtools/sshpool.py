@@ -0,0 +1,206 @@
+"""Pooled SSH sessions to the benchmark VMs.
+
+The private key is loaded once and every host keeps one authenticated
+transport alive across command batches. Each command runs on its own channel,
+so several commands can run on the same host at once without a new handshake.
+"""
+import concurrent.futures
+import select
+import shlex
+import threading
+
+import paramiko
+
+DEFAULT_USER = "ubuntu"
+# sshd only allows MaxSessions (10 by default) channels per connection
+DEFAULT_MAX_CHANNELS = 8
+KEEPALIVE_SECS = 30
+READ_SIZE = 32 * 1024
+KEY_TYPES = ("RSAKey", "ECDSAKey", "Ed25519Key")
+
+
+def load_key(path):
+    """Return the private key of path, whichever of KEY_TYPES it is."""
+    error = None
+    for name in KEY_TYPES:
+        try:
+            return getattr(paramiko, name).from_private_key_file(path)
+        except paramiko.ssh_exception.SSHException as e:
+            error = error or e
+    raise error
+
+
+def drain(chan, host, on_output):
+    """Pass whatever is buffered on both streams of chan to on_output."""
+    while chan.recv_stderr_ready():
+        on_output(host, "stderr", chan.recv_stderr(READ_SIZE))
+    while chan.recv_ready():
+        data = chan.recv(READ_SIZE)
+        if not data:
+            break
+        on_output(host, "stdout", data)
+
+
+def feed(chan, stdin):
+    # stdin is bytes or a binary file object, sent while the output is read
+    try:
+        if isinstance(stdin, bytes):
+            chan.sendall(stdin)
+        else:
+            for chunk in iter(lambda: stdin.read(READ_SIZE), b""):
+                chan.sendall(chunk)
+        chan.shutdown_write()
+    except (OSError, EOFError, paramiko.ssh_exception.SSHException):
+        # the remote side went away, read_channel reports how it ended
+        pass
+
+
+def finished(chan):
+    return (chan.eof_received or chan.closed) and chan.exit_status_ready()
+
+
+def read_channel(chan, host, on_output):
+    # interleave both streams, so a full stdout window never stalls stderr
+    # (or the other way around) while the other one is being read
+    while not finished(chan):
+        select.select([chan], [], [], 1)
+        drain(chan, host, on_output)
+    drain(chan, host, on_output)
+    return chan.recv_exit_status()
+
+
+class SSHPool:
+    def __init__(
+        self,
+        pkey,
+        username=DEFAULT_USER,
+        max_channels=DEFAULT_MAX_CHANNELS,
+        connect_timeout=30,
+    ):
+        # Load the .pem file only once for all the hosts
+        self.pkey = load_key(pkey)
+        self.username = username
+        self.max_channels = max_channels
+        self.connect_timeout = connect_timeout
+        self.clients = {}
+        self.channels = {}
+        self.host_locks = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def host_lock(self, host):
+        with self.lock:
+            if host not in self.host_locks:
+                self.host_locks[host] = threading.Lock()
+                self.channels[host] = threading.BoundedSemaphore(self.max_channels)
+            return self.host_locks[host]
+
+    def transport(self, host):
+        """Return a live transport to host, connecting only when needed."""
+        with self.host_lock(host):
+            client = self.clients.get(host)
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return transport
+                client.close()
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                host,
+                username=self.username,
+                pkey=self.pkey,
+                timeout=self.connect_timeout,
+                allow_agent=False,
+                look_for_keys=False,
+            )
+            transport = client.get_transport()
+            transport.set_keepalive(KEEPALIVE_SECS)
+            self.clients[host] = client
+            return transport
+
+    def run(self, host, cmd, on_output=None, stdin=None):
+        """Run cmd on host and return (exit_code, stdout, stderr).
+
+        When on_output(host, stream, data) is given the output is handed to
+        it as it arrives instead of being collected. stdin (bytes or a binary
+        file object) is streamed to the command.
+        """
+        output = {"stdout": [], "stderr": []}
+
+        def collect(host, stream, data):
+            output[stream].append(data)
+
+        on_output = on_output or collect
+        transport = self.transport(host)
+        with self.channels[host]:
+            chan = transport.open_session()
+            feeder = None
+            try:
+                chan.exec_command(cmd)
+                if stdin is not None:
+                    feeder = threading.Thread(target=feed, args=(chan, stdin))
+                    feeder.start()
+                exit_code = read_channel(chan, host, on_output)
+            finally:
+                chan.close()
+                if feeder is not None:
+                    feeder.join()
+        stdout = b"".join(output["stdout"]).decode(errors="replace")
+        stderr = b"".join(output["stderr"]).decode(errors="replace")
+        return exit_code, stdout, stderr
+
+    def run_batch(self, cmds, workers=None):
+        """Run a {host: [cmd, ...]} batch, commands of a host in order.
+
+        Returns {host: [(exit_code, stdout, stderr), ...]} or the exception
+        raised while working on that host.
+        """
+
+        def host_work(host):
+            return [self.run(host, cmd) for cmd in cmds[host]]
+
+        workers = workers or len(cmds) or 1
+        res = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(host_work, host): host for host in cmds}
+            for future in concurrent.futures.as_completed(futures):
+                host = futures[future]
+                try:
+                    res[host] = future.result()
+                except (paramiko.ssh_exception.SSHException, OSError) as e:
+                    res[host] = e
+        return res
+
+    def upload(self, hosts, path, data, workers=None):
+        """Write data (bytes) to path on every host, moved in place once whole.
+
+        Returns {host: exit_code} or the exception raised for that host.
+        """
+        cmd = "cat > {0}.part && mv {0}.part {0}".format(shlex.quote(path))
+
+        def host_work(host):
+            return self.run(host, cmd, stdin=data)[0]
+
+        workers = workers or len(hosts) or 1
+        res = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(host_work, host): host for host in hosts}
+            for future in concurrent.futures.as_completed(futures):
+                host = futures[future]
+                try:
+                    res[host] = future.result()
+                except (paramiko.ssh_exception.SSHException, OSError) as e:
+                    res[host] = e
+        return res
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
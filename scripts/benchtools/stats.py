@@ -0,0 +1,219 @@
+"""Statistics over the repeated runs of every (test, vm) cell.
+
+All the runs of a cell are grouped and reduced to their median, mean,
+stdev, coefficient of variation and a bootstrap confidence interval of the
+median. Cells are processed as 2-D NumPy arrays, one batch per number of
+runs, and a cell is flagged unstable when it has too few runs or when its
+spread is too wide to trust a comparison.
+"""
+import argparse
+import csv
+import math
+import sys
+
+import numpy as np
+
+from benchtools import memtier
+
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_RUNS = 3
+DEFAULT_CV_MAX = 0.05
+# width of the confidence interval relative to the median
+DEFAULT_CI_MAX = 0.10
+# bound on the cells x resamples x runs of one bootstrap batch
+BATCH_ELEMENTS = 4 * 1024 * 1024
+FIELDS = [
+    "test",
+    "vm",
+    "metric",
+    "runs",
+    "median",
+    "mean",
+    "stdev",
+    "cv",
+    "ci_low",
+    "ci_high",
+    "unstable",
+]
+
+
+def group_runs(results, column):
+    """Return {(test, vm): [value of every run]} of a Results column."""
+    groups = {}
+    for test, vm, value in zip(results.test, results.vm, results[column]):
+        if not math.isnan(value):
+            groups.setdefault((test, vm), []).append(value)
+    return groups
+
+
+def bootstrap_median(data, resamples, confidence, rng):
+    """Return the (low, high) bounds of the median of every row of data."""
+    cells, runs = data.shape
+    alpha = (1 - confidence) / 2
+    low = np.empty(cells)
+    high = np.empty(cells)
+    step = max(1, BATCH_ELEMENTS // (resamples * runs))
+    for start in range(0, cells, step):
+        batch = data[start : start + step]
+        picks = rng.integers(0, runs, size=(resamples, runs))
+        # (cells, resamples, runs) -> (cells, resamples)
+        medians = np.median(batch[:, picks], axis=2)
+        low[start : start + step], high[start : start + step] = np.quantile(
+            medians, [alpha, 1 - alpha], axis=1
+        )
+    return low, high
+
+
+def aggregate(
+    results,
+    columns=("ops_sec",),
+    resamples=DEFAULT_RESAMPLES,
+    confidence=DEFAULT_CONFIDENCE,
+    min_runs=DEFAULT_MIN_RUNS,
+    cv_max=DEFAULT_CV_MAX,
+    ci_max=DEFAULT_CI_MAX,
+    seed=0,
+):
+    """Return one dict per (test, vm, metric), keyed like FIELDS."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for column in columns:
+        groups = group_runs(results, column)
+        by_runs = {}
+        for key, values in groups.items():
+            by_runs.setdefault(len(values), []).append(key)
+        for runs, keys in sorted(by_runs.items()):
+            data = np.array([groups[key] for key in keys])
+            median = np.median(data, axis=1)
+            mean = data.mean(axis=1)
+            if runs > 1:
+                stdev = data.std(axis=1, ddof=1)
+            else:
+                stdev = np.full(len(keys), np.nan)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cv = stdev / mean
+            low, high = bootstrap_median(data, resamples, confidence, rng)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                width = (high - low) / median
+            unstable = (runs < min_runs) | ~(cv <= cv_max) | ~(width <= ci_max)
+            for i, (test, vm) in enumerate(keys):
+                rows.append(
+                    {
+                        "test": test,
+                        "vm": vm,
+                        "metric": column,
+                        "runs": runs,
+                        "median": median[i],
+                        "mean": mean[i],
+                        "stdev": stdev[i],
+                        "cv": cv[i],
+                        "ci_low": low[i],
+                        "ci_high": high[i],
+                        "unstable": bool(unstable[i]),
+                    }
+                )
+    order = {}
+    for key in zip(results.test, results.vm):
+        order.setdefault(key, len(order))
+    rows.sort(key=lambda row: (order[(row["test"], row["vm"])], row["metric"]))
+    return rows
+
+
+def write_csv(fd, rows):
+    writer = csv.writer(fd, lineterminator="\n")
+    writer.writerow(FIELDS)
+    for row in rows:
+        line = [memtier.short_name(row["test"]), row["vm"], row["metric"], row["runs"]]
+        for field in FIELDS[4:-1]:
+            value = row[field]
+            line.append("" if np.isnan(value) else "{:.3f}".format(value))
+        line.append(int(row["unstable"]))
+        writer.writerow(line)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Aggregate the repeated runs of every (test, vm) cell.",
+    )
+    parser.add_argument("--results-dir", default="results-final", help="logs dir")
+    parser.add_argument(
+        "--suffix",
+        default="-priority-10.log",
+        help="log file name suffix, what comes before it is the vm",
+    )
+    parser.add_argument(
+        "--metric",
+        action="append",
+        default=None,
+        choices=list(memtier.COLUMNS),
+        help="metric to aggregate, can be repeated. Defaults to ops_sec",
+    )
+    parser.add_argument(
+        "--resamples", type=int, default=DEFAULT_RESAMPLES, help="bootstrap resamples"
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=DEFAULT_CONFIDENCE,
+        help="confidence level of the interval",
+    )
+    parser.add_argument(
+        "--min-runs",
+        type=int,
+        default=DEFAULT_MIN_RUNS,
+        help="cells with fewer runs are unstable",
+    )
+    parser.add_argument(
+        "--cv-max",
+        type=float,
+        default=DEFAULT_CV_MAX,
+        help="cells with a higher coefficient of variation are unstable",
+    )
+    parser.add_argument(
+        "--ci-max",
+        type=float,
+        default=DEFAULT_CI_MAX,
+        help="cells with a wider interval, relative to the median, are unstable",
+    )
+    parser.add_argument("--output", default=None, help="CSV file, default stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    index = memtier.build_index(args.results_dir, args.suffix)
+    rows = aggregate(
+        memtier.Results.from_index(index),
+        args.metric or ["ops_sec"],
+        args.resamples,
+        args.confidence,
+        args.min_runs,
+        args.cv_max,
+        args.ci_max,
+    )
+    if args.output is None:
+        write_csv(sys.stdout, rows)
+    else:
+        with open(args.output, "w") as fd:
+            write_csv(fd, rows)
+    unstable = [row for row in rows if row["unstable"]]
+    for row in unstable:
+        print(
+            "Unstable {} on {} ({}): {} runs, cv {:.3f}, ci [{:.3f}, {:.3f}]".format(
+                memtier.short_name(row["test"]),
+                row["vm"],
+                row["metric"],
+                row["runs"],
+                row["cv"],
+                row["ci_low"],
+                row["ci_high"],
+            ),
+            file=sys.stderr,
+        )
+    print("{} of {} cells unstable".format(len(unstable), len(rows)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Stop a benchmark once its throughput reached a steady state.
+
+redis-benchmark prints its instantaneous throughput every 250 ms while it
+runs ("SET: rps=169850.0 (overall: 168510.2) avg_msec=0.231 (overall:
+0.235)"). Those samples are followed as they come: the warm-up is cut with
+MSER-5 (the truncation of the 5-sample batch means minimizing the standard
+error of what is left, searched over the first half of them) and the test
+is steady once the confidence interval of the mean of the batches after
+the warm-up is within a tolerance of that mean. The benchmark is then
+interrupted instead of running its whole -n, and its throughput and
+average latency are those of the samples after the warm-up.
+
+Tests printing several titles (lrange) are not cut short, as interrupting
+one would skip the next ones, but are measured the same way.
+"""
+import argparse
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BATCH = 5
+# batch means after the warm-up needed before judging the steady state
+MIN_BATCHES = 4
+DEFAULT_TOLERANCE = 0.02
+DEFAULT_MIN_SECONDS = 5.0
+# normal quantile of the 95% confidence interval of the mean
+Z = 1.96
+POLL_SECS = 1.0
+SEVERAL_TITLES = ("lrange",)
+PROGRESS_RE = re.compile(
+    r"^(?P<title>[^:]+): rps=(?P<rps>[0-9.]+) \(overall: [0-9.]+\) "
+    r"avg_msec=(?P<avg>[0-9.]+)"
+)
+FIELDS = ["warmup_s", "measured_s", "samples", "steady"]
+
+
+def mser(values, batch=BATCH):
+    """Return the warm-up truncation of values, a multiple of batch, or None.
+
+    None when there are too few batches, or when the truncation falls in the
+    second half of them, meaning the series did not settle yet.
+    """
+    count = len(values) // batch
+    if count < 2 * MIN_BATCHES:
+        return None
+    means = np.asarray(values[: count * batch], dtype=float)
+    means = means.reshape(count, batch).mean(axis=1)
+    # sum and sum of squares of means[d:] for every d, at once
+    sums = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum((means**2)[::-1])[::-1]
+    left = np.arange(count, 0, -1)
+    statistic = (squares - sums**2 / left) / left**2
+    half = count // 2
+    truncation = int(np.argmin(statistic[: half + 1]))
+    if truncation == half:
+        return None
+    return truncation * batch
+
+
+class Series:
+    """The progress samples of one test title."""
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, min_seconds=DEFAULT_MIN_SECONDS):
+        self.tolerance = tolerance
+        self.min_seconds = min_seconds
+        self.times = []
+        self.rps = []
+        self.latencies = []
+
+    def add(self, when, rps, latency):
+        """Add a sample, return whether the series is steady now."""
+        self.times.append(when)
+        self.rps.append(rps)
+        self.latencies.append(latency)
+        return self.steady()
+
+    def steady(self):
+        if not self.times or self.times[-1] - self.times[0] < self.min_seconds:
+            return False
+        truncation = mser(self.rps)
+        if truncation is None:
+            return False
+        count = (len(self.rps) - truncation) // BATCH
+        tail = np.asarray(self.rps[truncation : truncation + count * BATCH])
+        means = tail.reshape(count, BATCH).mean(axis=1)
+        halfwidth = Z * means.std(ddof=1) / np.sqrt(count)
+        return bool(halfwidth <= self.tolerance * means.mean())
+
+    def result(self, title):
+        """Return the result row of the samples after the warm-up."""
+        truncation = mser(self.rps) or 0
+        rps = self.rps[truncation:]
+        latencies = self.latencies[truncation:]
+        return {
+            "test": title,
+            "rps": round(float(np.mean(rps)), 2),
+            "avg_latency_ms": round(float(np.mean(latencies)), 3),
+            "warmup_s": round(self.times[truncation] - self.times[0], 3),
+            "measured_s": round(self.times[-1] - self.times[truncation], 3),
+            "samples": len(rps),
+            "steady": self.steady(),
+        }
+
+
+def run(cmd, tolerance, min_seconds, timeout=None, stop=True):
+    """Run cmd, interrupting it once steady when stop, return its outcome.
+
+    Returns (output, exit code or None when timed out, result rows, whether it
+    was interrupted).
+    """
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = bytearray()
+    partial = b""
+    series = {}
+    interrupted = timed_out = False
+    try:
+        while True:
+            if timeout is not None and time.monotonic() - start > timeout:
+                proc.kill()
+                timed_out = True
+                break
+            if not select.select([proc.stdout], [], [], POLL_SECS)[0]:
+                continue
+            data = os.read(proc.stdout.fileno(), 65536)
+            if not data:
+                break
+            output += data
+            # progress lines end with \r, they are overwritten in a terminal
+            lines = re.split(rb"[\r\n]", partial + data)
+            partial = lines.pop()
+            now = time.monotonic()
+            for line in lines:
+                match = PROGRESS_RE.match(line.decode(errors="replace").strip())
+                if match is None:
+                    continue
+                title = match.group("title")
+                samples = series.setdefault(title, Series(tolerance, min_seconds))
+                steady = samples.add(
+                    now, float(match.group("rps")), float(match.group("avg"))
+                )
+                if steady and stop and not interrupted:
+                    proc.send_signal(signal.SIGINT)
+                    interrupted = True
+    finally:
+        proc.stdout.close()
+        exit_code = proc.wait()
+    if timed_out:
+        exit_code = None
+    elif interrupted:
+        exit_code = 0
+    rows = [samples.result(title) for title, samples in series.items()]
+    return output.decode(errors="replace"), exit_code, rows, interrupted
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run redis-benchmark until its throughput is steady.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="confidence interval of the mean throughput relative to it",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=DEFAULT_MIN_SECONDS,
+        help="shortest run, whatever the samples",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="longest run, in seconds"
+    )
+    parser.add_argument(
+        "cmd",
+        nargs=argparse.REMAINDER,
+        help="redis-benchmark command, without --csv which hides the progress",
+    )
+    args = parser.parse_args(argv)
+    if args.cmd[:1] == ["--"]:
+        args.cmd = args.cmd[1:]
+    if not args.cmd:
+        parser.error("no command to run")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    try:
+        _, exit_code, rows, interrupted = run(
+            args.cmd, args.tolerance, args.min_seconds, args.timeout
+        )
+    except OSError as e:
+        print("Error on {}. {}".format(args.cmd[0], e), file=sys.stderr)
+        return 1
+    fields = ["test", "rps", "avg_latency_ms"] + FIELDS
+    print(",".join(fields))
+    for row in rows:
+        print(",".join(str(row[field]) for field in fields))
+    if exit_code != 0:
+        print(
+            "Error on {}. {}".format(
+                args.cmd[0],
+                "timed out" if exit_code is None else "exit code {}".format(exit_code),
+            ),
+            file=sys.stderr,
+        )
+        return 1
+    if not rows:
+        print(
+            "Error on {}. No progress in the output".format(args.cmd[0]),
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Append-only columnar store of the benchmark results.
+
+Every ingest writes one immutable segment: a directory holding one .npy file
+per column (string columns dictionary encoded as int32 codes). index.json
+records, per segment, its row count, timestamp range and the distinct
+setups, instance types, tests and git shas it holds, so a query only opens
+the segments that can match, and of those only the columns it needs,
+memory-mapped. It also records, per log ingested, its size, mtime and the
+last run of every test stored from it, so ingesting the same results dir
+again only stores the runs appended to its logs since.
+"""
+import argparse
+import csv
+import datetime
+import fcntl
+import fnmatch
+import json
+import os
+import sys
+
+import numpy as np
+
+from benchtools import memtier, prepare_ips
+
+INDEX = "index.json"
+KEYS = ("setup", "instance_type", "test", "git_sha")
+METRICS = tuple(memtier.COLUMNS)
+DEFAULT_GIT_SHA = "N/A"
+
+
+def load_index(store_dir):
+    try:
+        with open(os.path.join(store_dir, INDEX), "r") as fd:
+            return json.load(fd)
+    except OSError:
+        return {"segments": [], "logs": {}}
+
+
+def write_index(store_dir, index):
+    path = os.path.join(store_dir, INDEX)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(index, fd, indent=" ")
+    os.replace(path + ".tmp", path)
+
+
+def append(store_dir, rows, logs=None):
+    """Write rows (dicts with KEYS, timestamp, run and METRICS) as a segment.
+
+    logs ({path: {"size", "mtime_ns", "runs": {test: last run stored}}}) are
+    recorded as ingested along with it.
+    Returns the segment id, or None when there is nothing to write.
+    """
+    if not rows and not logs:
+        return None
+    os.makedirs(os.path.join(store_dir, "segments"), exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(store_dir)
+        index.setdefault("logs", {}).update(logs or {})
+        if not rows:
+            write_index(store_dir, index)
+            return None
+        segment = {
+            "id": "{:06d}".format(len(index["segments"]) + 1),
+            "rows": len(rows),
+            "created": int(datetime.datetime.now().timestamp()),
+            "dicts": {},
+        }
+        columns = {}
+        for key in KEYS:
+            values = [row[key] for row in rows]
+            segment["dicts"][key] = sorted(set(values))
+            codes = {value: code for code, value in enumerate(segment["dicts"][key])}
+            columns[key] = np.array([codes[v] for v in values], dtype=np.int32)
+        columns["timestamp"] = np.array([row["timestamp"] for row in rows], np.int64)
+        columns["run"] = np.array([row["run"] for row in rows], dtype=np.int32)
+        for name in METRICS:
+            columns[name] = np.array([row[name] for row in rows], dtype=np.float64)
+        segment["ts_min"] = int(columns["timestamp"].min())
+        segment["ts_max"] = int(columns["timestamp"].max())
+        # written aside, then moved in place, so readers never see half of it
+        path = os.path.join(store_dir, "segments", segment["id"])
+        os.makedirs(path + ".tmp")
+        for name, column in columns.items():
+            np.save(os.path.join(path + ".tmp", name + ".npy"), column)
+        os.rename(path + ".tmp", path)
+        index["segments"].append(segment)
+        write_index(store_dir, index)
+    return segment["id"]
+
+
+def load_column(segment_path, name):
+    return np.load(os.path.join(segment_path, name + ".npy"), mmap_mode="r")
+
+
+def query(
+    store_dir, columns=METRICS, since=None, until=None, segments=None, **patterns
+):
+    """Return {column: numpy array} of the rows matching every filter.
+
+    patterns are fnmatch globs over KEYS (e.g. test="*string-get-100B",
+    instance_type="m7g.*"), since and until bound the epoch timestamp and
+    segments, when given, are the only segment ids looked at. The KEYS,
+    timestamp and run are always returned.
+    """
+    names = list(KEYS) + ["timestamp", "run"] + [c for c in columns if c in METRICS]
+    parts = {name: [] for name in names}
+    for segment in load_index(store_dir)["segments"]:
+        if segments is not None and segment["id"] not in segments:
+            continue
+        if since is not None and segment["ts_max"] < since:
+            continue
+        if until is not None and segment["ts_min"] > until:
+            continue
+        wanted = {}
+        for key, pattern in patterns.items():
+            if pattern is not None:
+                wanted[key] = [
+                    code
+                    for code, value in enumerate(segment["dicts"][key])
+                    if fnmatch.fnmatchcase(value, pattern)
+                ]
+        if any(not codes for codes in wanted.values()):
+            continue
+        path = os.path.join(store_dir, "segments", segment["id"])
+        mask = np.ones(segment["rows"], dtype=bool)
+        for key, codes in wanted.items():
+            mask &= np.isin(load_column(path, key), codes)
+        timestamps = load_column(path, "timestamp")
+        if since is not None:
+            mask &= timestamps >= since
+        if until is not None:
+            mask &= timestamps <= until
+        if not mask.any():
+            continue
+        for name in names:
+            column = np.asarray(load_column(path, name)[mask])
+            if name in KEYS:
+                column = np.array(segment["dicts"][name], dtype=object)[column]
+            parts[name].append(column)
+    return {name: np.concatenate(part) if part else [] for name, part in parts.items()}
+
+
+def ingest(store_dir, results_dir, suffix, setup, git_sha, jobs=None):
+    """Append the results of the logs under results_dir as one segment.
+
+    Only the runs not ingested yet are stored: the logs unchanged since the
+    last ingest are not read, and of a log that grew (another run appended
+    to it) only the runs past those already stored are. A log that shrank
+    was replaced and is read as a new one. The instance type is the vm of
+    the log name and the timestamp the mtime of the log. Returns the number
+    of rows written.
+    """
+    seen = load_index(store_dir).get("logs", {})
+    files = []
+    logs = {}
+    for vm, path in memtier.log_files(results_dir, suffix):
+        info = os.stat(path)
+        key = os.path.realpath(path)
+        stamp = {"size": info.st_size, "mtime_ns": info.st_mtime_ns}
+        previous = seen.get(key)
+        if previous is not None and stamp["size"] < previous["size"]:
+            previous = None
+        if previous is not None and all(previous[k] == stamp[k] for k in stamp):
+            continue
+        runs = dict(previous["runs"]) if previous is not None else {}
+        logs[key] = dict(stamp, runs=runs)
+        files.append((path, vm))
+    rows = []
+    for (path, vm), table in zip(files, memtier.parse_files(files, jobs)):
+        timestamp = int(os.path.getmtime(path))
+        runs = logs[os.path.realpath(path)]["runs"]
+        results = memtier.Results()
+        for (test, _, run), metrics in sorted(table.items()):
+            if run > runs.get(test, 0):
+                results.append(test, vm, run, metrics)
+        for test, _, run, values in results.rows():
+            row = {
+                "setup": setup,
+                "instance_type": vm,
+                "test": test,
+                "git_sha": git_sha,
+                "timestamp": timestamp,
+                "run": run,
+            }
+            row.update(values)
+            rows.append(row)
+            runs[test] = max(run, runs.get(test, 0))
+    append(store_dir, rows, logs)
+    return len(rows)
+
+
+def setup_name(setup_dir):
+    # the setup_name output of the terraform setup, or its directory name
+    try:
+        outputs = prepare_ips.load_outputs(setup_dir)
+    except Exception:
+        outputs = {}
+    return outputs.get("setup_name") or os.path.basename(os.path.abspath(setup_dir))
+
+
+def epoch(value):
+    # ISO date or datetime, local time
+    if value is None:
+        return None
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+def write_csv(fd, table):
+    writer = csv.writer(fd, lineterminator="\n")
+    names = list(table)
+    writer.writerow(names)
+    for i in range(len(table["run"])):
+        line = []
+        for name in names:
+            value = table[name][i]
+            if name == "timestamp":
+                value = datetime.datetime.fromtimestamp(value).isoformat()
+            elif name in METRICS:
+                value = "" if np.isnan(value) else "{:.3f}".format(value)
+            elif name == "test":
+                value = memtier.short_name(value)
+            line.append(value)
+        writer.writerow(line)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Append-only columnar store of the benchmark results.",
+    )
+    parser.add_argument("--store", default="results-store", help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="append a results dir")
+    ingest_parser.add_argument(
+        "--results-dir", default="results-final", help="logs dir"
+    )
+    ingest_parser.add_argument(
+        "--suffix",
+        default="-priority-10.log",
+        help="log file name suffix, what comes before it is the instance type",
+    )
+    ingest_parser.add_argument(
+        "--setup-dir",
+        default=".",
+        help="terraform setup the results come from, for its setup_name",
+    )
+    ingest_parser.add_argument("--setup", default=None, help="setup name override")
+    ingest_parser.add_argument(
+        "--git-sha",
+        default=os.environ.get("TF_VAR_github_sha", DEFAULT_GIT_SHA),
+        help="commit tested, defaults to the github_sha terraform variable",
+    )
+    ingest_parser.add_argument("--jobs", type=int, default=None, help="processes")
+    query_parser = commands.add_parser("query", help="print matching results")
+    for key in KEYS:
+        query_parser.add_argument(
+            "--" + key.replace("_", "-"), default=None, help="glob over " + key
+        )
+    query_parser.add_argument("--since", default=None, help="ISO date or datetime")
+    query_parser.add_argument("--until", default=None, help="ISO date or datetime")
+    query_parser.add_argument(
+        "--metric",
+        action="append",
+        default=None,
+        choices=METRICS,
+        help="metric to print, can be repeated. Defaults to all",
+    )
+    query_parser.add_argument("--output", default=None, help="CSV file, default stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    if args.command == "ingest":
+        setup = args.setup or setup_name(args.setup_dir)
+        rows = ingest(
+            args.store, args.results_dir, args.suffix, setup, args.git_sha, args.jobs
+        )
+        print("Stored {} rows of {} at {}".format(rows, setup, args.git_sha))
+        return 0
+    table = query(
+        args.store,
+        args.metric or METRICS,
+        epoch(args.since),
+        epoch(args.until),
+        **{key: getattr(args, key) for key in KEYS}
+    )
+    if args.output is None:
+        write_csv(sys.stdout, table)
+    else:
+        with open(args.output, "w") as fd:
+            write_csv(fd, table)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
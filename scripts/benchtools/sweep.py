@@ -0,0 +1,430 @@
+"""Run a redis-benchmark sweep from a declarative spec, resumable.
+
+The spec is a JSON file with the server, the fixed options and a matrix of
+test types x clients x pipeline x data size x keyspace (and runs) to sweep:
+
+    {
+      "host": "10.3.0.10", "port": 6379, "requests": 1000000,
+      "matrix": {"tests": ["set", "get"], "clients": [50, 200],
+                 "pipeline": [1, 16], "data_size": [3, 1024],
+                 "keyspace": [1, 1000000]},
+      "runs": 3
+    }
+
+Every point of the matrix runs redis-benchmark --csv once and its rows are
+parsed into structured results. Finished points are appended to
+sweep.jsonl in the output directory as they complete, so an interrupted
+sweep started again skips them and goes on where it stopped; results.csv
+is rewritten from it at the end. The first line of sweep.jsonl is a digest
+of the spec fields outside of the matrix, runs and repeat: a sweep whose
+server or options changed since refuses to resume from it.
+
+With "steady": {"tolerance": 0.02, "min_seconds": 5} every point runs until
+its throughput is steady instead of for its whole -n (requests becoming a
+bound), see benchtools.steady; only rps and the average latency are
+measured then. With "repeat": {"ci_max": 0.05} runs becomes the most runs
+of a point: a point is run again only while the confidence interval of
+the median rps of its runs is wider than ci_max of it, see
+benchtools.repeat.
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from benchtools import repeat, stats, steady
+
+CHECKPOINT = "sweep.jsonl"
+RESULTS = "results.csv"
+AXES = ("tests", "clients", "pipeline", "data_size", "keyspace")
+DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 6379,
+    "requests": 100000,
+    "threads": None,
+    "cluster": False,
+    "flushall": False,
+    "runs": 1,
+    "timeout": None,
+    "steady": None,
+    "repeat": None,
+    # taskset -c cpu list of redis-benchmark, see benchtools.pinning
+    "cpus": None,
+    "redis_benchmark": "redis-benchmark",
+    "redis_cli": "redis-cli",
+    "matrix": {
+        "tests": ["set", "get"],
+        "clients": [50],
+        "pipeline": [1],
+        "data_size": [3],
+        "keyspace": [1],
+    },
+}
+# redis-benchmark --csv columns, older versions only print test and rps
+CSV_FIELDS = [
+    "test",
+    "rps",
+    "avg_latency_ms",
+    "min_latency_ms",
+    "p50_latency_ms",
+    "p95_latency_ms",
+    "p99_latency_ms",
+    "max_latency_ms",
+]
+PARAMS = ["test_type", "clients", "pipeline", "data_size", "keyspace", "run"]
+OPTIONS = {
+    "steady": {"tolerance", "min_seconds"},
+    "repeat": {"ci_max", "min_runs", "confidence"},
+}
+# spec fields that only choose which points run, not what a point measures
+UNHASHED = ("matrix", "runs", "repeat")
+
+
+def load_spec(path):
+    """Return the spec of path with the defaults filled in."""
+    with open(path, "r") as fd:
+        spec = json.load(fd)
+    unknown = set(spec) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("unknown spec keys: {}".format(", ".join(sorted(unknown))))
+    matrix = dict(DEFAULTS["matrix"], **spec.get("matrix", {}))
+    unknown = set(matrix) - set(AXES)
+    if unknown:
+        raise ValueError("unknown matrix axes: {}".format(", ".join(sorted(unknown))))
+    for axis, values in matrix.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError("matrix {} must be a non empty list".format(axis))
+    for key, allowed in OPTIONS.items():
+        if spec.get(key) is not None and set(spec[key]) - allowed:
+            raise ValueError("{} takes {}".format(key, ", ".join(sorted(allowed))))
+    spec = dict(DEFAULTS, **spec)
+    spec["matrix"] = matrix
+    return spec
+
+
+def points(spec):
+    """Yield every point of the sweep as a dict keyed like PARAMS, in order."""
+    matrix = spec["matrix"]
+    for run in range(1, spec["runs"] + 1):
+        for values in itertools.product(*(matrix[axis] for axis in AXES)):
+            point = dict(zip(PARAMS, values))
+            point["run"] = run
+            yield point
+
+
+def point_id(point):
+    return " ".join("{}={}".format(param, point[param]) for param in PARAMS)
+
+
+def cell_id(point):
+    # the point, whatever its run
+    return " ".join("{}={}".format(param, point[param]) for param in PARAMS[:-1])
+
+
+def command(spec, point):
+    """Return the redis-benchmark argv of a point."""
+    cmd = [spec["redis_benchmark"]]
+    if spec["cpus"]:
+        cmd = ["taskset", "-c", spec["cpus"]] + cmd
+    if spec["threads"]:
+        cmd += ["--threads", str(spec["threads"])]
+    cmd += [
+        "-e",
+        "-h",
+        spec["host"],
+        "-p",
+        str(spec["port"]),
+        "-r",
+        str(point["keyspace"]),
+        "-c",
+        str(point["clients"]),
+        "-n",
+        str(spec["requests"]),
+        "-d",
+        str(point["data_size"]),
+        "-P",
+        str(point["pipeline"]),
+        "-t",
+        str(point["test_type"]),
+    ]
+    # --csv hides the progress the steady state is detected on
+    cmd.append("-q" if spec["steady"] is not None else "--csv")
+    if spec["cluster"]:
+        cmd.append("--cluster")
+    return cmd
+
+
+def parse_csv(output):
+    """Return a dict per result row of redis-benchmark --csv output.
+
+    The numeric fields are floats, lines that are not CSV rows are skipped.
+    """
+    rows = []
+    fields = CSV_FIELDS[:2]
+    for line in output.splitlines():
+        if not line.startswith('"'):
+            continue
+        cells = next(csv.reader([line]))
+        if cells[:2] == CSV_FIELDS[:2]:
+            fields = cells
+            continue
+        try:
+            row = {"test": cells[0]}
+            row.update({f: float(c) for f, c in zip(fields[1:], cells[1:])})
+        except ValueError:
+            continue
+        rows.append(row)
+    return rows
+
+
+def spec_digest(spec):
+    """Return the sha256 of the spec fields a point measurement depends on."""
+    fields = {key: value for key, value in spec.items() if key not in UNHASHED}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def load_checkpoint(output_dir, spec=None):
+    """Return {point id: entry} of the points finished so far.
+
+    Raises ValueError when spec is given and the checkpoint was written for
+    a spec with another digest.
+    """
+    done = {}
+    digest = None
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT), "r") as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # cut short while being written
+                    continue
+                if "id" in entry:
+                    done[entry["id"]] = entry
+                else:
+                    digest = entry["spec"]
+    except OSError:
+        pass
+    if spec is not None and digest is not None and digest != spec_digest(spec):
+        raise ValueError(
+            "{} was written for another spec, use another output dir".format(
+                CHECKPOINT
+            )
+        )
+    return done
+
+
+def open_checkpoint(output_dir, spec):
+    """Return the checkpoint opened to append, its spec digest written first."""
+    fd = open(os.path.join(output_dir, CHECKPOINT), "a")
+    if fd.tell() == 0:
+        fd.write(json.dumps({"spec": spec_digest(spec)}) + "\n")
+        fd.flush()
+    return fd
+
+
+def run(cmd, timeout):
+    """Return the output and exit code (None when timed out) of cmd."""
+    try:
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=timeout,
+            check=False,
+        )
+        return proc.stdout.decode(errors="replace"), proc.returncode
+    except subprocess.TimeoutExpired as e:
+        return (e.stdout or b"").decode(errors="replace"), None
+
+
+def run_point(spec, point, output_dir):
+    """Run one point, return its checkpoint entry."""
+    start = time.monotonic()
+    started = datetime.datetime.now().isoformat(timespec="seconds")
+    if spec["flushall"]:
+        cli = [spec["redis_cli"], "-h", spec["host"], "-p", str(spec["port"])]
+        subprocess.run(cli + ["flushall"], stdout=subprocess.DEVNULL, check=False)
+    cmd = command(spec, point)
+    if spec["steady"] is not None:
+        output, exit_code, rows, _ = steady.run(
+            cmd,
+            spec["steady"].get("tolerance", steady.DEFAULT_TOLERANCE),
+            spec["steady"].get("min_seconds", steady.DEFAULT_MIN_SECONDS),
+            spec["timeout"],
+            stop=point["test_type"] not in steady.SEVERAL_TITLES,
+        )
+    else:
+        output, exit_code = run(cmd, spec["timeout"])
+        rows = parse_csv(output)
+    raw = os.path.join("raw", point_id(point).replace(" ", "_") + ".txt")
+    with open(os.path.join(output_dir, raw), "w") as fd:
+        fd.write(output)
+    error = None
+    if exit_code != 0:
+        error = "timed out" if exit_code is None else "exit code {}".format(exit_code)
+    elif not rows:
+        error = "no results in the output"
+    return {
+        "id": point_id(point),
+        "point": point,
+        "command": " ".join(cmd),
+        "started": started,
+        "seconds": round(time.monotonic() - start, 3),
+        "rows": rows,
+        "raw": raw,
+        "error": error,
+    }
+
+
+def unsettled(spec, done, run):
+    """Return the cell ids of spec to run again at run, with "repeat"."""
+    settings = spec["repeat"]
+    groups = {}
+    for point in points(spec):
+        if point["run"] == 1:
+            groups[cell_id(point)] = []
+        entry = done.get(point_id(point))
+        if point["run"] < run and entry is not None and not entry["error"]:
+            groups[cell_id(point)].append(min(row["rps"] for row in entry["rows"]))
+    return repeat.pending(
+        groups,
+        settings.get("ci_max", stats.DEFAULT_CI_MAX),
+        settings.get("min_runs", repeat.DEFAULT_MIN_RUNS),
+        spec["runs"],
+        settings.get("confidence", stats.DEFAULT_CONFIDENCE),
+    )
+
+
+def write_results(fd, entries):
+    writer = csv.writer(fd, lineterminator="\n")
+    writer.writerow(PARAMS + CSV_FIELDS + steady.FIELDS)
+    for entry in entries:
+        for row in entry["rows"]:
+            writer.writerow(
+                [entry["point"][param] for param in PARAMS]
+                + [row.get(field, "") for field in CSV_FIELDS + steady.FIELDS]
+            )
+
+
+def sweep(spec, output_dir, retry_failed=False, log=sys.stdout):
+    """Run the points of spec not finished yet.
+
+    Returns the entries of every finished point of spec, in order. Raises
+    ValueError when output_dir holds the checkpoint of another spec.
+    """
+    os.makedirs(os.path.join(output_dir, "raw"), exist_ok=True)
+    done = load_checkpoint(output_dir, spec)
+
+    def wanted(point):
+        entry = done.get(point_id(point))
+        return entry is None or (retry_failed and entry["error"])
+
+    # with repeat only a bound, lowered as cells settle
+    total = sum(1 for point in points(spec) if wanted(point))
+    pos = 0
+    elapsed = 0.0
+    with open_checkpoint(output_dir, spec) as checkpoint:
+        for run in range(1, spec["runs"] + 1):
+            todo = [p for p in points(spec) if p["run"] == run and wanted(p)]
+            if spec["repeat"] is not None:
+                again = unsettled(spec, done, run)
+                total -= sum(1 for point in todo if cell_id(point) not in again)
+                todo = [point for point in todo if cell_id(point) in again]
+            for point in todo:
+                pos += 1
+                entry = run_point(spec, point, output_dir)
+                checkpoint.write(json.dumps(entry, sort_keys=True) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                done[entry["id"]] = entry
+                elapsed += entry["seconds"]
+                summary = entry["error"] or " ".join(
+                    "{} {:.0f} rps".format(row["test"], row["rps"])
+                    for row in entry["rows"]
+                )
+                log.write(
+                    "[{}/{}] {} {} (eta {:.0f}s)\n".format(
+                        pos,
+                        total,
+                        entry["id"],
+                        summary,
+                        elapsed / pos * (total - pos),
+                    )
+                )
+                log.flush()
+    order = {point_id(point): i for i, point in enumerate(points(spec))}
+    entries = sorted(
+        (entry for entry in done.values() if entry["id"] in order),
+        key=lambda entry: order[entry["id"]],
+    )
+    buffer = io.StringIO()
+    write_results(buffer, entries)
+    path = os.path.join(output_dir, RESULTS)
+    with open(path + ".tmp", "w") as fd:
+        fd.write(buffer.getvalue())
+    os.replace(path + ".tmp", path)
+    return entries
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run a resumable redis-benchmark sweep from a JSON spec.",
+    )
+    parser.add_argument("spec", help="sweep spec JSON")
+    parser.add_argument("--output-dir", default="sweep", help="results directory")
+    parser.add_argument("--host", default=None, help="override the spec host")
+    parser.add_argument("--port", type=int, default=None, help="override the port")
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="run again the points that failed, not only the missing ones",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the commands and exit"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    try:
+        spec = load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print("Error on {}. {}".format(args.spec, e), file=sys.stderr)
+        return 1
+    if args.host is not None:
+        spec["host"] = args.host
+    if args.port is not None:
+        spec["port"] = args.port
+    if args.dry_run:
+        for point in points(spec):
+            print(" ".join(command(spec, point)))
+        return 0
+    if shutil.which(spec["redis_benchmark"]) is None:
+        print(
+            "Error on {}. {} not found".format(args.spec, spec["redis_benchmark"]),
+            file=sys.stderr,
+        )
+        return 1
+    try:
+        entries = sweep(spec, args.output_dir, args.retry_failed)
+    except ValueError as e:
+        print("Error on {}. {}".format(args.output_dir, e), file=sys.stderr)
+        return 1
+    failed = [entry for entry in entries if entry["error"]]
+    for entry in failed:
+        print("Error on {}. {}".format(entry["id"], entry["error"]), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
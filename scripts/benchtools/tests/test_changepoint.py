@@ -0,0 +1,18 @@
+import numpy as np
+
+from benchtools import changepoint
+
+
+def test_e_divisive_finds_the_step():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(100, 1, 30), rng.normal(120, 1, 30)])
+
+    found = changepoint.e_divisive(values, seed=0)
+
+    assert [index for index, _ in found] == [30]
+    assert found[0][1] <= changepoint.DEFAULT_PVALUE
+
+
+def test_e_divisive_flat_series():
+    rng = np.random.default_rng(0)
+    assert changepoint.e_divisive(rng.normal(100, 1, 60), seed=0) == []
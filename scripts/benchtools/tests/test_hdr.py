@@ -0,0 +1,28 @@
+import numpy as np
+
+from benchtools import hdr
+
+
+def test_encode_decode_round_trip():
+    histogram = hdr.Histogram(lowest=1, highest=60 * 1000 * 1000, digits=3)
+    rng = np.random.default_rng(0)
+    for value in rng.lognormal(6, 1.5, 10000).astype(int) + 1:
+        histogram.record(int(value))
+    histogram.record(1, 5)
+    histogram.record(59 * 1000 * 1000)
+
+    decoded = hdr.Histogram.decode(histogram.encode())
+
+    assert (decoded.lowest, decoded.highest, decoded.digits) == (
+        histogram.lowest,
+        histogram.highest,
+        histogram.digits,
+    )
+    assert np.array_equal(decoded.counts, histogram.counts)
+    assert decoded.stats() == histogram.stats()
+
+
+def test_decode_empty():
+    decoded = hdr.Histogram.decode(hdr.Histogram().encode())
+    assert decoded.total == 0
+    assert decoded.stats() == {"count": 0}
@@ -0,0 +1,127 @@
+import socketserver
+import threading
+
+import numpy as np
+import pytest
+
+from benchtools import rts, store
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            drop = server.connections <= server.drop
+        while True:
+            args = self.read_command()
+            if args is None or drop:
+                # a broken connection, the command is lost
+                return
+            server.commands.append(args)
+            if args[0] == "TS.CREATE":
+                self.wfile.write(b"+OK\r\n")
+            elif args[0] == "TS.MADD":
+                stamps = args[2::3]
+                reply = b"*%d\r\n" % len(stamps)
+                reply += b"".join(b":%d\r\n" % int(s) for s in stamps)
+                self.wfile.write(reply)
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.commands = []
+    server.connections = 0
+    server.drop = 0
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def pool(server, retries=rts.DEFAULT_RETRIES):
+    return rts.Pool(*server.server_address, retries=retries)
+
+
+def test_madd_commands_encoding(server):
+    data = {
+        "k1": ({}, np.array([1700000000001, 1700000000002]), np.array([1.5, 2000.25])),
+        "k2": ({}, np.array([1700000000001]), np.array([-3.0])),
+    }
+    commands = rts.madd_commands(data, batch=2)
+    assert len(commands) == 2
+    with pool(server) as p:
+        replies = p.execute(commands)
+    assert replies == [[1700000000001, 1700000000002], [1700000000001]]
+    first, second = server.commands
+    assert first[0] == second[0] == "TS.MADD"
+    assert first[1::3] == ["k1", "k1"]
+    assert first[2::3] == ["1700000000001", "1700000000002"]
+    assert [float(v) for v in first[3::3]] == [1.5, 2000.25]
+    # negative values are not fixed point, encoded one at a time
+    assert second[1:3] == ["k2", "1700000000001"]
+    assert float(second[3]) == -3.0
+
+
+def test_export_writes_the_new_segments(server, tmp_path):
+    row = {
+        "setup": "s",
+        "instance_type": "m7g.large",
+        "test": "memtier_benchmark-1Mkeys-string-get-100B",
+        "git_sha": "aaa",
+        "timestamp": 1700000000,
+    }
+    metrics = {name: float("nan") for name in store.METRICS}
+    store.append(
+        str(tmp_path),
+        [
+            dict(row, run=1, **dict(metrics, ops_sec=1000.0)),
+            dict(row, run=2, **dict(metrics, ops_sec=1100.0)),
+        ],
+    )
+    with pool(server) as p:
+        segments, written, errors = rts.export(p, str(tmp_path), metrics=["ops_sec"])
+        assert (segments, written, errors) == (["000001"], 2, [])
+        # recorded as exported, nothing sent the second time
+        assert rts.export(p, str(tmp_path), metrics=["ops_sec"]) == ([], 0, [])
+    create, madd = server.commands
+    key = "benchtools/s/m7g.large/1Mkeys-string-get-100B/ops_sec"
+    assert create[:5] == ["TS.CREATE", key, "DUPLICATE_POLICY", "LAST", "LABELS"]
+    assert "instance_type" in create and "m7g.large" in create
+    # ms timestamps, the run added so the runs of one ingest stay apart
+    assert madd[1:] == [key, "1700000000001", madd[3], key, "1700000000002", madd[6]]
+    assert [float(madd[3]), float(madd[6])] == [1000.0, 1100.0]
+
+
+def test_pool_retries_on_a_new_connection(server):
+    server.drop = 2
+    with pool(server, retries=2) as p:
+        assert p.execute([rts.encode("TS.CREATE", "k")]) == ["OK"]
+    assert server.connections == 3
+    assert server.commands == [["TS.CREATE", "k"]]
+
+
+def test_pool_gives_up_after_its_retries(server):
+    server.drop = 3
+    with pool(server, retries=1) as p:
+        with pytest.raises(ConnectionError):
+            p.execute([rts.encode("TS.CREATE", "k")])
+    assert server.connections == 2
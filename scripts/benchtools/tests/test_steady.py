@@ -0,0 +1,37 @@
+import numpy as np
+
+from benchtools import steady
+
+
+def test_mser_truncates_the_ramp():
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(10000, 100000, 50)
+    flat = rng.normal(100000, 1000, 200)
+
+    truncation = steady.mser(np.concatenate([ramp, flat]))
+
+    assert truncation is not None
+    assert truncation % steady.BATCH == 0
+    assert 40 <= truncation <= 60
+
+
+def test_mser_not_settled():
+    assert steady.mser(np.linspace(10000, 100000, 200)) is None
+
+
+def test_mser_too_few_samples():
+    assert steady.mser([100000.0] * (2 * steady.MIN_BATCHES * steady.BATCH - 1)) is None
+
+
+def test_series_steady_once_flat():
+    rng = np.random.default_rng(0)
+    series = steady.Series(tolerance=0.02, min_seconds=5.0)
+    values = np.concatenate(
+        [np.linspace(10000, 100000, 20), rng.normal(100000, 500, 80)]
+    )
+    states = [series.add(i * 0.25, value, 0.2) for i, value in enumerate(values)]
+
+    assert not any(states[:20])
+    assert states[-1]
+    result = series.result("SET")
+    assert abs(result["rps"] - 100000) < 1000
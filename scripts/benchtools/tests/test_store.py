@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from benchtools import store
+
+SUFFIX = "-priority-10.log"
+TEST = "memtier_benchmark-1Mkeys-string-get-100B"
+
+
+def write_run(path, ops_sec, mtime):
+    with open(path, "a") as fd:
+        fd.write("# Results for {} test-case on oss-standalone topology\n".format(TEST))
+        fd.write("|Metric JSON Path|Metric Value|\n|----|---:|\n")
+        fd.write('|"ALL STATS".Totals."Ops/sec"|{}|\n'.format(ops_sec))
+    os.utime(path, (mtime, mtime))
+
+
+def test_ingest_stores_only_the_runs_appended(tmp_path):
+    results = tmp_path / "results"
+    results.mkdir()
+    log = str(results / ("m7g.large" + SUFFIX))
+    write_run(log, 1000, 1700000000)
+    assert store.ingest(str(tmp_path / "store"), str(results), SUFFIX, "s", "aaa") == 1
+    # unchanged, nothing to store
+    assert store.ingest(str(tmp_path / "store"), str(results), SUFFIX, "s", "aaa") == 0
+
+    write_run(log, 2000, 1700086400)
+    assert store.ingest(str(tmp_path / "store"), str(results), SUFFIX, "s", "bbb") == 1
+
+    table = store.query(str(tmp_path / "store"), columns=["ops_sec"])
+    rows = sorted(zip(table["git_sha"], table["run"], table["ops_sec"]))
+    assert rows == [("aaa", 1, 1000.0), ("bbb", 2, 2000.0)]
+    assert list(np.sort(table["timestamp"])) == [1700000000, 1700086400]
+
+
+def test_ingest_reads_a_replaced_log_again(tmp_path):
+    results = tmp_path / "results"
+    results.mkdir()
+    log = str(results / ("m7g.large" + SUFFIX))
+    write_run(log, 1000, 1700000000)
+    write_run(log, 1100, 1700000000)
+    assert store.ingest(str(tmp_path / "store"), str(results), SUFFIX, "s", "aaa") == 2
+
+    os.remove(log)
+    write_run(log, 3000, 1700086400)
+    assert store.ingest(str(tmp_path / "store"), str(results), SUFFIX, "s", "bbb") == 1
@@ -0,0 +1,33 @@
+import io
+import json
+
+from benchtools import tfstate
+
+STATE = {
+    "version": 4,
+    "serial": 12,
+    "resources": [{"name": "a\\\"b", "values": [1, -2.5e3, None, True]}],
+    "outputs": {
+        "server_public_ip": {"value": ["3.15.1.2", "3.15.1.3"]},
+        "big": {"value": -1.5e10},
+        "small": {"value": 12345.678e-3},
+        "flag": {"value": False},
+    },
+    "check_results": -1.5e10,
+}
+
+
+def test_members_at_every_chunk_size():
+    text = json.dumps(STATE)
+    for chunk_size in range(1, 48):
+        reader = tfstate.StateReader(io.StringIO(text), chunk_size)
+        values = {key: reader.value() for key in reader.members()}
+        assert values == STATE, chunk_size
+
+
+def test_read_outputs(tmp_path):
+    path = tmp_path / tfstate.STATE_FILE
+    path.write_text(json.dumps(STATE))
+    outputs = tfstate.read_outputs(str(path))
+    assert outputs == {k: v["value"] for k, v in STATE["outputs"].items()}
+    assert tfstate.read_serial(str(path)) == 12
@@ -0,0 +1,173 @@
+"""Read terraform outputs straight from a local terraform.tfstate.
+
+The state is scanned incrementally and only the top level "outputs" object is
+decoded, so multi-MB states (e.g. 35 nodes / 500 shards) are never loaded as a
+whole. Setups using a remote backend still need the terraform binary.
+"""
+import json
+import os
+import re
+
+STATE_FILE = "terraform.tfstate"
+BACKEND_STATE_FILE = os.path.join(".terraform", "terraform.tfstate")
+ENVIRONMENT_FILE = os.path.join(".terraform", "environment")
+WORKSPACES_DIR = "terraform.tfstate.d"
+CHUNK_SIZE = 64 * 1024
+
+SERIAL_RE = re.compile(r'"serial"\s*:\s*(\d+)')
+# next character that matters when skipping a value, and a whole JSON string
+STRUCTURAL_RE = re.compile(r'["{}\[\]]')
+STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+NON_SPACE_RE = re.compile(r"\S")
+# characters that can still continue a number
+NUMBER_TAIL_RE = re.compile(r"[0-9.eE+-]*")
+
+
+class StateReader:
+    """Minimal pull parser over the top level object of a JSON document."""
+
+    def __init__(self, fd, chunk_size=CHUNK_SIZE):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.fd.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            match = NON_SPACE_RE.search(self.buf, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if not self.fill():
+                raise ValueError("unexpected end of terraform state")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                "expected '{}' in terraform state, got '{}'".format(char, self.peek())
+            )
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                res, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # most likely the value spans past the buffered data
+                if not self.fill():
+                    raise
+                continue
+            # a number is only whole once a character that cannot continue it
+            # is buffered, "-1" may still be the start of "-1.5e10"
+            if self.buf[self.pos] not in '"{[':
+                tail = NUMBER_TAIL_RE.match(self.buf, end)
+                if tail.end() == len(self.buf) and self.fill():
+                    continue
+            self.pos = end
+            return res
+
+    def skip(self):
+        if self.peek() not in "{[":
+            self.value()
+            return
+        depth = 0
+        while True:
+            match = STRUCTURAL_RE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise ValueError("unexpected end of terraform state")
+                continue
+            char = match.group()
+            if char == '"':
+                self.pos = match.start()
+                string = STRING_RE.match(self.buf, self.pos)
+                # the string may continue past the buffered data
+                if string is None:
+                    if not self.fill():
+                        raise ValueError("unexpected end of terraform state")
+                    continue
+                self.pos = string.end()
+                continue
+            self.pos = match.end()
+            depth += 1 if char in "{[" else -1
+            if depth == 0:
+                return
+
+    def members(self):
+        """Yield the top level keys, leaving the reader on each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def read_outputs(path):
+    """Return the outputs of a state file as a name -> value dict."""
+    with open(path, "r") as fd:
+        reader = StateReader(fd)
+        for key in reader.members():
+            if key == "outputs":
+                return {k: v["value"] for k, v in reader.value().items()}
+            reader.skip()
+    return {}
+
+
+def read_serial(path):
+    # the serial sits in the header of the state, no need to parse all of it
+    with open(path, "r") as fd:
+        match = SERIAL_RE.search(fd.read(4096))
+    return int(match.group(1)) if match else None
+
+
+def backend(setup_dir):
+    """Return the backend (type, config) recorded by terraform init."""
+    path = os.path.join(setup_dir, BACKEND_STATE_FILE)
+    try:
+        with open(path, "r") as fd:
+            res = json.load(fd).get("backend") or {}
+    except (OSError, ValueError):
+        return "local", {}
+    return res.get("type", "local"), res.get("config") or {}
+
+
+def current_workspace(setup_dir):
+    try:
+        with open(os.path.join(setup_dir, ENVIRONMENT_FILE), "r") as fd:
+            return fd.read().strip() or "default"
+    except OSError:
+        return "default"
+
+
+def local_state_path(setup_dir):
+    """Return the local state file of setup_dir, or None for remote backends."""
+    backend_type, config = backend(setup_dir)
+    if backend_type != "local":
+        return None
+    path = os.path.join(setup_dir, config.get("path") or STATE_FILE)
+    workspace = current_workspace(setup_dir)
+    if workspace != "default":
+        workspace_dir = config.get("workspace_dir") or WORKSPACES_DIR
+        path = os.path.join(setup_dir, workspace_dir, workspace, STATE_FILE)
+    if os.path.isfile(path):
+        return path
+    return None
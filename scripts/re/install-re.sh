@@ -5,11 +5,18 @@ source defaults.sh
 # exit immediately on error
 set -e
 
+# upload the artifacts once, the nodes relay them to each other over the
+# private network. The relay needs python3 on the nodes and the relay port
+# (52100) open between them in the security group; without either, checked
+# first, the artifacts are copied to every node over SSH like scp did. The PEM
+# can be an RSA, ECDSA or Ed25519 key
+PYTHONPATH=$(dirname "$0")/.. python3 -m benchtools.distribute \
+    --pem ${PEM} --user ${USER} \
+    --node $NODE1_EXT_IP:$NODE1_INT_IP \
+    --node $NODE2_EXT_IP:$NODE2_INT_IP \
+    license.txt:/tmp/license.txt install.sh:/tmp/i.sh $RE:/tmp/re.tar
+
 for IP in $NODE1_EXT_IP $NODE2_EXT_IP; do
     echo "connecting to $IP using user $USER"
-    ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} echo $IP
-    scp -i ${PEM} license.txt ${USER}@${IP}:/tmp/license.txt
-    scp -i ${PEM} install.sh ${USER}@${IP}:/tmp/i.sh
-    scp -i ${PEM} $RE ${USER}@${IP}:/tmp/re.tar
     ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} sudo /tmp/i.sh
 done
@@ -4,6 +4,7 @@
 NODE1_EXT_IP=${NODE1_EXT_IP:-3.12.146.105}
 NODE2_EXT_IP=${NODE2_EXT_IP:-18.119.116.40}
 NODE1_INT_IP=${NODE1_INT_IP:-10.3.0.180}
+NODE2_INT_IP=${NODE2_INT_IP:-10.3.0.139}
 
 CLIENT_EIP=${CLIENT_EIP:-3.135.210.78}
 
@@ -6,8 +6,10 @@ source defaults.sh
 IP=$NODE1_EXT_IP
 REMOTE_MOD_ARTIFACT=/tmp/rejson.zip
 
-scp -i ${PEM} license.txt ${USER}@${IP}:/tmp/license.txt
-scp -i ${PEM} $REJSON_ARTIFACT ${USER}@${IP}:$REMOTE_MOD_ARTIFACT
+# skipped when the node already holds the same files in its artifact cache
+PYTHONPATH=$(dirname "$0")/.. python3 -m benchtools.distribute \
+    --pem ${PEM} --user ${USER} --node $NODE1_EXT_IP:$NODE1_INT_IP \
+    license.txt:/tmp/license.txt $REJSON_ARTIFACT:$REMOTE_MOD_ARTIFACT
 
 ssh -i ${PEM} -t ${USER}@${IP} sudo \
     /opt/redislabs/bin/rladmin cluster create name $CLUSTER_NAME \
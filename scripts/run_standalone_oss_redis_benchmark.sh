@@ -1,9 +1,28 @@
 #!/bin/bash
 
+# Runs redis-benchmark over TEST_TYPES at one CLIENTS/PIPELINE/DATA_SIZE/KEYSPACELEN
+# point through benchtools.sweep, which parses the --csv output into
+# $OUTPUT_DIR/results.csv and resumes an interrupted run where it stopped.
+# The server is REDIS_HOST (127.0.0.1 by default) and PORT (6379). For a whole
+# matrix pass a sweep spec instead: SPEC=sweep.json, whose host and port are
+# only overridden when REDIS_HOST or PORT are set.
+# With SLO_MS set, the clients (from CLIENTS up) and PIPELINE giving the most
+# throughput with the p99 latency under SLO_MS are searched instead, see
+# benchtools.saturate, and reported for INSTANCE_TYPE.
+# With STEADY_TOLERANCE set (e.g. 0.02), every test stops as soon as its
+# throughput is steady, REQUESTS being only a bound, see benchtools.steady.
+# With REPEAT_CI_MAX set (e.g. 0.05), a test is run again only while the
+# confidence interval of its median rps is wider than that, RUNS_PER_VARIATION
+# times at most, see benchtools.repeat.
+# redis-benchmark is pinned to whole cores of the NUMA node of the NIC, away
+# from the NIC IRQs, with a thread per core, see benchtools.pinning. PIN=0 to
+# leave it to the scheduler.
+
 # exit immediately on error
 set -e
-HOSTNAME=${HOSTNAME:-"127.0.0.1"}
-PORT=${PORT:-6379}
+# not HOSTNAME, that bash always sets to the name of this machine
+REDIS_HOST=${REDIS_HOST:-""}
+PORT=${PORT:-""}
 TLS_PORT=${TLS_PORT:-6080}
 CLIENTS=${CLIENTS:-50}
 REQUESTS=${REQUESTS:-100000}
@@ -11,7 +30,6 @@ DATA_SIZE=${DATA_SIZE:-3}
 KEYSPACELEN=${KEYSPACELEN:-1}
 PIPELINE=${PIPELINE:-1}
 CLUSTER=${CLUSTER:-""}
-CSV=${CSV:-"--csv"}
 RUNS_PER_VARIATION=${RUNS_PER_VARIATION:-1}
 
 
@@ -20,17 +38,39 @@ for ARGUMENT in "$@"; do
   KEY=$(echo $ARGUMENT | cut -f1 -d=)
   VALUE=$(echo $ARGUMENT | cut -f2 -d=)
   case "$KEY" in
-  HOSTNAME) HOSTNAME=${VALUE} ;;
+  REDIS_HOST | HOSTNAME) REDIS_HOST=${VALUE} ;;
   PORT) PORT=${VALUE} ;;
   *) ;;
   esac
 
 done
 
-# How many benchmark threads - match num of cores, or default to 8
-THREADS=${THREADS:-$(grep -c ^processor /proc/cpuinfo 2>/dev/null || echo 8)}
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+PIN=${PIN:-1}
+CLIENT_CPUS=""
+CLIENT_THREADS=""
+if [[ "${PIN}" == "1" ]] && command -v taskset >/dev/null; then
+  PLAN=$(PYTHONPATH=${SCRIPT_DIR} python3 -m benchtools.pinning --servers 0 --nic auto)
+  eval "${PLAN}"
+fi
+
+# How many benchmark threads - one per planned core, or match num of cores, or
+# default to 8
+THREADS=${THREADS:-${CLIENT_THREADS:-$(grep -c ^processor /proc/cpuinfo 2>/dev/null || echo 8)}}
 
 OUTPUT_NAME_SUFIX=${OUTPUT_NAME_SUFIX:-""}
+OUTPUT_DIR=${OUTPUT_DIR:-"sweep${OUTPUT_NAME_SUFIX}"}
+SPEC=${SPEC:-""}
+SLO_MS=${SLO_MS:-""}
+INSTANCE_TYPE=${INSTANCE_TYPE:-""}
+STEADY_TOLERANCE=${STEADY_TOLERANCE:-""}
+REPEAT_CI_MAX=${REPEAT_CI_MAX:-""}
+
+# steady runs only measure the average latency, there is no p99 to search on
+if [[ -n "${SLO_MS}" && -n "${STEADY_TOLERANCE}" ]]; then
+  echo "SLO_MS and STEADY_TOLERANCE can not be used together"
+  exit 1
+fi
 
 # All available default tests
 TEST_TYPES_ALL="\
@@ -66,31 +106,49 @@ if [[ -z "${CLI_EXE_FILE_NAME}" ]]; then
   exit 1
 fi
 
-for RUN in $(seq 1 ${RUNS_PER_VARIATION}); do
-  for TEST_NAME in $TEST_TYPES; do
-    FILENAME=${OUTPUT_NAME_SUFIX}_run_${RUN}_test_${TEST_NAME}.txt
-    echo "Running test: $TEST_NAME"
-    echo "  Saving results to file: ${FILENAME}"
-    echo "  Used benchmark command : ${EXE_FILE_NAME} --threads ${THREADS} -e -p ${PORT} -h ${HOSTNAME} -r ${KEYSPACELEN} -c ${CLIENTS} -n ${REQUESTS} -d ${DATA_SIZE} ${CLUSTER} -P ${PIPELINE} -t ${TEST_NAME}"
-    TEE_CMD="tee -a ${FILENAME}"
-    # if [[ "${RUN}" != "1" ]]; then
-    #   TEE_CMD="tee -a >(tail -n 1 > ${FILENAME})"
-    # fi
-
-    ${EXE_FILE_NAME} \
-      --threads ${THREADS} \
-      -e \
-      -p ${PORT} \
-      -h ${HOSTNAME} \
-      -r ${KEYSPACELEN} \
-      -c ${CLIENTS} \
-      -n ${REQUESTS} \
-      -d ${DATA_SIZE} \
-      ${CLUSTER} \
-      ${CSV} \
-      -P ${PIPELINE} \
-      -t ${TEST_NAME} \
-      2>&1 | ${TEE_CMD}
-  done
+OVERRIDES=()
+if [[ -z "${SPEC}" ]]; then
+  SPEC=${OUTPUT_DIR}.spec.json
+  TESTS=$(printf '"%s",' ${TEST_TYPES})
+  cat >${SPEC} <<EOF
+{
+  "host": "${REDIS_HOST:-127.0.0.1}",
+  "port": ${PORT:-6379},
+  "requests": ${REQUESTS},
+  "threads": ${THREADS},
+  "cluster": $([[ -n "${CLUSTER}" ]] && echo true || echo false),
+  "runs": ${RUNS_PER_VARIATION},
+  "steady": $([[ -n "${STEADY_TOLERANCE}" ]] && echo "{\"tolerance\": ${STEADY_TOLERANCE}}" || echo null),
+  "cpus": $([[ -n "${CLIENT_CPUS}" ]] && echo "\"${CLIENT_CPUS}\"" || echo null),
+  "repeat": $([[ -n "${REPEAT_CI_MAX}" ]] && echo "{\"ci_max\": ${REPEAT_CI_MAX}}" || echo null),
+  "redis_benchmark": "${EXE_FILE_NAME}",
+  "redis_cli": "${CLI_EXE_FILE_NAME}",
+  "matrix": {
+    "tests": [${TESTS%,}],
+    "clients": [${CLIENTS}],
+    "pipeline": [${PIPELINE}],
+    "data_size": [${DATA_SIZE}],
+    "keyspace": [${KEYSPACELEN}]
+  }
+}
+EOF
+else
+  if [[ -n "${REDIS_HOST}" ]]; then
+    OVERRIDES+=(--host "${REDIS_HOST}")
+  fi
+  if [[ -n "${PORT}" ]]; then
+    OVERRIDES+=(--port "${PORT}")
+  fi
+fi
 
-done
+if [[ -n "${SLO_MS}" ]]; then
+  echo "Searching the saturation of ${SPEC} under p99 ${SLO_MS} ms, saving results to ${OUTPUT_DIR}"
+  PYTHONPATH=${SCRIPT_DIR} python3 -m benchtools.saturate "${SPEC}" \
+    --output-dir "${OUTPUT_DIR}" "${OVERRIDES[@]}" \
+    --slo "${SLO_MS}" --instance-type "${INSTANCE_TYPE}"
+  exit 0
+fi
+
+echo "Running the sweep of ${SPEC}, saving results to ${OUTPUT_DIR}"
+PYTHONPATH=${SCRIPT_DIR} python3 -m benchtools.sweep "${SPEC}" \
+  --output-dir "${OUTPUT_DIR}" "${OVERRIDES[@]}"
@@ -4,10 +4,23 @@ sudo apt install build-essential tcl pkg-config -y
 gcc --version
 rm -rf redis-stable.tar.gz
 rm -rf redis-stable
-curl -O http://download.redis.io/redis-stable.tar.gz
+# install-redis-source.sh ships the tarball from the node artifact cache
+if [ -f /tmp/redis-stable.tar.gz ]; then
+    cp /tmp/redis-stable.tar.gz .
+else
+    curl -O http://download.redis.io/redis-stable.tar.gz
+fi
 tar xzvf redis-stable.tar.gz
 cd redis-stable 
 make -j 
 sudo make install
-taskset -c 0 redis-server --save '' --requirepass performance.redis --port 16379 --daemonize yes --protected-mode no
+# pin redis-server to a whole core of the NUMA node of the NIC and the NIC IRQs
+# to another one (irqbalance would move them back), see
+# scripts/benchtools/pinning.py, shipped as /tmp/pinning.py
+SERVER_CPUS=(0)
+if [ -f /tmp/pinning.py ]; then
+    systemctl stop irqbalance 2>/dev/null
+    eval "$(python3 /tmp/pinning.py --servers 1 --nic auto --apply-irqs)"
+fi
+taskset -c ${SERVER_CPUS[0]} redis-server --save '' --requirepass performance.redis --port 16379 --daemonize yes --protected-mode no
 redis-cli -p 16379 -a performance.redis ping
@@ -6,8 +6,9 @@ set -e
 
 USER=ubuntu
 PEM=${PEM:-"~/redislabs/pems/perf-ci.pem"}
+RUNS=${RUNS:-3}
 
-mkdir -p ./results-final
+FETCH=""
 
 for CLIENT_N in `seq 1 16`; do 
     eip=B_M$CLIENT_N\_E
@@ -20,7 +21,9 @@ for CLIENT_N in `seq 1 16`; do
     LOGNAME="$VM_TYPE-priority-10.log"
     echo "*************************************************************************************"
     # --override-memtier-test-time 10  
-    CMD="redis-benchmarks-spec-client-runner --override-test-runs 3 --flushall_on_every_test_start --tests-priority-upper-limit 10 --db_server_host $DB_HOST --db_server_port 16379 --db_server_password performance.redis  2>&1 > /home/ubuntu/$LOGNAME"
+    # the suite runs $RUNS times, appending to the log, so every run of a test
+    # shows up in it (memtier --run-count only reports best/worst/average)
+    CMD="for RUN in $(seq -s ' ' $RUNS); do redis-benchmarks-spec-client-runner --override-test-runs 1 --flushall_on_every_test_start --tests-priority-upper-limit 10 --db_server_host $DB_HOST --db_server_port 16379 --db_server_password performance.redis --defaults_filename /home/ubuntu/defaults.yml  2>&1 >> /home/ubuntu/$LOGNAME; done"
     echo "Working on host: $IP"
     echo "Benchmark will be done on DB host ($VM_TYPE): $DB_HOST"
     echo "logname: $LOGNAME"
@@ -28,6 +31,7 @@ for CLIENT_N in `seq 1 16`; do
     echo "/////////////////////////////////////////////////////////////////////////////////////"
     # ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} sudo redis-benchmarks-spec-client-runner --help
     # scp -o "StrictHostKeyChecking no" -i ${PEM} install-redisbench.sh ${USER}@${IP}:/tmp/i.sh
+    # scp -o "StrictHostKeyChecking no" -i ${PEM} defaults.yml ${USER}@${IP}:/home/ubuntu/defaults.yml
     # ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} sudo /tmp/i.sh
     # ssh -tt -i ${PEM} ${USER}@${IP} sudo "echo $CMD > /home/ubuntu/run.sh"
     # ssh -tt -i ${PEM} ${USER}@${IP} sudo chmod 755 /home/ubuntu/run.sh
@@ -40,12 +44,30 @@ for CLIENT_N in `seq 1 16`; do
     # ssh -t -i ${PEM} ${USER}@${IP} sudo docker ps 
     # ssh -t -i ${PEM} ${USER}@${IP} rm -rf /home/ubuntu/$LOGNAME
     # ssh -f -i ${PEM} ${USER}@${IP} sudo $CMD &
-    scp -i ${PEM} ${USER}@${IP}:/home/ubuntu/$LOGNAME ./results-final/$LOGNAME
+    FETCH="$FETCH --fetch $IP:/home/ubuntu/$LOGNAME"
     # ssh -t -i ${PEM} ${USER}@${IP} cat /home/ubuntu/$LOGNAME
     echo "*************************************************************************************"
 #    ssh -o "StrictHostKeyChecking no" -i ${PEM} -tt ${USER}@${IP} sudo screen -S benchmark "'$CMD'" &
     #ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} sudo redis-benchmarks-spec-client-runner --flushall_on_every_test_start --flushall_on_every_test_end --dry-run --tests-priority-upper-limit 1 --db_server_host $DB_HOST --db_server_port 16379 --db_server_password performance.redis --override-memtier-test-time 1 
 done
 
+# fetch the results of all the clients at once, compressed on the wire,
+# resuming partial transfers and skipping the ones that did not change
+PYTHONPATH=../../scripts python3 -m benchtools.collect \
+    --pem ${PEM} --user ${USER} --dest ./results-final $FETCH
+
+# or, instead of $RUNS passes of the whole suite, pass again only over the
+# tests whose median ops/sec is not known to within 10% yet, at most $RUNS
+# times: start with TESTS=".*", run $CMD with --tests-regexp "$TESTS" on every
+# client and collect, then
+# TESTS=$(PYTHONPATH=../../scripts python3 -m benchtools.repeat \
+#     --results-dir ./results-final --max-runs ${RUNS} --regexp)
+# until it prints nothing
+
+# while the sweep runs, follow it instead: one row per completed test as it
+# completes, and the hosts that stop completing tests are reported
+# PYTHONPATH=../../scripts python3 -m benchtools.follow \
+#     --pem ${PEM} --user ${USER} --output ./results-live.csv ${FETCH//--fetch/--follow}
+
 # wait
 
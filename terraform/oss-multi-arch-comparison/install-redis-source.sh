@@ -7,11 +7,25 @@ set -e
 USER=ubuntu
 PEM=${PEM:-"~/redislabs/pems/perf-ci.pem"}
 
+# download redis-stable once and relay it between the nodes, nodes that already
+# hold the same tarball in their artifact cache skip the transfer
+# curl -z redis-stable.tar.gz -O http://download.redis.io/redis-stable.tar.gz
+# NODES=""
+# for CLIENT_N in `seq 1 16`; do
+#     eip=REDIS_$CLIENT_N\_E
+#     iip=REDIS_$CLIENT_N\_INTERNAL_IP
+#     NODES="$NODES --node ${!eip}:${!iip}"
+# done
+# PYTHONPATH=../../scripts python3 -m benchtools.distribute --pem ${PEM} $NODES \
+#     redis-stable.tar.gz:/tmp/redis-stable.tar.gz build-redis.sh:/tmp/i.sh \
+#     ../../scripts/benchtools/pinning.py:/tmp/pinning.py
+
 for CLIENT_N in `seq 1 16`; do 
     eip=REDIS_$CLIENT_N\_E
     IP="${!eip}"
     echo "Working on host: $IP"
     # scp -o "StrictHostKeyChecking no"  -i ${PEM} build-redis.sh ${USER}@${IP}:/tmp/i.sh
+    # scp -o "StrictHostKeyChecking no"  -i ${PEM} ../../scripts/benchtools/pinning.py ${USER}@${IP}:/tmp/pinning.py
     # ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} sudo /tmp/i.sh
     ssh -o "StrictHostKeyChecking no" -i ${PEM} -t ${USER}@${IP} redis-cli -p 16379 -a performance.redis ping
 done
@@ -1,6 +1,13 @@
-import json
-import paramiko
-import concurrent.futures
+import asyncio
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../scripts")
+)
+
+from benchtools.remote import fan_out, print_summary
+from benchtools.sshpool import SSHPool
 
 
 public_ips = [
@@ -44,32 +51,6 @@ public_ips = {
 pkey = "/home/fco/redislabs/pems/perf-ci.pem"
 
 
-def host_work(public_ip, cmds_array, pkey):
-    print("connecting to {}".format(public_ip))
-    # Create an SSH client
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # Load the .pem file
-    pem = paramiko.RSAKey.from_private_key_file(pkey)
-
-    # Connect to the host
-    client.connect(public_ip, username="ubuntu", pkey=pem)
-    print(public_ip)
-    for cmd in cmds_array:
-
-        # Run the command
-        stdin, stdout, stderr = client.exec_command(cmd)
-
-        # Print the command output
-        print(stderr.read().decode())
-        # Print the command output
-        print(stdout.read().decode())
-
-    # Close the connection
-    client.close()
-
-
 # cmds = """sudo apt update -y
 # sudo apt install python3-pip -y
 # sudo pip3 install --upgrade pip
@@ -84,7 +65,8 @@ def host_work(public_ip, cmds_array, pkey):
 
 cmds = {}
 for h, db_ip in public_ips.items():
-    cmd_1 = "sudo /home/ubuntu/.local/bin/redis-benchmarks-spec-client-runner --preserve_temporary_client_dirs --flushall_on_every_test_start --db_server_host {}  --db_server_port 16379 --tests-priority-upper-limit 10 > /home/ubuntu/benchmark.log".format(
+    # pipefail, so that the step reports the runner exit code and not tee's
+    cmd_1 = "set -o pipefail; sudo /home/ubuntu/.local/bin/redis-benchmarks-spec-client-runner --preserve_temporary_client_dirs --flushall_on_every_test_start --db_server_host {}  --db_server_port 16379 --tests-priority-upper-limit 10 2>&1 | tee /home/ubuntu/benchmark.log".format(
         db_ip
     )
     cmd = []
@@ -96,12 +78,10 @@ for h, db_ip in public_ips.items():
     cmds[h] = cmd
 
 
-# Use a concurrent.futures.ThreadPoolExecutor to run the commands concurrently
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    # Submit the run_command function for each host and command
-    futures = [
-        executor.submit(host_work, host, cmds[host], pkey) for host in public_ips.keys()
-    ]
-
-    # Wait for all the tasks to complete
-    concurrent.futures.wait(futures)
+# The benchmark output of every client is streamed as it is produced into
+# ./client-logs/<host>/<NN>-<cmd>.log, so the progress can be followed with tail -f
+with SSHPool(pkey) as pool:
+    results = asyncio.run(
+        fan_out(pool, cmds, timeout=24 * 60 * 60, log_dir="./client-logs")
+    )
+print_summary(results)
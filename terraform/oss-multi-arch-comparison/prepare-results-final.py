@@ -1,3 +1,12 @@
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../scripts")
+)
+
+from benchtools import compare, memtier, stats
+
 aws = {'m5.large': 745, 'r5.4xlarge': 236, 'c5.xlarge': 761, 'm5.xlarge': 281, 'i3.8xlarge': 90, 'r5.2xlarge': 346, 'm5.24xlarge': 27, 'c5.2xlarge': 168, 'm4.10xlarge': 2, 'r5.8xlarge': 139, 'm5.2xlarge': 86, 'r5.xlarge': 144, 'r5.12xlarge': 16, 'm5.16xlarge': 16, 'm5.4xlarge': 38, 'c5.4xlarge': 137, 'r5.16xlarge': 52, 'm5.12xlarge': 6, 'i3.4xlarge': 121, 'r5n.4xlarge': 2, 'm5.8xlarge': 9, 'm4.large': 9, 'i3.2xlarge': 62, 'r5.24xlarge': 35, 'c5n.4xlarge': 20, 'c4.xlarge': 16, 'c5.9xlarge': 37, 'r5n.24xlarge': 14, 'c5n.9xlarge': 12, 'm4.xlarge': 2, 'r5n.12xlarge': 5, 'c5n.2xlarge': 9, 'r5n.8xlarge': 2, 'c5.12xlarge': 37, 'r4.8xlarge': 5, 'r4.2xlarge': 5, 'c5.18xlarge': 10, 'c4.4xlarge': 2}
 
 for vm,count in aws.items():
@@ -43,13 +52,21 @@ tests = [
 "memtier_benchmark-1Mkeys-string-get-1KiB-pipeline-10"
 ]
 
-for test in tests:
-    for vm in vms:
-        filename = "{}-priority-10.log".format(vm)
-        with open ("./results-final-cleaned/"+filename,"r") as fd:
-            lines = fd.readlines()
-            for line in lines:
-                if test in line:
-                    v = line.split("|")[3].strip()
-                    #print("{},{},{}".format (test,vm,v) )
-                    break
\ No newline at end of file
+# each log is read once, the (test, vm, run) matrix comes from the index
+index = memtier.build_index("./results-final", "-priority-10.log")
+results = memtier.Results.from_index(index, tests, vms)
+with open("final_10.csv", "w") as fd:
+    memtier.write_csv(fd, results)
+
+# median and confidence interval of the runs of every cell, with the ones
+# whose runs are too spread out to be compared flagged as unstable
+with open("final_10_stats.csv", "w") as fd:
+    stats.write_csv(fd, stats.aggregate(results, ["ops_sec", "p99_ms"]))
+
+# every vm against the previous generation c5, per vCPU and per dollar
+tests, vms, tables, ranking = compare.compare(
+    results, "ops_sec", "c5.2xlarge", compare.load_catalog(), tests, vms
+)
+with open("final_10_compare.csv", "w") as fd:
+    compare.write_csv(fd, tests, vms, tables)
+compare.print_ranking(ranking, "per_dollar")
@@ -4,16 +4,26 @@ source ips.sh
 # exit immediately on error
 set -e
 
-mkdir -p ./results-final-cleaned
+# parse every log under ./results-final at once, one process per core, into
+# a single (test, vm, run) CSV with all the memtier metrics
+PYTHONPATH=../../scripts python3 -m benchtools.memtier \
+    --results-dir ./results-final --output ./results-final.csv
 
-for CLIENT_N in `seq 1 16`; do 
-    vmtype=REDIS_VM_$CLIENT_N
-    VM_TYPE="${!vmtype}"
-    LOGNAME="$VM_TYPE-priority-10.log"
-    echo "*************************************************************************************"
-    cat ./results-final/$LOGNAME | grep memtier | grep AGGREGATED | grep Ops > ./results-final-cleaned/$LOGNAME
-    echo "*************************************************************************************"
-done
+# and append them to the long-lived results store, tagged with the setup_name
+# of this setup and the github_sha terraform variable
+PYTHONPATH=../../scripts python3 -m benchtools.store \
+    --store ${RESULTS_STORE:-~/results-store} ingest \
+    --results-dir ./results-final --setup-dir .
+
+# push the new ingests to the RedisTimeSeries datasink, when there is one
+if [ -n "${DATASINK_RTS_HOST}" ]; then
+    PYTHONPATH=../../scripts python3 -m benchtools.rts \
+        --store ${RESULTS_STORE:-~/results-store}
+fi
+
+# then report the regressions and improvements this harvest brought in
+PYTHONPATH=../../scripts python3 -m benchtools.changepoint \
+    --store ${RESULTS_STORE:-~/results-store} --output ./changepoints.csv
 
 # wait
 
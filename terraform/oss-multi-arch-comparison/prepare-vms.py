@@ -1,6 +1,13 @@
+import asyncio
 import json
-import paramiko
-import concurrent.futures
+import os
+import sys
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from benchtools.remote import LinePrinter, fan_out, print_summary
+from benchtools.sshpool import SSHPool
 
 
 pkey = "/home/fco/redislabs/pems/perf-ci.pem"
@@ -10,36 +17,6 @@ with open("public_ips.json", "r") as json_fd:
     public_ips = json.load(json_fd)
 
 
-def host_work(public_ip, cmds_array, pkey):
-
-    print("connecting to {}".format(public_ip))
-    try:
-        # Create an SSH client
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # Load the .pem file
-        pem = paramiko.RSAKey.from_private_key_file(pkey)
-
-        # Connect to the host
-        client.connect(public_ip, username="ubuntu", pkey=pem)
-        print(public_ip)
-        for cmd in cmds_array:
-
-            # Run the command
-            stdin, stdout, stderr = client.exec_command(cmd)
-
-            # Print the command output
-            print(stderr.read().decode())
-            # Print the command output
-            print(stdout.read().decode())
-
-        # Close the connection
-        client.close()
-    except paramiko.ssh_exception.SSHException as e:
-     print("Error on {}. {}".format(public_ip,e))
-
-
 cmds = """sudo apt update -y
 sudo apt install build-essential tcl pkg-config -y
 gcc --version
@@ -48,26 +25,38 @@ rm -rf redis-stable
 curl -O http://download.redis.io/redis-stable.tar.gz
 tar xzvf redis-stable.tar.gz
 cd redis-stable && make -j && sudo make install
-taskset -c 0 redis-server --save '' --requirepass performance.redis --port 16379 --daemonize yes --protected-mode no
+eval "$(python3 /tmp/pinning.py --servers 1 || echo SERVER_CPUS=0)"
+taskset -c ${SERVER_CPUS[0]} redis-server --save '' --requirepass performance.redis --port 16379 --daemonize yes --protected-mode no
 redis-cli -p 16379 -a performance.redis ping"""
 
 cmds = """redis-cli -p 16379 -a performance.redis ping"""
 
 cmds = """pkill -9 redis-server
-taskset -c 0 redis-server --save '' --port 16379 --daemonize yes --protected-mode no --requirepass performance.redis 
+eval "$(python3 /tmp/pinning.py --servers 1 || echo SERVER_CPUS=0)"
+taskset -c ${SERVER_CPUS[0]} redis-server --save '' --port 16379 --daemonize yes --protected-mode no --requirepass performance.redis 
 redis-cli -p 16379 -a performance.redis ping"""
 
 cmds = """sudo pkill -9 redis-server"""
 
 cmds_array = cmds.split("\n")
 
-# Use a concurrent.futures.ThreadPoolExecutor to run the commands concurrently
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    # Submit the run_command function for each host and command
-    futures = [
-        executor.submit(host_work, host, cmds_array, pkey)
-        for host in public_ips.values()
-    ]
-
-    # Wait for all the tasks to complete
-    concurrent.futures.wait(futures)
+# The lines of cmds run as one script per host, in a single channel, so the
+# shell state carries over between them; the exit code of each line is reported
+printer = LinePrinter()
+with SSHPool(pkey) as pool:
+    # the commands eval the CPU plan of /tmp/pinning.py, ship it first
+    with open(os.path.join(SCRIPTS_DIR, "benchtools", "pinning.py"), "rb") as fd:
+        shipped = pool.upload(public_ips.values(), "/tmp/pinning.py", fd.read())
+    for host, status in sorted(shipped.items()):
+        if status != 0:
+            print("Error on {}. pinning.py not shipped: {}".format(host, status))
+    results = asyncio.run(
+        fan_out(
+            pool,
+            {host: cmds_array for host in public_ips.values()},
+            on_output=printer,
+            batch=True,
+        )
+    )
+printer.flush()
+print_summary(results)
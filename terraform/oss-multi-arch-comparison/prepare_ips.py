@@ -1,13 +1,17 @@
-import subprocess
 import json
+import os
+import sys
 
-# Run the "terraform output json" command
-output = subprocess.run(["terraform", "output", "-json"], stdout=subprocess.PIPE)
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(setup_dir, "../../scripts"))
 
-output_json = json.loads(output.stdout.decode())
+from benchtools.prepare_ips import load_outputs
+
+# Read the outputs from the local state, or "terraform output -json" for remote ones
+output_json = load_outputs(setup_dir)
 cleaned_json = {}
 for keyn, keyv in output_json.items():
-    v = keyv["value"][0]
+    v = keyv[0]
     if "public_ip" in keyn and "client" not in keyn:
         f = keyn.find("_")
         s = keyn[f + 1 :].find("_")
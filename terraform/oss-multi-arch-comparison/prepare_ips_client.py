@@ -1,14 +1,18 @@
-import subprocess
 import json
+import os
+import sys
 
-# Run the "ls" command
-output = subprocess.run(["terraform", "output", "-json"], stdout=subprocess.PIPE)
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(setup_dir, "../../scripts"))
 
-output_json = json.loads(output.stdout.decode())
+from benchtools.prepare_ips import load_outputs
+
+# Read the outputs from the local state, or "terraform output -json" for remote ones
+output_json = load_outputs(setup_dir)
 cleaned_json = {}
 db_json = {}
 for keyn, keyv in output_json.items():
-    v = keyv["value"][0]
+    v = keyv[0]
     f = keyn.find("_")
     s = keyn[f + 1 :].find("_")
     vm = keyn[: s + f + 1].replace("_", ".")
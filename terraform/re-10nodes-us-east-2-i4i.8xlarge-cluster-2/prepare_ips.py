@@ -1,25 +1,10 @@
-import subprocess
-import json
+import os
+import sys
 
-# Run the "terraform output json" command
-output = subprocess.run(["terraform", "output", "-json"], stdout=subprocess.PIPE)
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(setup_dir, "../../scripts"))
 
-output_json = json.loads(output.stdout.decode())
-total_nodes = len(output_json['server_private_ip']['value'])
-ssh_user = output_json['server_ssh_user']['value']
-prefix="perf-cto-RE-"
-prefix=""
-cluster_name = output_json['setup_name']['value'][len(prefix):].replace(".","_")
+from benchtools.prepare_ips import main
 
-print("#!/bin/bash\n")
-print("TOTAL_NODES={}\n".format(total_nodes))
-print("USER={}\n".format(ssh_user))
-print("CLUSTER_NAME=\"{}\"\n".format(cluster_name))
-print("\n#internal IP addresses")
-cleaned_json = {}
-for keyn, v in enumerate(output_json['server_private_ip']['value'],start=1):
-    print("B_M{}_I={}".format(keyn,v))
-
-print("\n#external IP addresses")
-for keyn, v in enumerate(output_json['server_public_ip']['value'],start=1):
-    print("B_M{}_E={}".format(keyn,v))
\ No newline at end of file
+args = ["--dir", setup_dir, "--normalize", "dots"]
+sys.exit(main(args + sys.argv[1:]))
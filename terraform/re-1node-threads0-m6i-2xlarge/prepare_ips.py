@@ -1,30 +1,15 @@
-import subprocess
-import json
+import os
+import sys
 
-# Run the "terraform output json" command
-output = subprocess.run(["terraform", "output", "-json"], stdout=subprocess.PIPE)
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(setup_dir, "../../scripts"))
 
-output_json = json.loads(output.stdout.decode())
-total_nodes = len(output_json['server_private_ip']['value'])
-search_threads = output_json['search_threads']['value']
+from benchtools.prepare_ips import main
 
-print("#!/bin/bash\n")
-print("TOTAL_NODES={}\n".format(total_nodes))
-print("SEARCH_THREADS={}\n".format(search_threads))
-
-print("CLUSTER_NAME=\"{}_{}_threads\"\n".format(output_json['server_instance_type']['value'].replace(".","_"),search_threads))
-
-print("\n#client external IP addresses")
-if 'client_public_ip' in output_json:
-    print("CLIENT_E={}\n".format(output_json['client_public_ip']['value']))
-else:
-    print("\n")
-
-print("\n#internal IP addresses")
-cleaned_json = {}
-for keyn, v in enumerate(output_json['server_private_ip']['value'],start=1):
-    print("B_M{}_I={}".format(keyn,v))
-
-print("\n#external IP addresses")
-for keyn, v in enumerate(output_json['server_public_ip']['value'],start=1):
-    print("B_M{}_E={}".format(keyn,v))
\ No newline at end of file
+args = [
+    "--dir",
+    setup_dir,
+    "--cluster-name",
+    "{instance_type}_{search_threads}_threads",
+]
+sys.exit(main(args + sys.argv[1:]))